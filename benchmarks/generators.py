@@ -0,0 +1,114 @@
+"""
+Synthetic heatmap data for the benchmarks.
+
+Writes data directories in the CSV format of server/data, with polygons and safe places
+scattered around a city center.
+"""
+
+import csv
+import math
+import os
+import random
+
+CENTER = (9.1800, 48.7780)  # (longitude, latitude), Stuttgart like server/data
+SPREAD_DEG = 0.05  # about 4 km around the center
+POLYGON_RADIUS_DEG = 0.0008  # about 60 m
+
+
+def random_polygon(rng, center, radius, vertices):
+    """
+    Returns a closed polygon around a center.
+
+    Random angles can leave a gap of more than 180 degrees between two vertices, so some
+    rings self-intersect. They are kept on purpose, like the invalid polygons users draw.
+    """
+    angles = sorted(rng.uniform(0, 2 * math.pi) for _ in range(vertices))
+    ring = []
+    for angle in angles:
+        distance = radius * rng.uniform(0.5, 1.0)
+        ring.append(
+            [center[0] + math.cos(angle) * distance, center[1] + math.sin(angle) * distance]
+        )
+    ring.append(ring[0])
+    return ring
+
+
+def random_point(rng, spread=SPREAD_DEG):
+    """
+    Returns a random (longitude, latitude) point around the center.
+    """
+    return [
+        CENTER[0] + rng.uniform(-spread, spread),
+        CENTER[1] + rng.uniform(-spread, spread) * 0.66,
+    ]
+
+
+def generate_data_dir(
+    path,
+    polygons,
+    safe_places=None,
+    preferred=None,
+    vertices=10,
+    seed=0,
+):
+    """
+    Writes a synthetic heatmap data directory.
+
+    Parameters:
+    ----------
+    path : str
+        The directory to write, created if missing
+    polygons : int
+        Number of bad polygons
+    safe_places : int, optional
+        Number of safe places (default: polygons // 10, at least 10)
+    preferred : int, optional
+        Number of preferred polygons (default: polygons // 20, at least 1)
+    vertices : int, optional
+        Number of vertices per polygon, before closing it (default: 10)
+    seed : int, optional
+        Seed of the random generator (default: 0)
+
+    Returns:
+    ----------
+    str
+        The path of the directory.
+    """
+    rng = random.Random(seed)
+    if safe_places is None:
+        safe_places = max(10, polygons // 10)
+    if preferred is None:
+        preferred = max(1, polygons // 20)
+    os.makedirs(path, exist_ok=True)
+
+    def write_polygons(file_name, count):
+        with open(os.path.join(path, file_name), mode="w", newline="", encoding="utf-8") as file:
+            writer = csv.writer(file)
+            for _ in range(count):
+                writer.writerows(
+                    random_polygon(rng, random_point(rng), POLYGON_RADIUS_DEG, vertices)
+                )
+                writer.writerow([])
+
+    write_polygons("heatmap_coords.csv", polygons)
+    write_polygons("preferred_coords.csv", preferred)
+    with open(os.path.join(path, "safety_scores.csv"), mode="w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        for _ in range(polygons):
+            writer.writerow([round(rng.uniform(0.01, 0.9), 2)])
+    with open(os.path.join(path, "safe_place_coords.csv"), mode="w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        for _ in range(safe_places):
+            writer.writerow(random_point(rng))
+    return path
+
+
+def random_od_pairs(count, seed=1, spread=SPREAD_DEG / 2):
+    """
+    Returns random (origin, destination) coordinate strings in the "lng,lat" format of /route.
+    """
+    rng = random.Random(seed)
+    return [
+        tuple(",".join(map(str, random_point(rng, spread))) for _ in range(2))
+        for _ in range(count)
+    ]
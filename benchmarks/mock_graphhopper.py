@@ -0,0 +1,184 @@
+"""
+Local stand-in for the GraphHopper API used by the benchmarks.
+
+Serves /route, /matrix and /geocode with a configurable latency and synthetic results, so
+the server can be benchmarked without network access or API quota. Route geometry is a
+polyline through the requested points with intermediate vertices every few meters, and
+distances are the haversine length of that polyline times a detour factor.
+
+Run standalone with:  python benchmarks/mock_graphhopper.py --port 8989 --latency-ms 50
+"""
+
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DETOUR_FACTOR = 1.3  # road distance relative to the straight line
+VERTEX_SPACING_M = 25.0
+
+
+def haversine_m(a, b):
+    """
+    Returns the great-circle distance in meters between two (longitude, latitude) points.
+    """
+    lon1, lat1, lon2, lat2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * 6371008.8 * math.asin(math.sqrt(h))
+
+
+def synthetic_path(points):
+    """
+    Returns a GraphHopper-like path through the points with interpolated vertices.
+    """
+    coordinates = [list(points[0])]
+    distance = 0.0
+    for a, b in zip(points, points[1:]):
+        length = haversine_m(a, b)
+        steps = max(1, int(length / VERTEX_SPACING_M))
+        for step in range(1, steps + 1):
+            t = step / steps
+            coordinates.append([a[0] + (b[0] - a[0]) * t, a[1] + (b[1] - a[1]) * t])
+        distance += length * DETOUR_FACTOR
+    return {
+        "distance": distance,
+        "time": int(distance / 1.4 * 1000),
+        "points": {"type": "LineString", "coordinates": coordinates},
+    }
+
+
+class MockGraphHopper:
+    """
+    MockGraphHopper class.
+
+    A threaded HTTP server answering like the GraphHopper API.
+
+    Attributes:
+    ----------
+    latency_s : float
+        Mean added latency of every response in seconds.
+    jitter_s : float
+        Maximum random deviation from the mean latency in seconds.
+    calls : dict
+        Number of calls per path.
+    request_bytes : int
+        Total size of the request bodies received.
+
+    Methods:
+    ----------
+    start() : MockGraphHopper
+        Starts serving on a background thread.
+    stop() : None
+        Stops the server.
+    reset() : None
+        Resets the counters.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency_s=0.05, jitter_s=0.0):
+        self.latency_s = latency_s
+        self.jitter_s = jitter_s
+        self.calls = {}
+        self.request_bytes = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        with self._lock:
+            self.calls = {}
+            self.request_bytes = 0
+
+    def _record(self, path, size):
+        with self._lock:
+            self.calls[path] = self.calls.get(path, 0) + 1
+            self.request_bytes += size
+
+    def _sleep(self):
+        delay = self.latency_s + random.uniform(-self.jitter_s, self.jitter_s)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, body, status=200):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                size = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(size))
+                path = self.path.split("?")[0]
+                mock._record(path, size)
+                mock._sleep()
+                if path == "/route":
+                    points = [[float(lon), float(lat)] for lon, lat in body["points"]]
+                    self._send({"paths": [synthetic_path(points)]})
+                elif path == "/matrix":
+                    self._send(
+                        {
+                            "distances": [
+                                [haversine_m(a, b) * DETOUR_FACTOR for b in body["to_points"]]
+                                for a in body["from_points"]
+                            ]
+                        }
+                    )
+                else:
+                    self._send({"message": f"Unknown path {path}"}, status=404)
+
+            def do_GET(self):
+                path = self.path.split("?")[0]
+                mock._record(path, 0)
+                mock._sleep()
+                if path == "/geocode":
+                    self._send({"hits": [], "took": 1})
+                else:
+                    self._send({"message": f"Unknown path {path}"}, status=404)
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8989)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    mock = MockGraphHopper(
+        args.host, args.port, args.latency_ms / 1000, args.jitter_ms / 1000
+    )
+    print(f"Mock GraphHopper listening on {mock.base_url}")
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        mock.stop()
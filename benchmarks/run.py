@@ -0,0 +1,237 @@
+"""
+Benchmark suite of the WeLai server.
+
+Runs the scenarios below against synthetic heatmaps of increasing size and a local
+GraphHopper stand-in (see mock_graphhopper.py), and writes the results as JSON so they can
+be compared across versions.
+
+Scenarios:
+----------
+startup
+    Loading the data directory: CSV import and memory-mapped binary snapshot, and building
+    the spatial index.
+heatmap
+    Encoding the /heatmap payload (cold and cached), compressing it and building a map tile.
+edit
+    Journaled polygon edits as acknowledged by /add_polygon, alone and together with
+    re-encoding the full /heatmap payload.
+route
+    End-to-end get_route latency and upstream calls per detour mode.
+
+Usage:
+------
+    python benchmarks/run.py --scales 10,100,1000,10000 --output bench.json
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "server"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generators import (  # noqa: E402
+    CENTER,
+    generate_data_dir,
+    random_od_pairs,
+    random_point,
+    random_polygon,
+)
+from mock_graphhopper import MockGraphHopper  # noqa: E402
+from services.geostore import GeoStore  # noqa: E402
+from services.heatmap import Heatmap  # noqa: E402
+from services.webcrawler import WebCrawler  # noqa: E402
+
+SCENARIOS = ("startup", "heatmap", "edit", "route")
+
+
+def summarize(samples):
+    """
+    Returns summary statistics in milliseconds of timings in seconds.
+    """
+    milliseconds = np.asarray(samples) * 1000
+    return {
+        "n": len(samples),
+        "meanMs": float(milliseconds.mean()),
+        "p50Ms": float(np.percentile(milliseconds, 50)),
+        "p95Ms": float(np.percentile(milliseconds, 95)),
+        "maxMs": float(milliseconds.max()),
+    }
+
+
+def timed(function, *args, **kwargs):
+    """
+    Returns the result of a call and its duration in seconds.
+    """
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def center_tile(z):
+    """
+    Returns the (z, x, y) coordinates of the map tile at the center of the synthetic data.
+    """
+    n = 2**z
+    lon, lat = CENTER
+    x = int((lon + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return z, x, y
+
+
+def bench_startup(data_dir, scale, args):
+    store, csv_seconds = timed(GeoStore, data_dir)
+    _, index_seconds = timed(lambda: store.snapshot.heatmap_index)
+    store.close()
+    store, mmap_seconds = timed(GeoStore, data_dir)
+    store.close()
+    return {
+        "csvImportMs": csv_seconds * 1000,
+        "mmapLoadMs": mmap_seconds * 1000,
+        "heatmapIndexMs": index_seconds * 1000,
+    }
+
+
+def bench_heatmap(data_dir, scale, args):
+    heatmap = Heatmap(data_dir)
+    payload, cold_seconds = timed(heatmap.get_heatmap_payload)
+    warm = [timed(heatmap.get_heatmap_payload)[1] for _ in range(args.repeat)]
+    gzip_body, gzip_seconds = timed(payload.encoded, "gzip")
+
+    tile = center_tile(14)
+    tile_payload, tile_seconds = timed(heatmap.get_heatmap_tile, *tile)
+    heatmap.store.close()
+    return {
+        "payloadBytes": len(payload.body),
+        "gzipBytes": len(gzip_body),
+        "coldEncodeMs": cold_seconds * 1000,
+        "cachedEncode": summarize(warm),
+        "gzipMs": gzip_seconds * 1000,
+        "tileBytes": len(tile_payload.body),
+        "tileBuildMs": tile_seconds * 1000,
+    }
+
+
+def bench_edit(data_dir, scale, args):
+    rng = random.Random(2)
+    heatmap = Heatmap(data_dir)
+    add = []
+    add_and_encode = []
+    for i in range(args.edits):
+        polygon = random_polygon(rng, random_point(rng), 0.0005, 6)[:-1]
+        _, seconds = timed(heatmap.add_and_save_new_polygon, polygon, 0.3)
+        add.append(seconds)
+        _, encode_seconds = timed(heatmap.get_heatmap_payload)
+        add_and_encode.append(seconds + encode_seconds)
+    heatmap.store.close()
+    return {
+        "add": summarize(add),
+        "addAndEncode": summarize(add_and_encode),
+        "editsPerSecond": len(add) / sum(add),
+    }
+
+
+def bench_route(data_dir, scale, args):
+    results = {}
+    pairs = random_od_pairs(args.routes)
+    for mode in args.detour_modes:
+        mock = MockGraphHopper(latency_s=args.latency_ms / 1000).start()
+        crawler = WebCrawler(data_dir, api_base_url=mock.base_url, detour_mode=mode)
+        # Compile the custom model outside of the measurement, like a warm server
+        crawler.get_custom_model()
+        latencies = [timed(crawler.get_route, o, d, "foot")[1] for o, d in pairs]
+        cached = [timed(crawler.get_route, o, d, "foot")[1] for o, d in pairs]
+        results[mode] = {
+            "latency": summarize(latencies),
+            "cachedLatency": summarize(cached),
+            "upstreamCallsPerRoute": {
+                path: calls / len(pairs) for path, calls in mock.calls.items()
+            },
+            "upstreamRequestBytesPerRoute": mock.request_bytes / len(pairs),
+        }
+        # Shuts down the thread pools too, so no threads leak into the next mode
+        crawler.close()
+        crawler.store.close()
+        mock.stop()
+    return results
+
+
+BENCHMARKS = {
+    "startup": bench_startup,
+    "heatmap": bench_heatmap,
+    "edit": bench_edit,
+    "route": bench_route,
+}
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark suite of the WeLai server")
+    parser.add_argument("--scales", default="10,100,1000,10000",
+                        help="comma separated numbers of heatmap polygons (e.g. 10,100,1000,10000,100000)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"comma separated scenarios out of {', '.join(SCENARIOS)}")
+    parser.add_argument("--latency-ms", type=float, default=50.0,
+                        help="latency of the GraphHopper stand-in in milliseconds")
+    parser.add_argument("--routes", type=int, default=20, help="routes per detour mode")
+    parser.add_argument("--detour-modes", default="routes,matrix",
+                        help="comma separated detour modes of the route scenario")
+    parser.add_argument("--edits", type=int, default=100, help="polygon edits of the edit scenario")
+    parser.add_argument("--repeat", type=int, default=20, help="repetitions of cached measurements")
+    parser.add_argument("--output", help="file to write the JSON results to (default: stdout)")
+    args = parser.parse_args()
+    args.detour_modes = args.detour_modes.split(",")
+    scenarios = args.scenarios.split(",")
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "latencyMs": args.latency_ms,
+        },
+        "results": [],
+    }
+    work_dir = tempfile.mkdtemp(prefix="welai-bench-")
+    try:
+        for scale in map(int, args.scales.split(",")):
+            for scenario in scenarios:
+                # Every scenario starts from a fresh copy without snapshot or journal
+                data_dir = generate_data_dir(os.path.join(work_dir, f"{scale}-{scenario}"), scale)
+                print(f"Running {scenario} with {scale} polygons...", file=sys.stderr)
+                result = BENCHMARKS[scenario](data_dir, scale, args)
+                report["results"].append({"scenario": scenario, "polygons": scale, **result})
+                shutil.rmtree(data_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, mode="w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
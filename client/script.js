@@ -14,14 +14,17 @@ const map = L.map('mapContainer').setView([52.5, 13.4], 16);
 
 let debounceTimer;
 
-let heatmapPolygonCoords = [];
-let safetyScores = [];
-let safePlaceCoords = [];
-let preferredCoords = [];
-
-let heatmapPolygons = [];
-let safePlaces = [];
-let preferredPolygons = [];
+let heatmapFeatures = new Map();
+let safePlaceFeatures = new Map();
+let preferredFeatures = new Map();
+
+// Rendered layers by feature id
+let heatmapPolygons = new Map();
+let safePlaces = new Map();
+let preferredPolygons = new Map();
+let heatmapZoom = null;
+let heatmapRequest = 0;
+let heatmapDebounceTimer;
 
 let metaShown = true;
 
@@ -29,6 +32,7 @@ let targetMarker = null;
 const myCoordinates = L.latLng(48.776111, 9.174778);
 let myMarker = null;
 let routes = [];
+let routeEventSource = null;
 const profile = 'foot';
 
 let editMode = 'default'
@@ -43,32 +47,51 @@ let editSafePlaceCoords = []
 // HEATMAP FUNCTIONS
 //--------------------------------------------------------------------------------------------------
 
-// Calls the server to get the heatmap data
+// Returns the coordinates of the 256px heatmap tiles covering the visible map
+function getVisibleTiles() {
+    const zoom = map.getZoom();
+    const bounds = map.getPixelBounds();
+    const min = bounds.min.divideBy(256).floor();
+    const max = bounds.max.divideBy(256).floor();
+    const n = 2 ** zoom;
+
+    const tiles = [];
+    for (let x = min.x; x <= max.x; x++) {
+        for (let y = Math.max(0, min.y); y <= Math.min(n - 1, max.y); y++) {
+            tiles.push([zoom, ((x % n) + n) % n, y]);
+        }
+    }
+    return tiles;
+}
+
+// Calls the server to get the heatmap data of the visible tiles
 async function getHeatmapData() {
+    const request = ++heatmapRequest;
 	try {
-        // Construct the URL with query parameters
-        const url = new URL('/heatmap', window.location.origin);
-
-        const response = await fetch(url, {
-            method: 'GET',
-            headers: {
-                'Content-Type': 'application/json'
+        const tiles = await Promise.all(getVisibleTiles().map(async ([z, x, y]) => {
+            // Unchanged tiles are answered with 304 Not Modified by the server
+            const response = await fetch(new URL(`/heatmap/tile/${z}/${x}/${y}`, window.location.origin));
+            return response.json();
+        }));
+
+        // A newer request was started while this one was running
+        if (request !== heatmapRequest) return;
+
+        heatmapFeatures = new Map();
+        safePlaceFeatures = new Map();
+        preferredFeatures = new Map();
+        for (const tile of tiles) {
+            if (tile['error'] != undefined) {
+                console.error(tile['error']);
+                return;
             }
-        });
-
-        const heatmapData = await response.json();
-
-        if (heatmapData['error'] != undefined) {
-            console.error(heatmapData['error']);
-            return;
+            tile.heatmap.ids.forEach((id, i) => heatmapFeatures.set(id, {coordinates: tile.heatmap.coordinates[i], safetyScore: tile.heatmap.safetyScores[i]}));
+            tile.safePlaces.ids.forEach((id, i) => safePlaceFeatures.set(id, {coordinates: tile.safePlaces.coordinates[i]}));
+            tile.preferred.ids.forEach((id, i) => preferredFeatures.set(id, {coordinates: tile.preferred.coordinates[i]}));
         }
-		
-		heatmapPolygonCoords = heatmapData.heatmap.coordinates;
-		safetyScores = heatmapData.heatmap.safetyScores;
-        safePlaceCoords = heatmapData.safePlaces.coordinates;
-        preferredCoords = heatmapData.preferred.coordinates;
 
-		createHeatmap();
+		createHeatmap(heatmapZoom !== map.getZoom());
+        heatmapZoom = map.getZoom();
     } catch (error) {
         console.error(error);
     }
@@ -81,59 +104,42 @@ function valueToColor(value) {
     return `hsl(${hue}, 100%, 50%)`;
 }
 
-// Adds heatmap elements to the map
-function createHeatmap() {
-    for (let i in heatmapPolygons) {
-        map.removeLayer(heatmapPolygons[i]);
-    }
-    for (let i in safePlaces) {
-        map.removeLayer(safePlaces[i]);
-    }
-    for (let i in preferredPolygons) {
-        map.removeLayer(preferredPolygons[i]);
-    }
-
-    heatmapPolygons = [];
-    safePlaces = [];
-    preferredPolygons = [];
-    metaShown = true;
-
-    for (let i in heatmapPolygonCoords) {
-        heatmapPolygons.push(L.polygon(heatmapPolygonCoords[i], { color: valueToColor(safetyScores[i]), fillOpacity: 0.3, weight: 0 }).addTo(map));
+// Updates the rendered layers to the loaded features. Layers of features that are still visible
+// are kept unless redraw is set, e.g. because the zoom level and therefore the simplification changed.
+function updateLayers(layers, features, createLayer, redraw) {
+    for (const [id, layer] of layers) {
+        if (redraw || !features.has(id)) {
+            map.removeLayer(layer);
+            layers.delete(id);
+        }
     }
-
-    for (let i in preferredCoords) {
-        preferredPolygons.push(L.polygon(preferredCoords[i], { color: "#28ff65", fillOpacity: 0.3, weight: 0 }).addTo(map));
+    for (const [id, feature] of features) {
+        if (!layers.has(id)) {
+            const layer = createLayer(feature);
+            if (metaShown) layer.addTo(map);
+            layers.set(id, layer);
+        }
     }
+}
 
-    for (let i in safePlaceCoords) {
-        safePlaces.push(L.circle(safePlaceCoords[i], {color: '#fff', fillColor: '#00ff26', fillOpacity: 0.8, weight: 1, radius: 20}).addTo(map));
-    }
+// Adds heatmap elements to the map
+function createHeatmap(redraw = false) {
+    updateLayers(heatmapPolygons, heatmapFeatures, (feature) => L.polygon(feature.coordinates, { color: valueToColor(feature.safetyScore), fillOpacity: 0.3, weight: 0 }), redraw);
+    updateLayers(preferredPolygons, preferredFeatures, (feature) => L.polygon(feature.coordinates, { color: "#28ff65", fillOpacity: 0.3, weight: 0 }), redraw);
+    updateLayers(safePlaces, safePlaceFeatures, (feature) => L.circle(feature.coordinates, {color: '#fff', fillColor: '#00ff26', fillOpacity: 0.8, weight: 1, radius: 20}), redraw);
 }
 
 // Enables/Disables the heatmap elements
 function toggleHeatmap() {
 	metaShown = !metaShown;
 
-	if (metaShown) {
-		for (let i in heatmapPolygons) {
-			heatmapPolygons[i].addTo(map);
-		}
-		for (let i in safePlaces) {
-			safePlaces[i].addTo(map);
-		}
-        for (let i in preferredPolygons) {
-			preferredPolygons[i].addTo(map);
-		}
-	} else {
-		for (let i in heatmapPolygons) {
-			map.removeLayer(heatmapPolygons[i]);
-		}
-		for (let i in safePlaces) {
-			map.removeLayer(safePlaces[i]);
-		}
-        for (let i in preferredPolygons) {
-			map.removeLayer(preferredPolygons[i]);
+	for (const layers of [heatmapPolygons, safePlaces, preferredPolygons]) {
+		for (const layer of layers.values()) {
+			if (metaShown) {
+				layer.addTo(map);
+			} else {
+				map.removeLayer(layer);
+			}
 		}
 	}
 }
@@ -338,39 +344,51 @@ function onBringMeHomeButtonPressed() {
     }
 }
 
-async function requestRouteFromServer() {
+// Streams the route from the server: the initial route is shown right away and replaced by the
+// safe route through nearby safe places once the server has computed it
+function requestRouteFromServer() {
     if (!targetMarker || !myMarker) { return; }
 
     const origin = `${myCoordinates.lng},${myCoordinates.lat}`;
     const destination =  `${targetMarker.getLatLng().lng},${targetMarker.getLatLng().lat}`;
-    
-    try {
-        // Construct the URL with query parameters
-        const url = new URL('/route', window.location.origin);
-        url.searchParams.append('origin', origin);
-        url.searchParams.append('destination', destination);
-        url.searchParams.append('profile', profile);
 
-        const response = await fetch(url, {
-            method: 'GET',
-            headers: {
-                'Content-Type': 'application/json'
-            }
-        });
+    if (routeEventSource) {
+        routeEventSource.close();
+    }
 
-        const routeData = await response.json();
+    // Construct the URL with query parameters
+    const url = new URL('/route/stream', window.location.origin);
+    url.searchParams.append('origin', origin);
+    url.searchParams.append('destination', destination);
+    url.searchParams.append('profile', profile);
 
-        if (routeData['error'] != undefined) {
-            console.error(routeData['error']);
-            return;
+    const source = new EventSource(url);
+    routeEventSource = source;
+
+    source.addEventListener('initial', (event) => {
+        const routeData = JSON.parse(event.data);
+        if (routeData['paths'] != undefined) {
+            displayRoutes(routeData['paths']);
         }
+    });
 
+    source.addEventListener('final', (event) => {
+        source.close();
+        const routeData = JSON.parse(event.data);
         if (routeData['paths'] != undefined) {
             displayRoutes(routeData['paths']);
         }
-    } catch (error) {
-        console.error(error);
-    }
+    });
+
+    source.addEventListener('routeError', (event) => {
+        source.close();
+        console.error(JSON.parse(event.data)['error']);
+    });
+
+    // Do not reconnect, a new request is made for the next route
+    source.onerror = () => {
+        source.close();
+    };
 }
 
 async function sendSetPolygonToServer() {
@@ -394,19 +412,15 @@ async function sendSetPolygonToServer() {
             }
         });
 
-        const heatmapData = await response.json();
+        // The server only acknowledges the edit, the changed tiles are fetched again
+        const result = await response.json();
 
-        if (heatmapData['error'] != undefined) {
-            console.error(heatmapData['error']);
+        if (result['error'] != undefined) {
+            console.error(result['error']);
             return;
         }
 
-        heatmapPolygonCoords = heatmapData.heatmap.coordinates;
-        safetyScores = heatmapData.heatmap.safetyScores;
-        safePlaceCoords = heatmapData.safePlaces.coordinates;
-        preferredCoords = heatmapData.preferred.coordinates;
-
-        createHeatmap();
+        getHeatmapData();
 
         editPolygonCoords = [];
     } catch (error) {
@@ -429,19 +443,15 @@ async function sendSetSafePlaceToServer() {
             }
         });
 
-        const heatmapData = await response.json();
+        // The server only acknowledges the edit, the changed tiles are fetched again
+        const result = await response.json();
 
-        if (heatmapData['error'] != undefined) {
-            console.error(heatmapData['error']);
+        if (result['error'] != undefined) {
+            console.error(result['error']);
             return;
         }
 
-        heatmapPolygonCoords = heatmapData.heatmap.coordinates;
-        safetyScores = heatmapData.heatmap.safetyScores;
-        safePlaceCoords = heatmapData.safePlaces.coordinates;
-        preferredCoords = heatmapData.preferred.coordinates;
-
-        createHeatmap();
+        getHeatmapData();
 
         editSafePlaceCoords = [];
     } catch (error) {
@@ -456,6 +466,12 @@ async function sendSetSafePlaceToServer() {
 // Right-click event on the map
 map.on('contextmenu', onRightClick);
 
+// Load the heatmap tiles of the new view once the map stopped moving
+map.on('moveend', () => {
+    clearTimeout(heatmapDebounceTimer);
+    heatmapDebounceTimer = setTimeout(() => getHeatmapData(), 250);
+});
+
 // Toggle heatmap
 toggleMetaButtonElement.addEventListener('click', () => {
 	toggleHeatmap();
@@ -8,11 +8,17 @@ Attributes:
 app : Flask
     The Flask app instance.
 
+store : GeoStore
+    The store holding the heatmap data shared by the heatmap and the crawler, created by create_app.
+
 heatmap : Heatmap
-    The Heatmap instance used to generate heatmap data.
+    The Heatmap instance used to generate heatmap data, created by create_app.
 
 crawler : WebCrawler
-    The WebCrawler instance used to fetch route data.
+    The WebCrawler instance used to fetch route data, created by create_app.
+
+metrics : Metrics
+    Request, route pipeline and upstream metrics, with a slow request log if SLOW_REQUEST_MS is set.
 
 Routes:
 ------
@@ -22,35 +28,191 @@ Routes:
 /route (GET)
     Returns a safe route between the specified origin and destination for the specified profile.
 
+/route/stream (GET)
+    Streams Server-Sent Events with the initial route as soon as it is known and the safe route through nearby safe places once it is ready.
+
+/routes/batch (POST)
+    Computes the routes of a JSON list of origins, destinations and profiles and streams each result as NDJSON as soon as it is ready.
+
 /heatmap (GET)
     Returns the heatmap data, including bad polygon coordinates, medium polygon coordinates, and safe place coordinates.
+    The response is compressed and carries an ETag; If-None-Match answers 304 while the data is unchanged.
+
+/heatmap/tile/<z>/<x>/<y> (GET)
+    Returns the heatmap features intersecting a Web Mercator map tile, simplified for its zoom level.
 
 /add_polygon (POST)
-    Adds a new polygon to the heatmap with the specified safety score.
+    Adds a new polygon to the heatmap with the specified safety score and returns the new data version.
 
 /add_safe_place (POST)
-    Adds a new safe place to the heatmap with the specified coordinates.
+    Adds a new safe place to the heatmap with the specified coordinates and returns the new data version.
+
+/heatmap/import (POST)
+    Adds all polygons and safe places of a GeoJSON FeatureCollection body (optionally gzip encoded) in one transaction.
+
+/heatmap/export (GET)
+    Streams the polygons and safe places of the heatmap as a GeoJSON FeatureCollection.
 
 /suggestions (GET)
     Returns a list of suggestions based on the specified query.
 
+/cache_stats (GET)
+    Returns the hit and miss counters of the route and suggestion caches.
+
+/compaction_report (GET)
+    Returns the rule-count reduction of the heatmap compaction and the routing latency per custom model variant.
+
+/metrics (GET)
+    Returns request durations, route pipeline stage durations and upstream call counts and bytes in the Prometheus text format.
+    Worker processes sharing their metrics (see services.metrics.Metrics.share) are summed up.
+
+/healthz (GET)
+    Answers 200 while the process is alive.
+
+/readyz (GET)
+    Answers 200 with the data version once the data is loaded, and 503 while the server shuts down.
+
 Notes:
 -----
-This module is the entry point of the application.
+This module is the entry point of the development server. create_app builds the shared state once per process;
+serve.py runs the app with several worker processes that share the data loaded before they are forked.
 """
 
+import gzip
 import json
 import os
 import traceback
 
-from flask import Flask, jsonify, request, send_from_directory
+from flask import (
+    Flask,
+    Response,
+    g,
+    jsonify,
+    request,
+    send_from_directory,
+    stream_with_context,
+)
+from services.geojson import GeoJSONError
+from services.geostore import GeoStore
 from services.heatmap import Heatmap
+from services.metrics import Metrics
 from services.webcrawler import WebCrawler
 
 app = Flask(__name__, static_folder="../client", static_url_path="")
 
-heatmap = Heatmap(os.path.join(os.getcwd(), "server/data"))
-crawler = WebCrawler(os.path.join(os.getcwd(), "server/data"))
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+MAX_IMPORT_FEATURES = int(os.getenv("MAX_IMPORT_FEATURES", "1000000"))
+
+slow_request_ms = os.getenv("SLOW_REQUEST_MS")
+metrics = Metrics(slow_request_s=float(slow_request_ms) / 1000 if slow_request_ms else None)
+
+# Created by create_app
+store = None
+heatmap = None
+crawler = None
+shutting_down = False
+
+
+def create_app(data_dir=None):
+    """
+    Loads the heatmap data and creates the heatmap and the crawler the routes use, once per
+    process.
+
+    Parameters:
+    ----------
+    data_dir : str, optional
+        The directory of the heatmap data (default: the DATA_DIR environment variable,
+        or server/data)
+
+    Returns:
+    ----------
+    Flask
+        The app instance.
+    """
+    global store, heatmap, crawler
+    if store is None:
+        store = GeoStore(data_dir or os.getenv("DATA_DIR", DATA_DIR))
+        heatmap = Heatmap(store=store)
+        crawler = WebCrawler(
+            store.data_dir,
+            routing_backend=os.getenv("ROUTING_BACKEND", "graphhopper"),
+            road_graph_path=os.getenv("ROAD_GRAPH_PATH"),
+            detour_mode=os.getenv("DETOUR_MODE", "routes"),
+            scoring_mode=os.getenv("SCORING_MODE", "exact"),
+            metrics=metrics,
+            store=store,
+        )
+    return app
+
+
+def warm_up():
+    """
+    Builds the indexes, the custom model and the heatmap payload, e.g. before forking
+    server workers that share them copy-on-write.
+    """
+    crawler.warm_up()
+    heatmap.get_heatmap_payload()
+
+
+def after_fork():
+    """
+    Prepares a forked server worker, which inherited the data but none of the threads.
+    """
+    metrics.after_fork()
+    crawler.after_fork()
+
+
+def shutdown():
+    """
+    Stops answering readiness checks, drains the routes in flight and their upstream calls
+    and flushes pending heatmap edits.
+    """
+    global shutting_down
+    shutting_down = True
+    if crawler is not None:
+        crawler.close()
+    if store is not None:
+        store.close()
+    metrics.close()
+
+
+def encoded_response(payload):
+    """
+    Builds a response from a pre-encoded payload, in the best content encoding the client
+    accepts. Answers 304 Not Modified if the client already has the payload.
+    """
+    encoding = payload.select_encoding(request.accept_encodings)
+    if payload.matches(request.if_none_match):
+        response = Response(status=304)
+    else:
+        response = Response(payload.encoded(encoding), content_type=payload.content_type)
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+    response.set_etag(payload.etag(encoding))
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+@app.before_request
+def start_trace():
+    g.trace = metrics.start_trace(f"{request.method} {request.full_path.rstrip('?')}")
+
+
+@app.before_request
+def refresh_data():
+    # Pick up the edits other server processes made to the data directory
+    store.refresh()
+
+
+@app.after_request
+def finish_trace(response):
+    trace = g.pop("trace", None)
+    if trace is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        # Called once the body is sent, so streamed responses are timed until their end
+        response.call_on_close(lambda: metrics.finish_trace(trace, endpoint))
+    return response
 
 
 @app.route("/")
@@ -68,7 +230,9 @@ def get_safe_route():
         profile = request.args.get("profile")
 
         if origin and destination and profile:
-            return jsonify(crawler.get_route(origin, destination, profile))
+            route = crawler.get_route(origin, destination, profile)
+            with metrics.span("serialize"):
+                return jsonify(route)
         else:
             return jsonify({"error": "Missing origin or destination or profile"}), 400
     except Exception as e:
@@ -76,11 +240,92 @@ def get_safe_route():
         return jsonify({"error": "Server Error: " + str(e)}), 400
 
 
+@app.route("/route/stream", methods=["GET"])
+def get_safe_route_stream():
+    print("Safe route requested and streamed to the client...")
+    origin = request.args.get("origin")
+    destination = request.args.get("destination")
+    profile = request.args.get("profile")
+    if not (origin and destination and profile):
+        return jsonify({"error": "Missing origin or destination or profile"}), 400
+
+    def event(name, data):
+        with metrics.span("serialize"):
+            return f"event: {name}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+    def generate():
+        found = False
+        try:
+            for stage, route in crawler.iter_route(origin, destination, profile):
+                found = True
+                yield event(stage, route)
+            if not found:
+                yield event("routeError", {"error": "No route found"})
+        except Exception as e:
+            traceback.print_exc()
+            yield event("routeError", {"error": "Server Error: " + str(e)})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/routes/batch", methods=["POST"])
+def get_safe_routes_batch():
+    print("Batch of safe routes requested and in calculation...")
+    try:
+        body = request.get_json(force=True)
+        items = body["routes"] if isinstance(body, dict) else body
+        # Malformed items are reported in their own result line
+        route_requests = [
+            (item.get("origin"), item.get("destination"), item.get("profile", "foot"))
+            if isinstance(item, dict)
+            else (None, None, None)
+            for item in items
+        ]
+        results = crawler.get_routes(route_requests)
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": "Server Error: " + str(e)}), 400
+
+    def generate():
+        for index, route, error in results:
+            origin, destination, profile = route_requests[index]
+            result = {
+                "index": index,
+                "origin": origin,
+                "destination": destination,
+                "profile": profile,
+            }
+            if error is not None:
+                result["error"] = "Server Error: " + str(error)
+            elif not route:
+                result["error"] = "No route found"
+            else:
+                result["route"] = route
+            with metrics.span("serialize"):
+                line = json.dumps(result, separators=(",", ":")) + "\n"
+            yield line
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
 @app.route("/heatmap", methods=["GET"])
 def get_heatmap_data():
     print("Heatmap requested and sending to the client...")
     try:
-        return jsonify(heatmap.get_heatmap_and_safe_places())
+        return encoded_response(heatmap.get_heatmap_payload())
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": "Server Error: " + str(e)}), 400
+
+
+@app.route("/heatmap/tile/<int:z>/<int:x>/<int:y>", methods=["GET"])
+def get_heatmap_tile(z, x, y):
+    try:
+        return encoded_response(heatmap.get_heatmap_tile(z, x, y))
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": "Server Error: " + str(e)}), 400
@@ -92,9 +337,8 @@ def add_new_polygon():
     try:
         polygon = json.loads(request.args.get("polygon"))["coordinates"]
         safety_score = request.args.get("safetyScore")
-        heatmap.add_and_save_new_polygon(polygon, safety_score)
-        crawler.load_data_from_csv()
-        return jsonify(heatmap.get_heatmap_and_safe_places())
+        data_version = heatmap.add_and_save_new_polygon(polygon, safety_score)
+        return jsonify({"status": "ok", "dataVersion": data_version})
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": "Server Error: " + str(e)}), 400
@@ -106,14 +350,38 @@ def add_new_safe_place():
     try:
         coordinates_string_array = request.args.get("coordinates").split(",")
         coordinates = [float(coord) for coord in coordinates_string_array]
-        heatmap.add_and_save_new_safe_place(coordinates)
-        crawler.load_data_from_csv()
-        return jsonify(heatmap.get_heatmap_and_safe_places())
+        data_version = heatmap.add_and_save_new_safe_place(coordinates)
+        return jsonify({"status": "ok", "dataVersion": data_version})
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": "Server Error: " + str(e)}), 400
+
+
+@app.route("/heatmap/import", methods=["POST"])
+def import_heatmap_features():
+    print("Bulk import of heatmap features requested...")
+    try:
+        stream = request.stream
+        if request.content_encoding == "gzip":
+            stream = gzip.GzipFile(fileobj=stream)
+        return jsonify(heatmap.import_geojson(stream, max_features=MAX_IMPORT_FEATURES))
+    except GeoJSONError as e:
+        return jsonify({"error": str(e), "errors": e.errors}), 400
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": "Server Error: " + str(e)}), 400
 
 
+@app.route("/heatmap/export", methods=["GET"])
+def export_heatmap_features():
+    print("Heatmap export requested and streaming to the client...")
+    return Response(
+        stream_with_context(heatmap.export_geojson()),
+        mimetype="application/geo+json",
+        headers={"Content-Disposition": "attachment; filename=heatmap.geojson"},
+    )
+
+
 @app.route("/suggestions", methods=["GET"])
 def get_suggestions():
     print("Map suggestions requested and sending to the client...")
@@ -125,5 +393,50 @@ def get_suggestions():
         return jsonify({"error": "Server Error: " + str(e)}), 400
 
 
+@app.route("/cache_stats", methods=["GET"])
+def get_cache_stats():
+    try:
+        return jsonify(crawler.get_cache_stats())
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": "Server Error: " + str(e)}), 400
+
+
+@app.route("/compaction_report", methods=["GET"])
+def get_compaction_report():
+    try:
+        return jsonify(crawler.get_compaction_report())
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": "Server Error: " + str(e)}), 400
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/healthz", methods=["GET"])
+def get_health():
+    return jsonify({"status": "ok"})
+
+
+@app.route("/readyz", methods=["GET"])
+def get_readiness():
+    if shutting_down or store is None:
+        return jsonify({"status": "unavailable"}), 503
+    return jsonify(
+        {
+            "status": "ready",
+            "dataVersion": store.snapshot.version,
+            "upstream": crawler.upstream.breaker.state,
+        }
+    )
+
+
 if __name__ == "__main__":
-    app.run(debug=True)
+    create_app()
+    try:
+        app.run(debug=True)
+    finally:
+        shutdown()
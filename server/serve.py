@@ -0,0 +1,102 @@
+"""
+Production entry point of the WeLai server.
+
+Serves the app with gunicorn on several worker processes with several request threads each,
+so throughput grows with the number of cores. The heatmap data, its indexes, the custom
+model and the heatmap payload are loaded once in the master process before the workers are
+forked, so all workers share them copy-on-write. Edits made by one worker are picked up by
+the others through the shared data directory (see services.geostore.GeoStore.refresh).
+
+On SIGTERM every worker stops accepting connections, finishes the requests in flight
+within GRACEFUL_TIMEOUT seconds, waits for their upstream calls and flushes pending edits.
+
+The workers share their metrics through the METRICS_DIR directory, so /metrics returns
+the totals of all workers whichever worker accepts the scrape (see
+services.metrics.Metrics.share).
+
+Configuration (environment variables):
+----------
+BIND
+    Address to listen on (default: 0.0.0.0:5000)
+WORKERS
+    Number of worker processes (default: WEB_CONCURRENCY, or the number of CPU cores)
+THREADS
+    Number of request threads per worker (default: 8)
+TIMEOUT
+    Seconds after which an unresponsive worker is restarted (default: 60)
+GRACEFUL_TIMEOUT
+    Seconds a worker gets to finish its requests on shutdown (default: 30)
+METRICS_DIR
+    Directory the workers share their metrics through, emptied on start (default: a new
+    temporary directory)
+
+The variables of main.py (ROUTING_BACKEND, SCORING_MODE, ...) apply as well.
+
+Usage:
+------
+    python3 server/serve.py
+"""
+
+import os
+import tempfile
+
+import main
+from gunicorn.app.base import BaseApplication
+
+
+class Server(BaseApplication):
+    """
+    Server class.
+
+    A gunicorn application serving main.app with the app loaded before the workers are
+    forked.
+
+    Attributes:
+    ----------
+    options : dict
+        The gunicorn settings by name.
+    """
+
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for name, value in self.options.items():
+            self.cfg.set(name, value)
+
+    def load(self):
+        main.metrics.share(os.getenv("METRICS_DIR") or tempfile.mkdtemp(prefix="welai-metrics-"))
+        app = main.create_app()
+        main.warm_up()
+        return app
+
+
+def post_fork(server, worker):
+    main.after_fork()
+
+
+def worker_exit(server, worker):
+    main.shutdown()
+
+
+def options_from_env():
+    """
+    Returns the gunicorn settings from the environment variables described above.
+    """
+    workers = os.getenv("WORKERS") or os.getenv("WEB_CONCURRENCY") or os.cpu_count() or 1
+    return {
+        "bind": os.getenv("BIND", "0.0.0.0:5000"),
+        "workers": int(workers),
+        "threads": int(os.getenv("THREADS", "8")),
+        "worker_class": "gthread",
+        "timeout": int(os.getenv("TIMEOUT", "60")),
+        "graceful_timeout": int(os.getenv("GRACEFUL_TIMEOUT", "30")),
+        "preload_app": True,
+        "post_fork": post_fork,
+        "worker_exit": worker_exit,
+    }
+
+
+if __name__ == "__main__":
+    Server(options_from_env()).run()
@@ -0,0 +1,230 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    TTLCache class.
+
+    A thread-safe in-process cache that evicts the least recently used entry once it is
+    full and treats entries older than the time to live as missing.
+
+    Attributes:
+    ----------
+    maxsize : int
+        Maximum number of entries kept in the cache.
+    ttl : float
+        Time to live of an entry in seconds.
+    hits : int
+        Number of lookups that found a fresh entry.
+    misses : int
+        Number of lookups that found no entry or an expired one.
+
+    Methods:
+    ----------
+    get(key, default=None) : object
+        Returns the cached value for the key, or the default if there is no fresh entry.
+    peek(key, default=None) : object
+        Like get, but without updating the counters or the eviction order.
+    set(key, value) : None
+        Stores a value for the key.
+    clear() : None
+        Removes all entries.
+    stats() : dict
+        Returns the size and hit/miss counters of the cache.
+    """
+
+    def __init__(self, maxsize=1024, ttl=600.0):
+        """
+        Initializes the TTLCache instance.
+
+        Parameters:
+        ----------
+        maxsize : int, optional
+            Maximum number of entries kept in the cache (default: 1024)
+        ttl : float, optional
+            Time to live of an entry in seconds (default: 600.0)
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """
+        Returns the cached value for the key, or the default if there is no fresh entry.
+
+        Parameters:
+        ----------
+        key : hashable
+            The cache key.
+        default : object, optional
+            The value returned on a miss (default: None)
+
+        Returns:
+        ----------
+        object
+            The cached value or the default.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def peek(self, key, default=None):
+        """
+        Returns the cached value for the key without updating the counters or the eviction order.
+
+        Parameters:
+        ----------
+        key : hashable
+            The cache key.
+        default : object, optional
+            The value returned if there is no fresh entry (default: None)
+
+        Returns:
+        ----------
+        object
+            The cached value or the default.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[1]
+            return default
+
+    def set(self, key, value):
+        """
+        Stores a value for the key, evicting the least recently used entry if the cache is full.
+
+        Parameters:
+        ----------
+        key : hashable
+            The cache key.
+        value : object
+            The value to cache.
+        """
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Removes all entries. The hit and miss counters are kept.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Returns the size and hit/miss counters of the cache.
+
+        Returns:
+        ----------
+        dict
+            A dictionary with the current size, the maximum size, hits and misses.
+        """
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+class SingleFlight:
+    """
+    SingleFlight class.
+
+    Coalesces concurrent calls with the same key, so that only the first caller runs the
+    function and all others wait for and share its result.
+
+    Attributes:
+    ----------
+    coalesced : int
+        Number of calls that were answered by another caller's result.
+
+    Methods:
+    ----------
+    do(key, function, *args, **kwargs) : object
+        Runs the function unless a call with the same key is already in flight.
+    """
+
+    def __init__(self):
+        """
+        Initializes the SingleFlight instance.
+        """
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args, **kwargs):
+        """
+        Runs the function unless a call with the same key is already in flight, in which case
+        the result (or exception) of that call is returned (or raised).
+
+        Parameters:
+        ----------
+        key : hashable
+            The key identifying identical calls.
+        function : callable
+            The function to run.
+        *args, **kwargs
+            The arguments passed to the function.
+
+        Returns:
+        ----------
+        object
+            The result of the function.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+class _Call:
+    """
+    A call in flight of a SingleFlight instance.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
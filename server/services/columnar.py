@@ -0,0 +1,207 @@
+import json
+import os
+import struct
+
+import numpy as np
+
+KIND_BAD = 0
+KIND_PREFERRED = 1
+# Stored for heatmap polygons without a known score: safe, so they add no badness
+UNKNOWN_SAFETY_SCORE = 1.0
+
+MAGIC = b"WELAIGEO"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+
+class PolygonArrays:
+    """
+    PolygonArrays class.
+
+    Columnar storage of polygons: the vertices of all polygons in one contiguous float64
+    array and per polygon an offset into it, a safety score and a kind.
+
+    Attributes:
+    ----------
+    coords : numpy.ndarray
+        The (N, 2) array of (longitude, latitude) vertices of all polygons.
+    offsets : numpy.ndarray
+        The (M + 1,) int64 array; polygon i spans coords[offsets[i]:offsets[i + 1]].
+    scores : numpy.ndarray
+        The (M,) float64 array of safety scores (UNKNOWN_SAFETY_SCORE for heatmap polygons
+        without a known score, NaN for preferred polygons, whose scores are not stored).
+    kinds : numpy.ndarray
+        The (M,) int8 array of polygon kinds (KIND_BAD or KIND_PREFERRED).
+
+    Methods:
+    ----------
+    from_lists(polygons, scores, kinds) : PolygonArrays
+        Builds the arrays from lists of polygon coordinates.
+    ring(i) : numpy.ndarray
+        Returns the vertices of polygon i.
+    select(kind) : numpy.ndarray
+        Returns the indices of all polygons of a kind.
+    append(polygons, scores, kinds) : PolygonArrays
+        Returns new arrays with the polygons appended.
+    """
+
+    def __init__(self, coords, offsets, scores, kinds):
+        self.coords = coords
+        self.offsets = offsets
+        self.scores = scores
+        self.kinds = kinds
+
+    @classmethod
+    def empty(cls):
+        return cls(
+            np.empty((0, 2)),
+            np.zeros(1, dtype=np.int64),
+            np.empty(0),
+            np.empty(0, dtype=np.int8),
+        )
+
+    @classmethod
+    def from_lists(cls, polygons, scores, kinds):
+        """
+        Builds the arrays from lists of polygon coordinates.
+
+        Parameters:
+        ----------
+        polygons : list
+            The polygons as lists of (longitude, latitude) coordinates.
+        scores : list
+            The safety score of every polygon.
+        kinds : list
+            The kind of every polygon.
+
+        Returns:
+        ----------
+        PolygonArrays
+            The columnar polygons.
+        """
+        return cls.empty().append(polygons, scores, kinds)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def ring(self, i):
+        """
+        Returns the (n, 2) array of vertices of polygon i.
+        """
+        return self.coords[self.offsets[i] : self.offsets[i + 1]]
+
+    def select(self, kind):
+        """
+        Returns the indices of all polygons of a kind, in storage order.
+        """
+        return np.flatnonzero(self.kinds == kind)
+
+    def append(self, polygons, scores, kinds):
+        """
+        Returns new arrays with the polygons appended. The existing arrays are not changed.
+
+        Parameters:
+        ----------
+        polygons : list
+            The polygons as lists of (longitude, latitude) coordinates.
+        scores : list
+            The safety score of every polygon.
+        kinds : list
+            The kind of every polygon.
+
+        Returns:
+        ----------
+        PolygonArrays
+            The new columnar polygons.
+        """
+        if not polygons:
+            return self
+        lengths = np.array([len(polygon) for polygon in polygons], dtype=np.int64)
+        new_coords = np.array(
+            [coord[:2] for polygon in polygons for coord in polygon], dtype=float
+        ).reshape(-1, 2)
+        return PolygonArrays(
+            np.concatenate([self.coords, new_coords]),
+            np.concatenate([self.offsets, self.offsets[-1] + np.cumsum(lengths)]),
+            np.concatenate([self.scores, np.asarray(scores, dtype=float)]),
+            np.concatenate([self.kinds, np.asarray(kinds, dtype=np.int8)]),
+        )
+
+
+def save_binary(path, arrays):
+    """
+    Writes named arrays to a binary snapshot file that can be memory-mapped by load_binary.
+
+    The file starts with a magic number, the format version and the length of a JSON header
+    describing every array. The arrays follow, each aligned to 64 bytes. The file is written
+    to a temporary file first and then atomically renamed.
+
+    Parameters:
+    ----------
+    path : str
+        The path of the snapshot file.
+    arrays : dict
+        The arrays to write by name.
+    """
+    header = {}
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        header[name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": offset,
+        }
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    header_bytes = json.dumps(header).encode("utf-8")
+    preamble = MAGIC + struct.pack("<II", FORMAT_VERSION, len(header_bytes)) + header_bytes
+    data_start = -(-len(preamble) // ALIGNMENT) * ALIGNMENT
+
+    temp_path = path + ".tmp"
+    with open(temp_path, mode="wb") as file:
+        file.write(preamble.ljust(data_start, b"\0"))
+        for name, array in arrays.items():
+            file.seek(data_start + header[name]["offset"])
+            file.write(np.ascontiguousarray(array).tobytes())
+        file.truncate(data_start + offset)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+
+def load_binary(path):
+    """
+    Memory-maps the arrays of a binary snapshot file written by save_binary.
+
+    Nothing is read up front; pages are loaded by the operating system when the arrays are
+    accessed and are shared between processes mapping the same file.
+
+    Parameters:
+    ----------
+    path : str
+        The path of the snapshot file.
+
+    Returns:
+    ----------
+    dict
+        The read-only arrays by name.
+    """
+    mapped = np.memmap(path, dtype=np.uint8, mode="r")
+    if bytes(mapped[: len(MAGIC)]) != MAGIC:
+        raise ValueError(f"{path} is not a heatmap snapshot")
+    version, header_length = struct.unpack_from("<II", mapped, len(MAGIC))
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported heatmap snapshot version {version}")
+    header_start = len(MAGIC) + 8
+    header = json.loads(bytes(mapped[header_start : header_start + header_length]))
+    data_start = -(-(header_start + header_length) // ALIGNMENT) * ALIGNMENT
+
+    arrays = {}
+    for name, spec in header.items():
+        arrays[name] = np.ndarray(
+            tuple(spec["shape"]),
+            dtype=np.dtype(spec["dtype"]),
+            buffer=mapped,
+            offset=data_start + spec["offset"],
+        )
+    return arrays
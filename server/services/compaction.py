@@ -0,0 +1,89 @@
+import math
+import time
+
+import shapely
+from shapely.geometry import Polygon, mapping
+
+
+def compact_polygons(
+    heatmap, safety_scores, score_step=0.1, tolerance=0.00005, max_areas=32
+):
+    """
+    Compacts heatmap polygons into a bounded number of routing areas.
+
+    Polygons are grouped by their safety score quantized to score_step, every group is
+    dissolved into a single (multi)polygon and simplified. If there are still more than
+    max_areas groups, the two groups with the closest scores are merged until the limit
+    holds. Every area keeps the lowest safety score of its polygons, so compaction never
+    makes a place look safer than it was drawn.
+
+    The areas are returned ordered by ascending safety score. Used as an else_if chain of
+    priority rules, overlapping areas therefore apply the lowest score.
+
+    Parameters:
+    ----------
+    heatmap : list
+        A list of polygon coordinates
+    safety_scores : list
+        A safety score for every polygon in the heatmap
+    score_step : float, optional
+        Width of the safety score buckets polygons are grouped by (default: 0.1)
+    tolerance : float, optional
+        Simplification tolerance in degrees (default: 0.00005, about 5 m)
+    max_areas : int, optional
+        Maximum number of areas to emit (default: 32)
+
+    Returns:
+    ----------
+    tuple
+        The list of (GeoJSON geometry, safety score) areas and a report dictionary with the
+        number of input and output areas and vertices and the compaction time.
+    """
+    start = time.perf_counter()
+
+    groups = {}
+    input_vertices = 0
+    for polygon, safety_score in zip(heatmap, safety_scores):
+        if len(polygon) < 4:
+            continue
+        geometry = shapely.make_valid(Polygon(polygon))
+        input_vertices += len(polygon)
+        bucket = math.floor(safety_score / score_step + 1e-9)
+        score, geometries = groups.get(bucket, (safety_score, []))
+        geometries.append(geometry)
+        groups[bucket] = (min(score, safety_score), geometries)
+
+    # Dissolve every group, ordered by ascending score
+    areas = [
+        [score, shapely.union_all(geometries)]
+        for _, (score, geometries) in sorted(groups.items())
+    ]
+
+    # Merge the neighbours with the closest scores until the limit holds
+    while len(areas) > max(1, max_areas):
+        i = min(range(len(areas) - 1), key=lambda j: areas[j + 1][0] - areas[j][0])
+        areas[i : i + 2] = [
+            [areas[i][0], shapely.union(areas[i][1], areas[i + 1][1])]
+        ]
+
+    compacted = []
+    output_vertices = 0
+    for score, geometry in areas:
+        geometry = geometry.simplify(tolerance, preserve_topology=True)
+        polygons = [
+            part for part in shapely.get_parts(geometry) if part.geom_type == "Polygon"
+        ]
+        if not polygons:
+            continue
+        geometry = shapely.MultiPolygon(polygons)
+        output_vertices += shapely.get_num_coordinates(geometry)
+        compacted.append((mapping(geometry), score))
+
+    report = {
+        "inputAreas": len(heatmap),
+        "outputAreas": len(compacted),
+        "inputVertices": input_vertices,
+        "outputVertices": int(output_vertices),
+        "compactionSeconds": time.perf_counter() - start,
+    }
+    return compacted, report
@@ -0,0 +1,189 @@
+import json
+
+INIT_AREA = {
+    "type": "Feature",
+    "id": "init",
+    "properties": {},
+    "geometry": {
+        "type": "Polygon",
+        "coordinates": [
+            [
+                [9.179079392366791, 48.77928985002192],
+                [9.178403533981024, 48.77848548812847],
+                [9.180537608035477, 48.77835052681645],
+                [9.179079392366791, 48.77928985002192],
+            ]
+        ],
+    },
+}
+
+
+def polygon_areas(heatmap, safety_scores):
+    """
+    Turns heatmap polygons into routing areas, one per polygon.
+
+    Parameters:
+    ----------
+    heatmap : list
+        A list of polygon coordinates to avoid
+    safety_scores : list
+        A safety score for every polygon in the heatmap
+
+    Returns:
+    ----------
+    list
+        A list of (GeoJSON geometry, safety score) areas
+    """
+    return [
+        ({"type": "Polygon", "coordinates": [polygon]}, safety_score)
+        for polygon, safety_score in zip(heatmap, safety_scores)
+    ]
+
+
+def build_custom_model(areas, preferred_coords):
+    """
+    Builds the GraphHopper custom model for the heatmap data.
+
+    Parameters:
+    ----------
+    areas : list
+        A list of (GeoJSON geometry, safety score) areas to avoid
+    preferred_coords : list
+        A list of polygon coordinates to prefer
+
+    Returns:
+    ----------
+    dict
+        The custom model with its areas and priority rules
+    """
+    custom_model = {
+        "priority": [
+            {"if": "in_init", "multiply_by": "1"},
+        ],
+        "areas": {
+            "type": "FeatureCollection",
+            "features": [INIT_AREA],
+        },
+    }
+
+    # Add polygons with lower priority to api call
+    for i, (geometry, safety_score) in enumerate(areas):
+        feature = {
+            "type": "Feature",
+            "id": f"bad{i}",
+            "properties": {},
+            "geometry": geometry,
+        }
+        priority = {
+            "else_if": f"in_bad{i}",
+            "multiply_by": f"{safety_score}",
+        }
+        custom_model["areas"]["features"].append(feature)
+        custom_model["priority"].append(priority)
+
+    # Add polygons with higher priority (but no loop this time as this is an inverse operation (it sets the priority of everythin else lower))
+    feature = {
+        "type": "Feature",
+        "id": "good",
+        "properties": {},
+        "geometry": {"type": "Polygon", "coordinates": preferred_coords},
+    }
+    priority = {
+        "if": "!in_good",
+        "multiply_by": "0.5",
+    }
+    custom_model["areas"]["features"].append(feature)
+    custom_model["priority"].append(priority)
+
+    return custom_model
+
+
+def compile_custom_model(areas, preferred_coords):
+    """
+    Builds the GraphHopper custom model for the heatmap data and serializes it to JSON.
+
+    Parameters:
+    ----------
+    areas : list
+        A list of (GeoJSON geometry, safety score) areas to avoid
+    preferred_coords : list
+        A list of polygon coordinates to prefer
+
+    Returns:
+    ----------
+    bytes
+        The JSON encoded custom model
+    """
+    return json.dumps(
+        build_custom_model(areas, preferred_coords),
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def build_route_request(points, profile, optimize, custom_model):
+    """
+    Builds the JSON body of a GraphHopper route request around a precompiled custom model.
+
+    Only the small request specific part is serialized, the custom model bytes are spliced in.
+
+    Parameters:
+    ----------
+    points : list
+        The route points as [longitude, latitude] pairs
+    profile : str
+        The routing profile to use (e.g., "foot")
+    optimize : str
+        Whether to optimize the route (e.g., "false")
+    custom_model : bytes
+        The custom model as returned by compile_custom_model
+
+    Returns:
+    ----------
+    bytes
+        The JSON encoded request body
+    """
+    request = json.dumps(
+        {
+            "profile": profile,
+            "points": points,
+            "ch.disable": True,
+            "points_encoded": False,
+            "optimize": optimize,
+        },
+        separators=(",", ":"),
+    ).encode("utf-8")
+    return request[:-1] + b',"custom_model":' + custom_model + b"}"
+
+
+def build_matrix_request(from_points, to_points, profile, custom_model):
+    """
+    Builds the JSON body of a GraphHopper matrix request around a precompiled custom model.
+
+    Parameters:
+    ----------
+    from_points : list
+        The start points as [longitude, latitude] pairs
+    to_points : list
+        The end points as [longitude, latitude] pairs
+    profile : str
+        The routing profile to use (e.g., "foot")
+    custom_model : bytes
+        The custom model as returned by compile_custom_model
+
+    Returns:
+    ----------
+    bytes
+        The JSON encoded request body
+    """
+    request = json.dumps(
+        {
+            "profile": profile,
+            "from_points": from_points,
+            "to_points": to_points,
+            "out_arrays": ["distances"],
+            "ch.disable": True,
+            "fail_fast": False,
+        },
+        separators=(",", ":"),
+    ).encode("utf-8")
+    return request[:-1] + b',"custom_model":' + custom_model + b"}"
@@ -0,0 +1,66 @@
+import numpy as np
+import shapely
+
+EARTH_RADIUS_M = 6371008.8
+
+
+def haversine_m(lon1, lat1, lon2, lat2):
+    """
+    Calculates the great-circle distance between two sets of points.
+
+    Works on scalars as well as on NumPy arrays of equal shape, so whole coordinate
+    sequences can be measured in one call.
+
+    Parameters:
+    ----------
+    lon1, lat1 : float or numpy.ndarray
+        Longitude and latitude of the start points in degrees
+    lon2, lat2 : float or numpy.ndarray
+        Longitude and latitude of the end points in degrees
+
+    Returns:
+    ----------
+    float or numpy.ndarray
+        The distances in meters
+    """
+    lon1, lat1, lon2, lat2 = map(np.radians, (lon1, lat1, lon2, lat2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def estimate_detour_m(route_line, points, return_projections=False):
+    """
+    Estimates the extra distance of visiting points as a detour from a route.
+
+    Every point is projected onto the route and the detour is approximated as the
+    out-and-back distance between the point and its projection.
+
+    Parameters:
+    ----------
+    route_line : shapely.geometry.LineString
+        The route with (longitude, latitude) coordinates
+    points : list
+        A list of (longitude, latitude) coordinates
+    return_projections : bool, optional
+        Whether to also return the projections of the points onto the route (default: False)
+
+    Returns:
+    ----------
+    numpy.ndarray or tuple
+        The estimated detour for every point in meters, and with return_projections the
+        (N, 2) array of the projected points
+    """
+    if not points:
+        return (np.empty(0), np.empty((0, 2))) if return_projections else np.empty(0)
+    coords = np.asarray(points, dtype=float)
+    positions = shapely.line_locate_point(route_line, shapely.points(coords))
+    projected = shapely.get_coordinates(
+        shapely.line_interpolate_point(route_line, positions)
+    )
+    offsets = haversine_m(coords[:, 0], coords[:, 1], projected[:, 0], projected[:, 1])
+    if return_projections:
+        return 2 * offsets, projected
+    return 2 * offsets
@@ -0,0 +1,362 @@
+import codecs
+import json
+import math
+
+import shapely
+from services.columnar import UNKNOWN_SAFETY_SCORE
+
+# Safety score of preferred polygons imported without one; any score above 1 marks a
+# preferred area
+DEFAULT_PREFERRED_SCORE = 2.0
+
+
+class GeoJSONError(ValueError):
+    """
+    Raised if a GeoJSON upload is malformed or contains invalid features.
+
+    Attributes:
+    ----------
+    errors : list
+        Messages of the invalid features, e.g. "Feature 3: Polygon holes are not supported".
+    """
+
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        self.errors = errors or []
+
+
+class _JSONStream:
+    """
+    Reads consecutive JSON values from a byte or text stream without loading it at once.
+    """
+
+    def __init__(self, stream, chunk_size):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self.buffer = ""
+        self.pos = 0
+        self.consumed = 0  # characters dropped from the front of the buffer
+        self.eof = False
+
+    def _fill(self, size=None):
+        """
+        Appends the next chunk of the stream to the buffer. Returns False at the end.
+        """
+        if self.eof:
+            return False
+        if self.pos > self.chunk_size:
+            self.consumed += self.pos
+            self.buffer = self.buffer[self.pos :]
+            self.pos = 0
+        chunk = self.stream.read(size or self.chunk_size)
+        if isinstance(chunk, bytes):
+            chunk = self.text_decoder.decode(chunk, final=not chunk)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer += chunk
+        return True
+
+    def error(self, message):
+        return GeoJSONError(f"{message} at character {self.consumed + self.pos}")
+
+    def peek(self):
+        """
+        Returns the next non-whitespace character without consuming it, "" at the end.
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\n\r":
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self._fill():
+                return self.buffer[self.pos : self.pos + 1]
+
+    def expect(self, characters):
+        """
+        Consumes the next non-whitespace character, which must be one of characters.
+        """
+        character = self.peek()
+        if not character or character not in characters:
+            raise self.error(f"Expected {' or '.join(repr(c) for c in characters)}")
+        self.pos += 1
+        return character
+
+    def value(self):
+        """
+        Consumes and returns the next JSON value.
+        """
+        if not self.peek():
+            raise self.error("Unexpected end of data")
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # The value may continue in the next chunk; read more the longer it gets
+                if self._fill(max(self.chunk_size, len(self.buffer) - self.pos)):
+                    continue
+                raise self.error("Invalid JSON") from None
+            # A number at the end of the buffer may still be incomplete
+            if end == len(self.buffer) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_features(stream, chunk_size=1 << 16):
+    """
+    Parses a GeoJSON FeatureCollection incrementally and yields its features one by one.
+
+    Only the feature being parsed is held in memory, so large uploads can be validated
+    while they are still being received.
+
+    Parameters:
+    ----------
+    stream : file-like object
+        A binary (UTF-8) or text stream with a FeatureCollection
+    chunk_size : int, optional
+        Number of bytes read from the stream at once (default: 65536)
+
+    Yields:
+    ----------
+    object
+        The features in the order of the collection.
+
+    Raises:
+    ----------
+    GeoJSONError
+        If the stream is not valid JSON or not a FeatureCollection.
+    """
+    reader = _JSONStream(stream, chunk_size)
+    reader.expect("{")
+    has_features = False
+    if reader.peek() == "}":
+        reader.pos += 1
+    else:
+        while True:
+            key = reader.value()
+            if not isinstance(key, str):
+                raise reader.error("Expected a member name")
+            reader.expect(":")
+            if key == "features":
+                has_features = True
+                reader.expect("[")
+                if reader.peek() == "]":
+                    reader.pos += 1
+                else:
+                    while True:
+                        yield reader.value()
+                        if reader.expect(",]") == "]":
+                            break
+            else:
+                value = reader.value()
+                if key == "type" and value != "FeatureCollection":
+                    raise GeoJSONError("Expected a GeoJSON FeatureCollection")
+            if reader.expect(",}") == "}":
+                break
+    if reader.peek():
+        raise reader.error("Unexpected data after the FeatureCollection")
+    if not has_features:
+        raise GeoJSONError("The FeatureCollection has no features member")
+
+
+def _position(position):
+    """
+    Validates a GeoJSON position and returns it as [longitude, latitude].
+    """
+    if (
+        not isinstance(position, list)
+        or len(position) < 2
+        or not all(
+            isinstance(value, (int, float)) and not isinstance(value, bool)
+            for value in position[:2]
+        )
+    ):
+        raise ValueError("Positions must be [longitude, latitude] numbers")
+    longitude, latitude = float(position[0]), float(position[1])
+    if not (-180 <= longitude <= 180 and -90 <= latitude <= 90):
+        raise ValueError(f"Position {position[:2]} is out of range")
+    return [longitude, latitude]
+
+
+def _ring(rings):
+    """
+    Validates the rings of a GeoJSON polygon and returns its closed exterior ring.
+    """
+    if not isinstance(rings, list) or not rings:
+        raise ValueError("A Polygon needs an exterior ring")
+    if len(rings) > 1:
+        raise ValueError("Polygon holes are not supported")
+    if not isinstance(rings[0], list):
+        raise ValueError("A Polygon ring must be a list of positions")
+    ring = [_position(position) for position in rings[0]]
+    if ring and ring[0] != ring[-1]:
+        ring.append(ring[0])  # Routing calls expect closed loops
+    if len(ring) < 4:
+        raise ValueError("A Polygon ring needs at least 3 distinct positions")
+    reason = shapely.is_valid_reason(shapely.Polygon(ring))
+    if reason != "Valid Geometry":
+        # e.g. "Self-intersection[9.185 48.785]" of a bowtie shaped ring
+        raise ValueError(f"Invalid Polygon ring: {reason}")
+    return ring
+
+
+def _safety_score(properties):
+    """
+    Validates the safety score of a polygon feature from its properties. A missing or null
+    score is unknown: preferred polygons get DEFAULT_PREFERRED_SCORE and heatmap polygons
+    UNKNOWN_SAFETY_SCORE, like heatmap polygons loaded from CSV files without a score.
+    """
+    kind = properties.get("kind")
+    score = properties.get("safetyScore")
+    if score is None and kind == "preferred":
+        return DEFAULT_PREFERRED_SCORE
+    if score is None and kind == "heatmap":
+        return UNKNOWN_SAFETY_SCORE
+    if (
+        not isinstance(score, (int, float))
+        or isinstance(score, bool)
+        or not math.isfinite(score)
+        or score < 0
+    ):
+        raise ValueError("Polygons need a non-negative numeric safetyScore property")
+    if kind == "preferred" and score <= 1:
+        raise ValueError("Preferred polygons need a safetyScore above 1")
+    if kind == "heatmap" and score > 1:
+        raise ValueError("Heatmap polygons need a safetyScore of at most 1")
+    return float(score)
+
+
+def read_feature_collection(stream, max_features=None, max_errors=20):
+    """
+    Reads and validates the polygons and safe places of a GeoJSON FeatureCollection.
+
+    Polygon and MultiPolygon features become heatmap polygons with the safetyScore of
+    their properties; scores above 1, or the property kind "preferred", mark preferred
+    areas. Point and MultiPoint features become safe places. Rings are closed if needed,
+    and self-intersecting rings are rejected.
+
+    Parameters:
+    ----------
+    stream : file-like object
+        A binary (UTF-8) or text stream with a FeatureCollection
+    max_features : int, optional
+        Maximum number of features accepted (default: no limit)
+    max_errors : int, optional
+        Number of invalid features after which reading stops (default: 20)
+
+    Returns:
+    ----------
+    tuple
+        The polygons as lists of [longitude, latitude] positions, their safety scores, and
+        the safe places as [longitude, latitude] positions.
+
+    Raises:
+    ----------
+    GeoJSONError
+        If the stream is malformed, holds more than max_features features or any invalid
+        feature. Its errors list the invalid features.
+    """
+    polygons = []
+    safety_scores = []
+    safe_places = []
+    errors = []
+    for index, feature in enumerate(iter_features(stream)):
+        if max_features is not None and index >= max_features:
+            raise GeoJSONError(f"More than {max_features} features")
+        try:
+            if not isinstance(feature, dict) or feature.get("type") != "Feature":
+                raise ValueError("Expected a Feature")
+            geometry = feature.get("geometry")
+            properties = feature.get("properties") or {}
+            if not isinstance(geometry, dict) or not isinstance(properties, dict):
+                raise ValueError("A Feature needs a geometry and properties objects")
+            geometry_type = geometry.get("type")
+            coordinates = geometry.get("coordinates")
+            if geometry_type in ("Polygon", "MultiPolygon"):
+                parts = [coordinates] if geometry_type == "Polygon" else coordinates
+                if not isinstance(parts, list) or not parts:
+                    raise ValueError("A MultiPolygon needs at least one polygon")
+                score = _safety_score(properties)
+                rings = [_ring(part) for part in parts]
+                polygons.extend(rings)
+                safety_scores.extend([score] * len(rings))
+            elif geometry_type in ("Point", "MultiPoint"):
+                points = [coordinates] if geometry_type == "Point" else coordinates
+                if not isinstance(points, list) or not points:
+                    raise ValueError("A MultiPoint needs at least one position")
+                safe_places.extend(_position(point) for point in points)
+            else:
+                raise ValueError(f"Unsupported geometry type {geometry_type!r}")
+        except ValueError as e:
+            errors.append(f"Feature {index}: {e}")
+            if len(errors) >= max_errors:
+                break
+    if errors:
+        raise GeoJSONError(f"{len(errors)} invalid features, nothing was imported", errors)
+    return polygons, safety_scores, safe_places
+
+
+def iter_feature_collection(snapshot, batch_size=1000):
+    """
+    Serializes the heatmap data of a snapshot as a GeoJSON FeatureCollection in chunks.
+
+    The output can be imported again with read_feature_collection: heatmap polygons carry
+    the kind "heatmap" and their safetyScore, preferred polygons the kind "preferred" and
+    their safetyScore (DEFAULT_PREFERRED_SCORE if unknown) and safe places the kind
+    "safePlace". Rings with less than four positions are skipped.
+
+    Parameters:
+    ----------
+    snapshot : GeoSnapshot
+        The heatmap data
+    batch_size : int, optional
+        Number of features serialized per chunk (default: 1000)
+
+    Yields:
+    ----------
+    str
+        Consecutive parts of the JSON document.
+    """
+    polygons = snapshot.polygons
+    offsets = polygons.offsets
+
+    def polygon_features(ids, kind):
+        for i in ids:
+            if offsets[i + 1] - offsets[i] < 4:
+                continue
+            score = float(polygons.scores[i])
+            if not math.isfinite(score):
+                score = DEFAULT_PREFERRED_SCORE if kind == "preferred" else UNKNOWN_SAFETY_SCORE
+            properties = {"kind": kind, "safetyScore": score}
+            yield {
+                "type": "Feature",
+                "geometry": {"type": "Polygon", "coordinates": [polygons.ring(i).tolist()]},
+                "properties": properties,
+            }
+
+    def safe_place_features():
+        for point in snapshot.safe_places.tolist():
+            yield {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": point},
+                "properties": {"kind": "safePlace"},
+            }
+
+    def features():
+        yield from polygon_features(snapshot.heatmap_ids, "heatmap")
+        yield from polygon_features(snapshot.preferred_ids, "preferred")
+        yield from safe_place_features()
+
+    yield '{"type":"FeatureCollection","features":['
+    separator = ""
+    batch = []
+    for feature in features():
+        batch.append(json.dumps(feature, separators=(",", ":")))
+        if len(batch) >= batch_size:
+            yield separator + ",".join(batch)
+            separator = ","
+            batch = []
+    if batch:
+        yield separator + ",".join(batch)
+    yield "]}"
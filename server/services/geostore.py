@@ -0,0 +1,978 @@
+import csv
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import cached_property
+
+import numpy as np
+
+from services.columnar import (
+    KIND_BAD,
+    KIND_PREFERRED,
+    UNKNOWN_SAFETY_SCORE,
+    PolygonArrays,
+    load_binary,
+    save_binary,
+)
+from services.journal import Journal
+from services.spatial_index import SpatialIndex
+
+try:
+    import fcntl
+except ImportError:  # Windows, where only a single server process may use a data directory
+    fcntl = None
+
+
+def _checked_polygon(polygon):
+    """
+    Returns a polygon as a list of [longitude, latitude] positions, or raises ValueError.
+    """
+    try:
+        ring = np.array(polygon, dtype=float)
+    except (TypeError, ValueError):
+        ring = None
+    if ring is None or ring.ndim != 2 or ring.shape[1] < 2 or not np.isfinite(ring).all():
+        raise ValueError(f"A polygon needs a list of [longitude, latitude] positions: {polygon!r}")
+    return ring[:, :2].tolist()
+
+
+def _checked_position(coordinates):
+    """
+    Returns a position as [longitude, latitude], or raises ValueError.
+    """
+    try:
+        position = np.array(coordinates, dtype=float)
+    except (TypeError, ValueError):
+        position = None
+    if position is None or position.shape not in ((2,), (3,)) or not np.isfinite(position).all():
+        raise ValueError(f"A position needs a longitude and a latitude: {coordinates!r}")
+    return position[:2].tolist()
+
+
+def _checked_score(safety_score):
+    """
+    Returns a safety score as a finite float, or raises ValueError.
+    """
+    try:
+        score = float(safety_score)
+    except (TypeError, ValueError):
+        score = math.nan
+    if not math.isfinite(score):
+        raise ValueError(f"A safety score needs to be a finite number: {safety_score!r}")
+    return score
+
+
+class GeoSnapshot:
+    """
+    GeoSnapshot class.
+
+    An immutable version of the heatmap data. Edits never change a snapshot, they create a
+    new one, so readers can keep using the snapshot they started with while other threads
+    publish edits.
+
+    The polygons are stored in columnar arrays (see services.columnar.PolygonArrays), which
+    may be memory-mapped from a binary snapshot file. The list attributes are only built
+    when they are first used, e.g. to answer the heatmap endpoint.
+
+    Attributes:
+    ----------
+    version : int
+        The data version of the snapshot.
+    polygons : PolygonArrays
+        The bad and preferred polygons with their scores and kinds.
+    safe_places : numpy.ndarray
+        The (K, 2) array of safe place coordinates.
+    heatmap_ids : numpy.ndarray
+        The indices of the bad polygons in polygons.
+    preferred_ids : numpy.ndarray
+        The indices of the preferred polygons in polygons.
+    heatmap_scores : numpy.ndarray
+        The safety scores of the bad polygons.
+    heatmap_coords : list
+        List of bad polygon coordinates.
+    safety_scores : list
+        List of safety scores corresponding to the bad polygon coordinates.
+    safe_place_coords : list
+        List of safe place coordinates.
+    preferred_coords : list
+        List of preferred polygon coordinates.
+    heatmap_index : SpatialIndex
+        Spatial index over the bad polygons, built on first use.
+    safe_place_index : SpatialIndex
+        Spatial index over the safe places, built on first use.
+    preferred_index : SpatialIndex
+        Spatial index over the preferred polygons, built on first use.
+
+    Methods:
+    ----------
+    with_polygon(polygon, safety_score) : GeoSnapshot
+        Returns the next snapshot with the polygon added.
+    with_polygons(polygons, safety_scores) : GeoSnapshot
+        Returns the next snapshot with several polygons added.
+    with_safe_place(coordinates) : GeoSnapshot
+        Returns the next snapshot with the safe place added.
+    with_safe_places(coordinates) : GeoSnapshot
+        Returns the next snapshot with several safe places added.
+
+    Notes:
+    -----
+    The arrays must not be mutated, they are shared between snapshots.
+    """
+
+    def __init__(self, version, polygons, safe_places):
+        self.version = version
+        self.polygons = polygons
+        self.safe_places = safe_places
+
+    @classmethod
+    def empty(cls):
+        return cls(0, PolygonArrays.empty(), np.empty((0, 2)))
+
+    @cached_property
+    def heatmap_ids(self):
+        return self.polygons.select(KIND_BAD)
+
+    @cached_property
+    def preferred_ids(self):
+        return self.polygons.select(KIND_PREFERRED)
+
+    @cached_property
+    def heatmap_scores(self):
+        return self.polygons.scores[self.heatmap_ids]
+
+    @cached_property
+    def heatmap_coords(self):
+        return [self.polygons.ring(i).tolist() for i in self.heatmap_ids]
+
+    @cached_property
+    def safety_scores(self):
+        return self.heatmap_scores.tolist()
+
+    @cached_property
+    def safe_place_coords(self):
+        return self.safe_places.tolist()
+
+    @cached_property
+    def preferred_coords(self):
+        return [self.polygons.ring(i).tolist() for i in self.preferred_ids]
+
+    @cached_property
+    def polygon_geometries(self):
+        return SpatialIndex.from_rings(
+            self.polygons.coords, self.polygons.offsets
+        ).geometries
+
+    @cached_property
+    def heatmap_index(self):
+        return SpatialIndex(self.polygon_geometries[self.heatmap_ids])
+
+    @cached_property
+    def safe_place_index(self):
+        return SpatialIndex.from_points(self.safe_places)
+
+    @cached_property
+    def preferred_index(self):
+        return SpatialIndex(self.polygon_geometries[self.preferred_ids])
+
+    def with_polygon(self, polygon, safety_score):
+        """
+        Returns the next snapshot with a closed polygon added.
+
+        Parameters:
+        ----------
+        polygon : list
+            The list of coordinates defining the closed polygon.
+        safety_score : float
+            The safety score associated with the polygon. Polygons with a score above 1 are
+            preferred areas.
+
+        Returns:
+        ----------
+        GeoSnapshot
+            The new snapshot.
+        """
+        return self.with_polygons([polygon], [safety_score])
+
+    def with_polygons(self, polygons, safety_scores):
+        """
+        Returns the next snapshot with closed polygons added.
+
+        Parameters:
+        ----------
+        polygons : list
+            The lists of coordinates defining the closed polygons.
+        safety_scores : list
+            The safety score of every polygon. Polygons with a score above 1 are preferred
+            areas.
+
+        Returns:
+        ----------
+        GeoSnapshot
+            The new snapshot.
+        """
+        kinds = [
+            KIND_PREFERRED if safety_score > 1 else KIND_BAD # Higher or lower priority areas
+            for safety_score in safety_scores
+        ]
+        snapshot = GeoSnapshot(
+            self.version + 1,
+            self.polygons.append(polygons, safety_scores, kinds),
+            self.safe_places,
+        )
+        self._share_indexes(snapshot, "safe_place_index")
+        if KIND_BAD not in kinds:
+            self._share_indexes(snapshot, "heatmap_index")
+        if KIND_PREFERRED not in kinds:
+            self._share_indexes(snapshot, "preferred_index")
+        if "polygon_geometries" in self.__dict__:
+            # Only build the geometries of the new polygons
+            added = PolygonArrays.from_lists(polygons, safety_scores, kinds)
+            snapshot.polygon_geometries = np.concatenate([
+                self.polygon_geometries,
+                SpatialIndex.from_rings(added.coords, added.offsets).geometries,
+            ])
+        return snapshot
+
+    def with_safe_place(self, coordinates):
+        """
+        Returns the next snapshot with a safe place added.
+
+        Parameters:
+        ----------
+        coordinates : list
+            The list of coordinates defining the safe place.
+
+        Returns:
+        ----------
+        GeoSnapshot
+            The new snapshot.
+        """
+        return self.with_safe_places([coordinates])
+
+    def with_safe_places(self, coordinates):
+        """
+        Returns the next snapshot with safe places added.
+
+        Parameters:
+        ----------
+        coordinates : list
+            The lists of coordinates defining the safe places.
+
+        Returns:
+        ----------
+        GeoSnapshot
+            The new snapshot.
+        """
+        snapshot = GeoSnapshot(
+            self.version + 1,
+            self.polygons,
+            np.concatenate([
+                self.safe_places, np.array(coordinates, dtype=float).reshape(-1, 2)
+            ]),
+        )
+        self._share_indexes(
+            snapshot, "polygon_geometries", "heatmap_index", "preferred_index"
+        )
+        return snapshot
+
+    def _share_indexes(self, snapshot, *names):
+        """
+        Hands already built indexes over unchanged data on to the next snapshot.
+        """
+        for name in names:
+            if name in self.__dict__:
+                snapshot.__dict__[name] = self.__dict__[name]
+
+
+class GeoStore:
+    """
+    GeoStore class.
+
+    The single in-memory store of the heatmap data that the heatmap endpoints and the
+    routing logic share. Readers take the current GeoSnapshot, writers are serialized, apply
+    their edit once and publish a new snapshot atomically.
+
+    Several server processes can share a data directory. Writers of all processes are
+    serialized by an exclusive lock on a lock file and first catch up with the edits the
+    other processes journaled, so every process appends to the same journal in order. The
+    other processes pick the edits up with refresh(), which only costs two stat calls while
+    nothing changed.
+
+    The data is persisted as a binary snapshot file that is memory-mapped on startup and as
+    CSV files, which remain the format to import and export the data. Edits made to the CSV
+    files while the server is stopped are picked up because they are newer than the binary
+    snapshot.
+
+    Attributes:
+    ----------
+    data_dir : str
+        The directory where the CSV files, the binary snapshot and the journal are stored.
+    snapshot : GeoSnapshot
+        The current version of the data.
+    journal : Journal
+        The journal of edits made since the last CSV snapshot.
+    journal_compaction_threshold : int
+        Number of journaled edits after which a snapshot is written.
+    flush_delay_s : float
+        Time in seconds without edits after which the writer thread flushes them to disk.
+    max_flush_delay_s : float
+        Time in seconds after which the writer thread flushes a continuous burst of edits.
+
+    Methods:
+    ----------
+    add_listener(listener) : None
+        Registers a function that is called with every newly published snapshot.
+    add_polygon(polygon, safety_score) : GeoSnapshot
+        Journals and publishes a new closed polygon.
+    add_safe_place(coordinates) : GeoSnapshot
+        Journals and publishes a new safe place.
+    add_batch(polygons, safety_scores, safe_places) : GeoSnapshot
+        Publishes many polygons and safe places at once with a single persistence step.
+    load() : GeoSnapshot
+        Loads the data from the binary snapshot or the CSV files, replays the journal and
+        publishes the result.
+    refresh() : GeoSnapshot
+        Publishes the edits other processes made to the data directory since the last call.
+    flush() : None
+        Syncs the journal and writes a snapshot if it grew too long.
+    save_snapshot(snapshot=None) : None
+        Writes the data to the CSV files and the binary snapshot and empties the journal.
+    save_binary_snapshot(snapshot=None, journal_generation=-1) : None
+        Writes the data to the binary snapshot file.
+    close() : None
+        Flushes pending edits, stops the writer thread and closes the journal.
+
+    Notes:
+    -----
+    Edits are appended to a journal, so their cost does not grow with the size of the data. The
+    snapshot files are only rewritten every journal_compaction_threshold edits, by a writer
+    thread that waits until a burst of edits is over, so the burst is written once and off the
+    request that made the edit.
+
+    Writing a snapshot survives a crash at any step. The binary snapshot stores the journal
+    generation it contains, so a journal that was not reset yet is not replayed a second
+    time. The CSV files are rewritten one by one, so a marker file is kept until the binary
+    snapshot is written; if it is left behind, the CSV files may be a mix of old and new ones
+    and are written again from the binary snapshot.
+    """
+
+    def __init__(
+        self,
+        data_dir,
+        journal_compaction_threshold=1000,
+        flush_delay_s=0.5,
+        max_flush_delay_s=5.0,
+    ):
+        """
+        Initializes the GeoStore instance and loads the data from the specified directory.
+
+        Parameters:
+        ----------
+        data_dir : str
+            The directory where the CSV files are stored.
+        journal_compaction_threshold : int, optional
+            Number of journaled edits after which a snapshot is written (default: 1000)
+        flush_delay_s : float, optional
+            Time in seconds without edits after which they are flushed (default: 0.5)
+        max_flush_delay_s : float, optional
+            Time in seconds after which a continuous burst of edits is flushed (default: 5.0)
+        """
+        self.data_dir = data_dir
+        self.binary_snapshot_path = os.path.join(data_dir, "heatmap_snapshot.bin")
+        self.pending_snapshot_path = os.path.join(data_dir, "heatmap_snapshot.pending")
+        self.heatmap_coords_path = os.path.join(data_dir, "heatmap_coords.csv")
+        self.safety_scores_path = os.path.join(data_dir, "safety_scores.csv")
+        self.safe_place_coords_path = os.path.join(data_dir, "safe_place_coords.csv")
+        self.preferred_coords_path = os.path.join(data_dir, "preferred_coords.csv")
+        self.lock_path = os.path.join(data_dir, "heatmap.lock")
+        self.journal = Journal(os.path.join(data_dir, "heatmap_journal.jsonl"))
+        self.journal_compaction_threshold = journal_compaction_threshold
+        self.flush_delay_s = flush_delay_s
+        self.max_flush_delay_s = max_flush_delay_s
+        self.journal_length = 0
+        self.snapshot = GeoSnapshot.empty()
+        self._listeners = []
+        self._write_lock = threading.RLock()
+        self._lock_file = None
+        self._lock_pid = None
+        self._lock_depth = 0
+        self._snapshot_key = None  # identity of the loaded binary snapshot file
+        self._journal_offset = 0  # bytes of the journal included in the snapshot
+        self._flush_condition = threading.Condition()
+        self._flush_pending = False
+        self._last_edit = 0.0
+        self._writer = None
+        self._closed = False
+        self.load()
+
+    def add_listener(self, listener):
+        """
+        Registers a function that is called with every newly published snapshot.
+
+        Parameters:
+        ----------
+        listener : callable
+            A function taking the new GeoSnapshot.
+        """
+        self._listeners.append(listener)
+
+    def add_polygon(self, polygon, safety_score):
+        """
+        Journals and publishes a new closed polygon. The edit is validated before it is
+        journaled, so a rejected edit never reaches the journal.
+
+        Parameters:
+        ----------
+        polygon : list
+            The list of coordinates defining the closed polygon.
+        safety_score : float
+            The safety score associated with the polygon.
+
+        Returns:
+        ----------
+        GeoSnapshot
+            The published snapshot.
+
+        Raises:
+        ----------
+        ValueError
+            If the polygon or the safety score is invalid.
+        """
+        polygon = _checked_polygon(polygon)
+        safety_score = _checked_score(safety_score)
+        with self._exclusive():
+            snapshot = self.snapshot.with_polygon(polygon, safety_score)
+            self._append_to_journal(
+                {"op": "add_polygon", "polygon": polygon, "safetyScore": safety_score}
+            )
+            return self._publish(snapshot)
+
+    def add_safe_place(self, coordinates):
+        """
+        Journals and publishes a new safe place, validated before it is journaled.
+
+        Parameters:
+        ----------
+        coordinates : list
+            The list of coordinates defining the safe place.
+
+        Returns:
+        ----------
+        GeoSnapshot
+            The published snapshot.
+
+        Raises:
+        ----------
+        ValueError
+            If the coordinates are invalid.
+        """
+        coordinates = _checked_position(coordinates)
+        with self._exclusive():
+            snapshot = self.snapshot.with_safe_place(coordinates)
+            self._append_to_journal({"op": "add_safe_place", "coordinates": coordinates})
+            return self._publish(snapshot)
+
+    def add_batch(self, polygons, safety_scores, safe_places):
+        """
+        Publishes many closed polygons and safe places at once as a single new version.
+
+        Batches smaller than journal_compaction_threshold are journaled as one record. Larger
+        ones are written straight to a new snapshot instead, so importing a whole dataset
+        costs a single rewrite of the data files.
+
+        Parameters:
+        ----------
+        polygons : list
+            The lists of coordinates defining the closed polygons.
+        safety_scores : list
+            The safety score of every polygon. Polygons with a score above 1 are preferred
+            areas.
+        safe_places : list
+            The coordinates of the safe places.
+
+        Returns:
+        ----------
+        GeoSnapshot
+            The published snapshot.
+
+        Raises:
+        ----------
+        ValueError
+            If a polygon, safety score or safe place is invalid. Nothing is added then.
+        """
+        if len(polygons) != len(safety_scores):
+            raise ValueError("Every polygon needs a safety score")
+        polygons = [_checked_polygon(polygon) for polygon in polygons]
+        safety_scores = [_checked_score(safety_score) for safety_score in safety_scores]
+        safe_places = [_checked_position(coordinates) for coordinates in safe_places]
+        with self._exclusive():
+            snapshot = self.snapshot
+            if polygons:
+                snapshot = snapshot.with_polygons(polygons, safety_scores)
+            if safe_places:
+                snapshot = snapshot.with_safe_places(safe_places)
+            edits = len(polygons) + len(safe_places)
+            if edits >= self.journal_compaction_threshold:
+                # The journaled edits are part of the snapshot, so the journal is emptied
+                self.save_snapshot(snapshot)
+            elif edits:
+                self._append_to_journal(
+                    {
+                        "op": "add_batch",
+                        "polygons": polygons,
+                        "safetyScores": safety_scores,
+                        "safePlaces": safe_places,
+                    },
+                    edits,
+                )
+            return self._publish(snapshot)
+
+    def _append_to_journal(self, record, edits=1):
+        """
+        Appends an edit to the journal before it is published and wakes the writer thread.
+        """
+        self.journal.append(record)
+        self.journal_length += edits
+        self._journal_offset = self._file_size(self.journal.path)
+        self._request_flush()
+
+    def _publish(self, snapshot):
+        """
+        Makes the snapshot the current one, notifies the listeners and has the writer thread
+        write a snapshot if the journal grew too long.
+        """
+        self.snapshot = snapshot
+        for listener in self._listeners:
+            listener(snapshot)
+        if self.journal_length >= self.journal_compaction_threshold:
+            self._request_flush()
+        return snapshot
+
+    def _apply_records(self, snapshot, records):
+        """
+        Applies journal records to a snapshot in one batch and returns the new snapshot and
+        the number of edits applied. Invalid records, e.g. journaled by older versions that
+        did not validate edits first, are skipped.
+        """
+        polygons = []
+        safety_scores = []
+        safe_places = []
+        for record in records:
+            try:
+                if record["op"] == "add_polygon":
+                    new_polygons = [_checked_polygon(record["polygon"])]
+                    new_scores = [_checked_score(record["safetyScore"])]
+                    new_safe_places = []
+                elif record["op"] == "add_safe_place":
+                    new_polygons, new_scores = [], []
+                    new_safe_places = [_checked_position(record["coordinates"])]
+                elif record["op"] == "add_batch":
+                    new_polygons = [_checked_polygon(polygon) for polygon in record["polygons"]]
+                    new_scores = [_checked_score(score) for score in record["safetyScores"]]
+                    new_safe_places = [_checked_position(place) for place in record["safePlaces"]]
+                    if len(new_polygons) != len(new_scores):
+                        raise ValueError("Every polygon needs a safety score")
+                else:
+                    print(f"Ignoring unknown journal record: {record['op']}")
+                    continue
+            except (KeyError, TypeError, ValueError) as e:
+                print(f"Ignoring invalid journal record: {e}")
+                continue
+            polygons.extend(new_polygons)
+            safety_scores.extend(new_scores)
+            safe_places.extend(new_safe_places)
+
+        if polygons:
+            snapshot = snapshot.with_polygons(polygons, safety_scores)
+        if safe_places:
+            snapshot = snapshot.with_safe_places(safe_places)
+        return snapshot, len(polygons) + len(safe_places)
+
+    def load(self):
+        """
+        Loads the data, replays the journal on top of it and publishes the result.
+
+        The binary snapshot is memory-mapped if it is at least as new as the CSV files.
+        Otherwise the CSV files are imported and a new binary snapshot is written.
+
+        Returns:
+        ----------
+        GeoSnapshot
+            The published snapshot.
+        """
+        with self._exclusive(catch_up=False):
+            return self._load()
+
+    def _load(self):
+        """
+        Loads the data while the data directory is locked.
+        """
+        interrupted = os.path.exists(self.pending_snapshot_path)
+        included_generation = None
+        if self._binary_snapshot_is_current() or (
+            interrupted and os.path.exists(self.binary_snapshot_path)
+        ):
+            arrays = load_binary(self.binary_snapshot_path)
+            scores = arrays["scores"]
+            unknown = np.isnan(scores) & (arrays["kinds"] == KIND_BAD)
+            if unknown.any():
+                # Written by versions that kept unknown heatmap scores as NaN
+                scores = np.where(unknown, UNKNOWN_SAFETY_SCORE, scores)
+            polygons = PolygonArrays(arrays["coords"], arrays["offsets"], scores, arrays["kinds"])
+            snapshot = GeoSnapshot(0, polygons, arrays["safe_places"])
+            if "journal_generation" in arrays:
+                included_generation = int(arrays["journal_generation"][0])
+            self._snapshot_key = self._file_key(self.binary_snapshot_path)
+        else:
+            snapshot = self._load_csv()
+            self.save_binary_snapshot(snapshot)
+
+        # Replay the edits made since the last snapshot
+        generation = self.journal.read_generation()
+        records, self._journal_offset = self.journal.read_from(0)
+        if generation is None:
+            # Journals written before generations were stored are upgraded in place
+            generation = 0 if included_generation is None else included_generation + 1
+            self.journal.reset(generation, records)
+            self._journal_offset = self._file_size(self.journal.path)
+        elif generation == included_generation:
+            # A crash left the journal behind after its records were written to the snapshot
+            records = []
+            generation += 1
+            self.journal.reset(generation)
+            self._journal_offset = self._file_size(self.journal.path)
+        self.journal.generation = generation
+        snapshot, self.journal_length = self._apply_records(snapshot, records)
+
+        snapshot = self._publish(
+            GeoSnapshot(self.snapshot.version + 1, snapshot.polygons, snapshot.safe_places)
+        )
+        if interrupted:
+            print("Rewriting the heatmap snapshot after an interrupted write")
+            self.save_snapshot()
+        return snapshot
+
+    def refresh(self):
+        """
+        Publishes the edits other processes made to the data directory since the last call.
+
+        Without changes this only compares the binary snapshot and the journal file with the
+        state they were read in, so it can be called before every request.
+
+        Returns:
+        ----------
+        GeoSnapshot
+            The current snapshot.
+        """
+        if (
+            self._file_key(self.binary_snapshot_path) != self._snapshot_key
+            or self._file_size(self.journal.path) != self._journal_offset
+        ):
+            with self._exclusive():
+                pass  # Catching up is part of locking the data directory
+        return self.snapshot
+
+    def _catch_up(self):
+        """
+        Applies the edits other processes made while the data directory is locked: the records
+        they appended to the journal, or everything if they wrote a new snapshot.
+        """
+        if (
+            self._file_key(self.binary_snapshot_path) != self._snapshot_key
+            or self._file_size(self.journal.path) < self._journal_offset
+        ):
+            self._load()
+            return
+        records, self._journal_offset = self.journal.read_from(self._journal_offset)
+        if records:
+            snapshot, edits = self._apply_records(self.snapshot, records)
+            self.journal_length += edits
+            self._publish(snapshot)
+
+    @contextmanager
+    def _exclusive(self, catch_up=True):
+        """
+        Serializes writers of this and all other processes sharing the data directory and
+        brings the snapshot up to date with the edits of the other processes. Reentrant.
+        """
+        with self._write_lock:
+            if self._lock_depth == 0:
+                self._lock_data_dir()
+            self._lock_depth += 1
+            try:
+                if self._lock_depth == 1 and catch_up:
+                    self._catch_up()
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    self._unlock_data_dir()
+
+    def _lock_data_dir(self):
+        if fcntl is None:
+            return
+        if self._lock_pid != os.getpid():
+            # Locks belong to an open file, so a forked process needs a file of its own
+            self._lock_file = open(self.lock_path, mode="a")
+            self._lock_pid = os.getpid()
+        fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+
+    def _unlock_data_dir(self):
+        if fcntl is not None:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    @staticmethod
+    def _file_key(path):
+        """
+        Returns what identifies a version of a file that is replaced by renaming, or None.
+        """
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    @staticmethod
+    def _file_size(path):
+        try:
+            return os.path.getsize(path)
+        except FileNotFoundError:
+            return 0
+
+    def _request_flush(self):
+        """
+        Tells the writer thread that there are edits to flush, starting it if needed.
+        """
+        with self._flush_condition:
+            self._flush_pending = True
+            self._last_edit = time.monotonic()
+            # Threads do not survive a fork, so the writer is started in the process using it
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(
+                    target=self._flush_loop, name="geostore-writer", daemon=True
+                )
+                self._writer.start()
+            self._flush_condition.notify()
+
+    def _flush_loop(self):
+        """
+        Runs the writer thread: waits until a burst of edits is over, at most
+        max_flush_delay_s, and flushes the whole burst at once.
+        """
+        while True:
+            with self._flush_condition:
+                while not self._flush_pending and not self._closed:
+                    self._flush_condition.wait()
+                if not self._flush_pending:
+                    return
+                deadline = time.monotonic() + self.max_flush_delay_s
+                while not self._closed:
+                    remaining = (
+                        min(self._last_edit + self.flush_delay_s, deadline) - time.monotonic()
+                    )
+                    if remaining <= 0:
+                        break
+                    self._flush_condition.wait(remaining)
+                self._flush_pending = False
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"An Exception occured while flushing the heatmap data: {e}")
+
+    def flush(self):
+        """
+        Syncs the journal to disk and writes a snapshot if the journal grew too long.
+
+        Called by the writer thread once a burst of edits is over.
+        """
+        with self._exclusive():
+            if self.journal_length >= self.journal_compaction_threshold:
+                self.save_snapshot()
+            else:
+                self.journal.sync()
+
+    def _binary_snapshot_is_current(self):
+        """
+        Returns whether the binary snapshot exists and no CSV file was changed after it.
+        """
+        if not os.path.exists(self.binary_snapshot_path):
+            return False
+        snapshot_mtime = os.path.getmtime(self.binary_snapshot_path)
+        return all(
+            os.path.getmtime(path) <= snapshot_mtime
+            for path in (
+                self.heatmap_coords_path,
+                self.safety_scores_path,
+                self.safe_place_coords_path,
+                self.preferred_coords_path,
+            )
+        )
+
+    def _load_csv(self):
+        """
+        Imports the data from the CSV files.
+        """
+        # Load heatmap_coords and safety_scores
+        heatmap_coords, heatmap_offsets = self._read_polygons_csv(self.heatmap_coords_path)
+        with open(self.safety_scores_path, mode="r", encoding="utf-8") as file:
+            safety_scores = [float(row[0]) for row in csv.reader(file) if row]
+
+        # Load safe_place_coords
+        with open(self.safe_place_coords_path, mode="r", encoding="utf-8") as file:
+            safe_places = np.array(
+                [row[:2] for row in csv.reader(file) if row], dtype=float
+            ).reshape(-1, 2)
+
+        # Load preferred_coords, their scores are not stored
+        preferred_coords, preferred_offsets = self._read_polygons_csv(
+            self.preferred_coords_path
+        )
+
+        heatmap_count = len(heatmap_offsets) - 1
+        preferred_count = len(preferred_offsets) - 1
+        scores = np.full(heatmap_count + preferred_count, np.nan)
+        scores[:heatmap_count] = UNKNOWN_SAFETY_SCORE  # for heatmap rows without a score
+        count = min(heatmap_count, len(safety_scores))
+        scores[:count] = safety_scores[:count]
+        polygons = PolygonArrays(
+            np.concatenate([heatmap_coords, preferred_coords]),
+            np.concatenate([heatmap_offsets, heatmap_offsets[-1] + preferred_offsets[1:]]),
+            scores,
+            np.repeat(
+                np.array([KIND_BAD, KIND_PREFERRED], dtype=np.int8),
+                [heatmap_count, preferred_count],
+            ),
+        )
+        return GeoSnapshot(0, polygons, safe_places)
+
+    @staticmethod
+    def _read_polygons_csv(path):
+        """
+        Reads a CSV file of polygons separated by empty rows into coordinate and offset arrays.
+        """
+        with open(path, mode="r", encoding="utf-8") as file:
+            rows = list(csv.reader(file))
+        # A polygon is only complete once its separating empty row was written
+        ends = [i for i, row in enumerate(rows) if not row]
+        rows = rows[: ends[-1]] if ends else []
+        coords = np.array([row[:2] for row in rows if row], dtype=float).reshape(-1, 2)
+        offsets = np.zeros(len(ends) + 1, dtype=np.int64)
+        offsets[1:] = np.array(ends, dtype=np.int64) - np.arange(len(ends))
+        return coords, offsets
+
+    def save_snapshot(self, snapshot=None):
+        """
+        Writes the data to the CSV files and the binary snapshot and empties the journal.
+
+        Parameters:
+        ----------
+        snapshot : GeoSnapshot, optional
+            The data to save, which must include all journaled edits (default: the current
+            snapshot)
+        """
+        with self._exclusive():
+            self.journal.sync()
+            if snapshot is None:
+                snapshot = self.snapshot
+            generation = self.journal.generation
+            # Marks the CSV files as possibly mixed until the binary snapshot is written
+            with open(self.pending_snapshot_path, mode="w") as file:
+                os.fsync(file.fileno())
+            self._save_csv(snapshot)
+            # Written after the CSV files, so it is not considered outdated on the next load
+            self.save_binary_snapshot(snapshot, journal_generation=generation)
+            os.remove(self.pending_snapshot_path)
+            self.journal.reset(generation + 1)
+            self.journal_length = 0
+            self._journal_offset = self._file_size(self.journal.path)
+
+    def save_binary_snapshot(self, snapshot=None, journal_generation=-1):
+        """
+        Writes the data to the binary snapshot file, see services.columnar.save_binary.
+
+        Parameters:
+        ----------
+        snapshot : GeoSnapshot, optional
+            The data to save (default: the current snapshot)
+        journal_generation : int, optional
+            The journal generation whose records the data includes (default: -1, none)
+        """
+        with self._exclusive(catch_up=False):
+            if snapshot is None:
+                snapshot = self.snapshot
+            save_binary(
+                self.binary_snapshot_path,
+                {
+                    "coords": snapshot.polygons.coords,
+                    "offsets": snapshot.polygons.offsets,
+                    "scores": snapshot.polygons.scores,
+                    "kinds": snapshot.polygons.kinds,
+                    "safe_places": snapshot.safe_places,
+                    "journal_generation": np.array([journal_generation], dtype=np.int64),
+                },
+            )
+            self._snapshot_key = self._file_key(self.binary_snapshot_path)
+
+    def _save_csv(self, snapshot):
+        """
+        Saves the heatmap data to CSV files, as part of save_snapshot.
+
+        Every file is written to a temporary file first and then atomically renamed, so a
+        crash never leaves a half written CSV file behind. CSV files newer than the binary
+        snapshot are imported on the next load, so they are only written together with it.
+        """
+        with self._exclusive():
+            polygons = snapshot.polygons
+
+            # Save heatmap_coords
+            with self._atomic_writer(self.heatmap_coords_path) as file:
+                writer = csv.writer(file)
+                for i in snapshot.heatmap_ids:
+                    writer.writerows(polygons.ring(i).tolist())
+                    writer.writerow([])  # Empty row to separate polygons
+
+            # Save safety_scores
+            with self._atomic_writer(self.safety_scores_path) as file:
+                writer = csv.writer(file)
+                for score in snapshot.heatmap_scores.tolist():
+                    writer.writerow([score])
+
+            # Save safe_place_coords
+            with self._atomic_writer(self.safe_place_coords_path) as file:
+                writer = csv.writer(file)
+                writer.writerows(snapshot.safe_places.tolist())
+
+            # Save preferred_coords
+            with self._atomic_writer(self.preferred_coords_path) as file:
+                writer = csv.writer(file)
+                for i in snapshot.preferred_ids:
+                    writer.writerows(polygons.ring(i).tolist())
+                    writer.writerow([])  # Empty row to separate polygons
+
+    @contextmanager
+    def _atomic_writer(self, path):
+        """
+        Opens a temporary file for writing that replaces the file at path once it is closed.
+        """
+        temp_path = path + ".tmp"
+        with open(temp_path, mode="w", newline="", encoding="utf-8") as file:
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+
+    def close(self):
+        """
+        Flushes pending edits, stops the writer thread and closes the journal.
+        """
+        with self._flush_condition:
+            self._closed = True
+            self._flush_condition.notify()
+        writer = self._writer
+        if writer is not None and writer.is_alive() and writer is not threading.current_thread():
+            writer.join()
+        if self._flush_pending:
+            self.flush()
+        self.journal.close()
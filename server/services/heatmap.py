@@ -1,5 +1,10 @@
-import csv
-import os
+import threading
+
+from services.cache import TTLCache
+from services.geojson import iter_feature_collection, read_feature_collection
+from services.geostore import GeoStore
+from services.payload import EncodedPayload
+from services.tiles import build_tile, is_valid_tile
 
 
 class Heatmap:
@@ -10,58 +15,138 @@ class Heatmap:
 
     Attributes:
     ----------
+    store : GeoStore
+        The store holding the heatmap data, possibly shared with other instances.
+    snapshot : GeoSnapshot
+        The current version of the heatmap data.
     heatmap_coords : list
         List of bad polygon coordinates.
     safety_scores : list
         List of safety scores corresponding to the bad polygon coordinates.
     safe_place_coords : list
         List of safe place coordinates.
+    preferred_coords : list
+        List of preferred polygon coordinates.
+    data_version : int
+        Counter that is increased whenever the heatmap data changes.
+    heatmap_index : SpatialIndex
+        Spatial index over the bad polygons.
+    safe_place_index : SpatialIndex
+        Spatial index over the safe places.
+    preferred_index : SpatialIndex
+        Spatial index over the preferred polygons.
 
     Methods:
     ----------
-    __init__(data_dir) : None
-        Initializes the Heatmap instance with the specified data directory.
-    add_and_save_new_polygon(polygon, safety_score) : None
-        Adds a new polygon to the heatmap with the specified safety score and saves the data to CSV.
-    add_and_save_new_safe_place(coordinates) : None
-        Adds a new safe place to the heatmap with the specified coordinates and saves the data to CSV.
+    __init__(data_dir=None, store=None) : None
+        Initializes the Heatmap instance with the specified data directory or store.
+    add_and_save_new_polygon(polygon, safety_score) : int
+        Adds a new polygon to the heatmap with the specified safety score and journals the edit.
+    add_and_save_new_safe_place(coordinates) : int
+        Adds a new safe place to the heatmap with the specified coordinates and journals the edit.
+    import_geojson(stream) : dict
+        Validates a GeoJSON FeatureCollection and adds all of its features in one transaction.
+    export_geojson() : generator
+        Returns the current heatmap data as a streamed GeoJSON FeatureCollection.
     save_data_to_csv() : None
-        Saves the heatmap data to CSV files.
+        Saves the heatmap data to the CSV files and the binary snapshot.
     load_data_from_csv() : None
-        Loads the heatmap data from CSV files.
+        Reloads the heatmap data from CSV files and the journal.
+    on_data_changed() : None
+        Hook called after the heatmap data changed.
     flip_coordinates(coordinates) : list
         Flips the coordinates (i.e., swaps latitude and longitude) for the specified coordinates.
     get_heatmap_and_safe_places() : dict
         Returns a dictionary containing the bad polygon coordinates, medium polygon coordinates, and safe place coordinates.
+    get_heatmap_payload() : EncodedPayload
+        Returns the JSON encoded heatmap data of the current data version.
+    get_heatmap_tile(z, x, y) : EncodedPayload
+        Returns the JSON encoded heatmap features of a map tile.
 
     Notes:
     -----
-    This class is responsible for managing the heatmap data, including loading and saving to CSV files.
+    This class is responsible for managing the heatmap data. The data itself lives in a GeoStore,
+    so several instances (e.g. the Heatmap and the WebCrawler of the app) can share one copy of it
+    and see every edit without reloading it from disk. Read the snapshot once if several attributes
+    have to be consistent with each other.
     """
 
-    def __init__(self, data_dir):
+    def __init__(
+        self,
+        data_dir=None,
+        store=None,
+        journal_compaction_threshold=1000,
+        tile_cache_size=4096,
+        tile_cache_ttl_s=3600.0,
+    ):
         """
-        Initializes the Heatmap instance with the specified data directory.
+        Initializes the Heatmap instance with the specified data directory or store.
 
         Parameters:
         ----------
-        data_dir : str
-            The directory where the CSV files are stored.
+        data_dir : str, optional
+            The directory where the CSV files are stored. Only used if no store is given.
+        store : GeoStore, optional
+            The store to share the heatmap data with (default: a new store for data_dir)
+        journal_compaction_threshold : int, optional
+            Number of journaled edits after which a CSV snapshot is written (default: 1000)
+        tile_cache_size : int, optional
+            Maximum number of cached heatmap tiles (default: 4096)
+        tile_cache_ttl_s : float, optional
+            Time in seconds a cached heatmap tile is kept (default: 3600.0)
+        """
+        if store is None:
+            store = GeoStore(data_dir, journal_compaction_threshold)
+        self.store = store
+        self.data_dir = store.data_dir
+        self._heatmap_payload = (None, None)  # (data version, EncodedPayload)
+        self._heatmap_payload_lock = threading.Lock()
+        self.tile_cache = TTLCache(tile_cache_size, tile_cache_ttl_s)
+        self.store.add_listener(lambda snapshot: self.on_data_changed())
+        self.on_data_changed()
+
+    @property
+    def snapshot(self):
         """
-        self.data_dir = data_dir
-        self.heatmap_coords_path = os.path.join(data_dir, "heatmap_coords.csv")
-        self.safety_scores_path = os.path.join(data_dir, "safety_scores.csv")
-        self.safe_place_coords_path = os.path.join(data_dir, "safe_place_coords.csv")
-        self.preferred_coords_path = os.path.join(data_dir, "preferred_coords.csv")
-        self.heatmap_coords = []
-        self.safety_scores = []
-        self.safe_place_coords = []
-        self.preferred_coords = []
-        self.load_data_from_csv()
+        The current version of the heatmap data.
+        """
+        return self.store.snapshot
+
+    @property
+    def data_version(self):
+        return self.store.snapshot.version
+
+    @property
+    def heatmap_coords(self):
+        return self.store.snapshot.heatmap_coords
+
+    @property
+    def safety_scores(self):
+        return self.store.snapshot.safety_scores
+
+    @property
+    def safe_place_coords(self):
+        return self.store.snapshot.safe_place_coords
+
+    @property
+    def preferred_coords(self):
+        return self.store.snapshot.preferred_coords
+
+    @property
+    def heatmap_index(self):
+        return self.store.snapshot.heatmap_index
+
+    @property
+    def safe_place_index(self):
+        return self.store.snapshot.safe_place_index
+
+    @property
+    def preferred_index(self):
+        return self.store.snapshot.preferred_index
 
     def add_and_save_new_polygon(self, polygon, safety_score):
         """
-        Adds a new polygon to the heatmap with the specified safety score and saves the data to CSV.
+        Adds a new polygon to the heatmap with the specified safety score and journals the edit.
 
         Parameters:
         ----------
@@ -69,117 +154,103 @@ class Heatmap:
             The list of coordinates defining the polygon.
         safety_score : float
             The safety score associated with the polygon.
+
+        Returns:
+        ----------
+        int
+            The data version that includes the polygon.
         """
         if isinstance(safety_score, str):
             safety_score = float(safety_score)
-            
-        if safety_score > 1: # Higher priority areas
-            polygon.append(
-                polygon[0]
-            )  # Add first element to polygons end because routing call  expects closed loops
-            self.preferred_coords.append(polygon)
-        else: # Lower priority areas
-            polygon.append(
-                polygon[0]
-            )  # Add first element to polygons end because routing call  expects closed loops
-            self.heatmap_coords.append(polygon)
-            self.safety_scores.append(safety_score)
-        self.save_data_to_csv()
+
+        polygon.append(
+            polygon[0]
+        )  # Add first element to polygons end because routing call  expects closed loops
+        return self.store.add_polygon(polygon, safety_score).version
 
     def add_and_save_new_safe_place(self, coordinates):
         """
-        Adds a new safe place to the heatmap with the specified coordinates and saves the data to CSV.
+        Adds a new safe place to the heatmap with the specified coordinates and journals the edit.
 
         Parameters:
         ----------
         coordinates : list
             The list of coordinates defining the safe place.
+
+        Returns:
+        ----------
+        int
+            The data version that includes the safe place.
+        """
+        return self.store.add_safe_place(coordinates).version
+
+    def import_geojson(self, stream, max_features=None):
+        """
+        Validates a GeoJSON FeatureCollection and adds all of its features in one transaction.
+
+        The upload is parsed incrementally (see services.geojson.read_feature_collection).
+        Nothing is added if any feature is invalid; otherwise all features are published as a
+        single new data version and persisted in a single step.
+
+        Parameters:
+        ----------
+        stream : file-like object
+            A binary (UTF-8) or text stream with a FeatureCollection.
+        max_features : int, optional
+            Maximum number of features accepted (default: no limit)
+
+        Returns:
+        ----------
+        dict
+            The number of imported polygons, preferred polygons and safe places and the new
+            data version.
+
+        Raises:
+        ----------
+        GeoJSONError
+            If the upload is malformed or contains invalid features.
+        """
+        polygons, safety_scores, safe_places = read_feature_collection(stream, max_features)
+        snapshot = self.store.add_batch(polygons, safety_scores, safe_places)
+        preferred = sum(safety_score > 1 for safety_score in safety_scores)
+        return {
+            "polygons": len(polygons) - preferred,
+            "preferred": preferred,
+            "safePlaces": len(safe_places),
+            "dataVersion": snapshot.version,
+        }
+
+    def export_geojson(self):
+        """
+        Returns the current heatmap data as a GeoJSON FeatureCollection, serialized in chunks
+        (see services.geojson.iter_feature_collection).
+
+        Returns:
+        ----------
+        generator
+            Consecutive parts of the JSON document of a single data version.
         """
-        self.safe_place_coords.append(coordinates)
-        self.save_data_to_csv()
+        return iter_feature_collection(self.snapshot)
 
     def save_data_to_csv(self):
         """
-        Saves the heatmap data to CSV files.
-        """
-        # Save heatmap_coords
-        with open(
-            self.heatmap_coords_path, mode="w", newline="", encoding="utf-8"
-        ) as file:
-            writer = csv.writer(file)
-            for polygon in self.heatmap_coords:
-                for coord in polygon:
-                    writer.writerow(coord)
-                writer.writerow([])  # Empty row to separate polygons
-
-        # Save safety_scores
-        with open(
-            self.safety_scores_path, mode="w", newline="", encoding="utf-8"
-        ) as file:
-            writer = csv.writer(file)
-            for score in self.safety_scores:
-                writer.writerow([score])
-
-        # Save safe_place_coords
-        with open(
-            self.safe_place_coords_path, mode="w", newline="", encoding="utf-8"
-        ) as file:
-            writer = csv.writer(file)
-            for coord in self.safe_place_coords:
-                writer.writerow(coord)
-        
-        # Save preferred_coords
-        with open(
-            self.preferred_coords_path, mode="w", newline="", encoding="utf-8"
-        ) as file:
-            writer = csv.writer(file)
-            for polygon in self.preferred_coords:
-                for coord in polygon:
-                    writer.writerow(coord)
-                writer.writerow([])  # Empty row to separate polygons
+        Saves the heatmap data to the CSV files and the binary snapshot and empties the
+        journal, so the saved edits are not replayed on top of the CSV files.
+        """
+        self.store.save_snapshot()
 
     def load_data_from_csv(self):
         """
-        Loads the heatmap data from CSV files.
-        """
-        self.heatmap_coords = []
-        self.safe_place_coords = []
-        self.safety_scores = []
-        self.preferred_coords = []
-        # Load heatmap_coords
-        with open(self.heatmap_coords_path, mode="r", encoding="utf-8") as file:
-            reader = csv.reader(file)
-            polygon = []
-            for row in reader:
-                if row:
-                    polygon.append([float(row[0]), float(row[1])])
-                else:
-                    self.heatmap_coords.append(polygon)
-                    polygon = []
-
-        # Load safety_scores
-        with open(self.safety_scores_path, mode="r", encoding="utf-8") as file:
-            reader = csv.reader(file)
-            for row in reader:
-                self.safety_scores.append(float(row[0]))
-
-        # Load safe_place_coords
-        with open(self.safe_place_coords_path, mode="r", encoding="utf-8") as file:
-            reader = csv.reader(file)
-            for row in reader:
-                self.safe_place_coords.append([float(row[0]), float(row[1])])
-
-        # Load heatmap_coords
-        with open(self.preferred_coords_path, mode="r", encoding="utf-8") as file:
-            reader = csv.reader(file)
-            polygon = []
-            for row in reader:
-                if row:
-                    polygon.append([float(row[0]), float(row[1])])
-                else:
-                    self.preferred_coords.append(polygon)
-                    polygon = []
+        Reloads the heatmap data from CSV files and replays the journal on top of it.
+        """
+        self.store.load()
 
+    def on_data_changed(self):
+        """
+        Called after the heatmap data changed and data_version was increased.
+
+        Subclasses can override this to update data derived from the heatmap.
+        """
 
     def flip_coordinates(self, coordinates):
         """
@@ -207,25 +278,97 @@ class Heatmap:
                 break
         return flipped_coords
 
-    def get_heatmap_and_safe_places(self):
+    def get_heatmap_and_safe_places(self, snapshot=None):
         """
         Returns a dictionary containing the bad polygon coordinates, medium polygon coordinates, and safe place coordinates.
 
+        Parameters:
+        ----------
+        snapshot : GeoSnapshot, optional
+            The data to return (default: the current snapshot)
+
         Returns:
         ----------
         dict
             A dictionary with the heatmap and safe place data.
         """
+        if snapshot is None:
+            snapshot = self.snapshot
+        # Flip all vertices in one go instead of polygon by polygon
+        flipped = snapshot.polygons.coords[:, ::-1]
+        offsets = snapshot.polygons.offsets
+
+        def flipped_polygons(ids):
+            return [
+                flipped[offsets[i] : offsets[i + 1]].tolist()
+                for i in ids
+                if offsets[i + 1] > offsets[i]
+            ]
+
         data = {
             "heatmap": {
-                "coordinates": self.flip_coordinates(self.heatmap_coords),
-                "safetyScores": self.safety_scores,
+                "coordinates": flipped_polygons(snapshot.heatmap_ids),
+                "safetyScores": snapshot.safety_scores,
             },
             "safePlaces": {
-                "coordinates": self.flip_coordinates(self.safe_place_coords)
+                "coordinates": snapshot.safe_places[:, ::-1].tolist()
             },
             "preferred": {
-                "coordinates": self.flip_coordinates(self.preferred_coords)
+                "coordinates": flipped_polygons(snapshot.preferred_ids)
             }
         }
         return data
+
+    def get_heatmap_payload(self):
+        """
+        Returns the JSON encoded heatmap data of the current data version.
+
+        The data is flipped and serialized once per data version and shared by all requests
+        until the next edit, so serving the heatmap costs no encoding work.
+
+        Returns:
+        ----------
+        EncodedPayload
+            The encoded heatmap and safe place data.
+        """
+        snapshot = self.snapshot
+        version, payload = self._heatmap_payload
+        if version == snapshot.version:
+            return payload
+        with self._heatmap_payload_lock:
+            version, payload = self._heatmap_payload
+            if version != snapshot.version:
+                payload = EncodedPayload.from_json(self.get_heatmap_and_safe_places(snapshot))
+                self._heatmap_payload = (snapshot.version, payload)
+            return payload
+
+    def get_heatmap_tile(self, z, x, y):
+        """
+        Returns the JSON encoded heatmap features of a map tile, see services.tiles.build_tile.
+
+        Tiles are cached per data version, so edits never serve outdated tiles.
+
+        Parameters:
+        ----------
+        z, x, y : int
+            The Web Mercator tile coordinates
+
+        Returns:
+        ----------
+        EncodedPayload
+            The encoded features of the tile.
+
+        Raises:
+        ----------
+        ValueError
+            If the tile does not exist.
+        """
+        if not is_valid_tile(z, x, y):
+            raise ValueError(f"Invalid tile {z}/{x}/{y}")
+        snapshot = self.snapshot
+        key = (snapshot.version, z, x, y)
+        payload = self.tile_cache.get(key)
+        if payload is None:
+            payload = EncodedPayload.from_json(build_tile(snapshot, z, x, y))
+            self.tile_cache.set(key, payload)
+        return payload
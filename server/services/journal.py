@@ -0,0 +1,242 @@
+import json
+import os
+import threading
+import time
+
+
+class Journal:
+    """
+    Journal class.
+
+    An append-only file of JSON records, one per line. Every record is flushed to the
+    operating system right away, while the more expensive fsync to disk is batched.
+
+    The first line of the file holds the generation of the journal, which increases with
+    every reset. A snapshot can store the generation whose records it contains, so they are
+    not replayed a second time if a crash prevented the reset.
+
+    Attributes:
+    ----------
+    path : str
+        The path of the journal file.
+    generation : int or None
+        The generation written to the journal when it is started, None before it is known.
+    fsync_batch : int
+        Number of appended records after which the journal is synced to disk.
+    fsync_interval_s : float
+        Time in seconds after which an append syncs the journal to disk.
+
+    Methods:
+    ----------
+    append(record) : None
+        Appends a record to the journal.
+    read() : list
+        Returns all complete records of the journal.
+    read_from(offset) : tuple
+        Returns the complete records after a byte offset and the offset after them.
+    read_generation() : int or None
+        Returns the generation stored in the journal file.
+    sync() : None
+        Syncs all appended records to disk.
+    reset(generation, records=()) : None
+        Starts a new generation of the journal, e.g. after its records were written to a
+        snapshot.
+    close() : None
+        Syncs and closes the journal file.
+
+    Notes:
+    -----
+    At most fsync_batch records or fsync_interval_s seconds of edits can be lost on a power
+    failure. A record torn by a crash is ignored when the journal is read.
+    """
+
+    def __init__(self, path, fsync_batch=16, fsync_interval_s=1.0):
+        """
+        Initializes the Journal instance. The file is only opened on the first append.
+
+        Parameters:
+        ----------
+        path : str
+            The path of the journal file.
+        fsync_batch : int, optional
+            Number of appended records after which the journal is synced (default: 16)
+        fsync_interval_s : float, optional
+            Time in seconds after which an append syncs the journal (default: 1.0)
+        """
+        self.path = path
+        self.generation = None
+        self.fsync_batch = fsync_batch
+        self.fsync_interval_s = fsync_interval_s
+        self._file = None
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        self._lock = threading.Lock()
+
+    def append(self, record):
+        """
+        Appends a record to the journal.
+
+        Parameters:
+        ----------
+        record : dict
+            A JSON serializable record.
+        """
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            if self._file is None:
+                self._open()
+            self._file.write(line)
+            self._file.flush()
+            self._pending += 1
+            if (
+                self._pending >= self.fsync_batch
+                or time.monotonic() - self._last_sync >= self.fsync_interval_s
+            ):
+                self._sync()
+
+    def read(self):
+        """
+        Returns all complete records of the journal.
+
+        Returns:
+        ----------
+        list
+            The records in the order they were appended.
+        """
+        records = []
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path, mode="r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"Ignoring torn record in journal {self.path}")
+                    continue
+                if "generation" not in record:
+                    records.append(record)
+        return records
+
+    def read_from(self, offset):
+        """
+        Returns the complete records appended after a byte offset, e.g. by another process.
+
+        Parameters:
+        ----------
+        offset : int
+            The byte offset to read from, the end of a previously read record.
+
+        Returns:
+        ----------
+        tuple
+            The records and the byte offset after the last complete one.
+        """
+        if not os.path.exists(self.path):
+            return [], offset
+        with open(self.path, mode="rb") as file:
+            file.seek(offset)
+            data = file.read()
+        end = data.rfind(b"\n") + 1  # A record is complete once its newline was written
+        records = []
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Ignoring torn record in journal {self.path}")
+                continue
+            if "generation" not in record:
+                records.append(record)
+        return records, offset + end
+
+    def read_generation(self):
+        """
+        Returns the generation stored in the first line of the journal file.
+
+        Returns:
+        ----------
+        int or None
+            The generation, or None if the file is missing, empty or was written without
+            one.
+        """
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, mode="r", encoding="utf-8") as file:
+            line = file.readline()
+        try:
+            return json.loads(line).get("generation")
+        except (json.JSONDecodeError, AttributeError):
+            return None
+
+    def _open(self):
+        self._file = open(self.path, mode="a+b")
+        # Terminate a record torn by a crash, so the next record starts on its own line
+        if self._file.tell() > 0:
+            self._file.seek(-1, os.SEEK_END)
+            if self._file.read(1) != b"\n":
+                self._file.write(b"\n")
+        elif self.generation is not None:
+            # An emptied journal lost its generation if a crash interrupted the reset
+            self._file.write(self._generation_line(self.generation).encode("utf-8"))
+        self._file.close()
+        self._file = open(self.path, mode="a", encoding="utf-8")
+
+    @staticmethod
+    def _generation_line(generation):
+        return json.dumps({"generation": generation}) + "\n"
+
+    def sync(self):
+        """
+        Syncs all appended records to disk.
+        """
+        with self._lock:
+            self._sync()
+
+    def _sync(self):
+        if self._file is not None and self._pending:
+            os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def reset(self, generation, records=()):
+        """
+        Starts a new generation of the journal, e.g. after its records were written to a
+        snapshot.
+
+        Without records the file is emptied in place, so other processes appending to it
+        keep appending to the same file. With records it is replaced atomically.
+
+        Parameters:
+        ----------
+        generation : int
+            The generation of the new journal.
+        records : list, optional
+            Records the new journal starts with (default: none)
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            lines = [self._generation_line(generation)]
+            lines.extend(json.dumps(record, separators=(",", ":")) + "\n" for record in records)
+            path = self.path + ".tmp" if records else self.path
+            with open(path, mode="w", encoding="utf-8") as file:
+                file.writelines(lines)
+                file.flush()
+                os.fsync(file.fileno())
+            if records:
+                os.replace(path, self.path)
+            self.generation = generation
+            self._pending = 0
+            self._last_sync = time.monotonic()
+
+    def close(self):
+        """
+        Syncs and closes the journal file.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._sync()
+                self._file.close()
+                self._file = None
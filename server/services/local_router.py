@@ -0,0 +1,424 @@
+import heapq
+import math
+import threading
+
+import numpy as np
+import shapely
+
+from services.geo import EARTH_RADIUS_M, haversine_m
+
+PROFILE_SPEEDS_KMH = {"foot": 5.0, "bike": 15.0, "car": 50.0}
+PREFERRED_BOOST = 0.5  # priority outside preferred areas, like the "!in_good" rule of the custom model
+
+
+class RoadGraph:
+    """
+    RoadGraph class.
+
+    A road network in compressed sparse row (CSR) form: the outgoing edges of node i are
+    stored at positions indptr[i] to indptr[i + 1] of the edge arrays.
+
+    Attributes:
+    ----------
+    node_coords : numpy.ndarray
+        The (N, 2) array of (longitude, latitude) node coordinates.
+    indptr : numpy.ndarray
+        The (N + 1,) array of edge offsets per node.
+    sources : numpy.ndarray
+        The (E,) array of the source node of every edge.
+    targets : numpy.ndarray
+        The (E,) array of the target node of every edge.
+    lengths : numpy.ndarray
+        The (E,) array of edge lengths in meters.
+
+    Methods:
+    ----------
+    from_edge_list(path) : RoadGraph
+        Loads a road graph from a CSV edge list.
+    nearest_node(coordinates) : int
+        Returns the node closest to a (longitude, latitude) coordinate.
+    edge_lines() : numpy.ndarray
+        Returns every edge as a shapely LineString.
+    """
+
+    def __init__(self, node_coords, sources, targets, lengths):
+        order = np.argsort(sources, kind="stable")
+        self.node_coords = node_coords
+        self.sources = sources[order]
+        self.targets = targets[order]
+        self.lengths = lengths[order]
+        self.indptr = np.zeros(len(node_coords) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.sources, minlength=len(node_coords)), out=self.indptr[1:])
+        self._node_tree = shapely.STRtree(shapely.points(node_coords))
+
+    @classmethod
+    def from_edge_list(cls, path):
+        """
+        Loads a road graph from a CSV edge list, e.g. exported from OpenStreetMap ways.
+
+        Every row is one road segment "from_lon,from_lat,to_lon,to_lat[,oneway]". Segments
+        are traversable in both directions unless oneway is 1. Segments sharing a coordinate
+        (to 7 decimal places) are connected. Lines starting with # are ignored.
+
+        Parameters:
+        ----------
+        path : str
+            The path of the CSV file.
+
+        Returns:
+        ----------
+        RoadGraph
+            The road graph.
+        """
+        rows = np.loadtxt(path, delimiter=",", comments="#", ndmin=2)
+        ends = np.round(rows[:, :4].reshape(-1, 2), 7)
+        node_coords, node_ids = np.unique(ends, axis=0, return_inverse=True)
+        node_ids = node_ids.reshape(-1, 2)
+        lengths = haversine_m(rows[:, 0], rows[:, 1], rows[:, 2], rows[:, 3])
+
+        two_way = np.ones(len(rows), dtype=bool)
+        if rows.shape[1] > 4:
+            two_way = rows[:, 4] != 1
+        sources = np.concatenate([node_ids[:, 0], node_ids[two_way, 1]])
+        targets = np.concatenate([node_ids[:, 1], node_ids[two_way, 0]])
+        lengths = np.concatenate([lengths, lengths[two_way]])
+        return cls(node_coords, sources, targets, lengths)
+
+    def __len__(self):
+        return len(self.node_coords)
+
+    def nearest_node(self, coordinates):
+        """
+        Returns the index of the node closest to a (longitude, latitude) coordinate.
+        """
+        return int(self._node_tree.query_nearest(shapely.Point(coordinates))[0])
+
+    def edge_lines(self):
+        """
+        Returns every edge as a straight shapely LineString, in edge order.
+        """
+        return shapely.linestrings(
+            np.stack(
+                [self.node_coords[self.sources], self.node_coords[self.targets]], axis=1
+            )
+        )
+
+
+class EdgeCosts:
+    """
+    EdgeCosts class.
+
+    The routing costs of all edges of a road graph for one version of the heatmap data,
+    stored as Python lists for fast access from the search loop.
+
+    Attributes:
+    ----------
+    version : int
+        The data version the costs were computed for.
+    costs : list
+        The cost of every edge, its length divided by its priority (inf if impassable).
+    min_cost_per_m : float
+        The lowest cost per meter of any edge, used to keep the A* heuristic admissible.
+    """
+
+    def __init__(self, version, costs, min_cost_per_m):
+        self.version = version
+        self.costs = costs
+        self.min_cost_per_m = min_cost_per_m
+
+
+def edge_priorities(graph, snapshot):
+    """
+    Computes the routing priority of every edge, like the GraphHopper custom model does.
+
+    An edge inside bad polygons gets the lowest safety score of these polygons as priority.
+    Edges outside all preferred polygons are multiplied by PREFERRED_BOOST.
+
+    Parameters:
+    ----------
+    graph : RoadGraph
+        The road graph
+    snapshot : GeoSnapshot
+        The heatmap data
+
+    Returns:
+    ----------
+    numpy.ndarray
+        The priority of every edge between 0 (impassable) and 1.
+    """
+    lines = graph.edge_lines()
+    priorities = np.ones(len(lines))
+
+    pairs = snapshot.heatmap_index.query(lines, predicate="intersects")
+    if pairs.shape[1]:
+        scores = np.nan_to_num(snapshot.heatmap_scores[pairs[1]], nan=1.0)
+        np.minimum.at(priorities, pairs[0], np.clip(scores, 0.0, 1.0))
+
+    preferred = np.zeros(len(lines), dtype=bool)
+    pairs = snapshot.preferred_index.query(lines, predicate="intersects")
+    preferred[pairs[0]] = True
+    return np.where(preferred, priorities, priorities * PREFERRED_BOOST)
+
+
+class LocalRouter:
+    """
+    LocalRouter class.
+
+    An in-process replacement for the GraphHopper route endpoint. Routes are searched with A*
+    on a local road graph, with edge costs weighted by the heatmap.
+
+    Attributes:
+    ----------
+    graph : RoadGraph
+        The road graph to route on.
+
+    Methods:
+    ----------
+    from_file(path) : LocalRouter
+        Creates a router for a CSV edge list.
+    prepare(snapshot) : EdgeCosts
+        Returns the edge costs for a heatmap snapshot, computed once per data version.
+    route(points, profile, snapshot) : dict
+        Returns a route through the points in the format of the GraphHopper route endpoint.
+    matrix(from_points, to_points, snapshot) : dict
+        Returns the route distances between points in the format of the GraphHopper matrix endpoint.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self._costs = None
+        self._costs_lock = threading.Lock()
+        # The search loop is faster on lists than on NumPy arrays
+        self._indptr = graph.indptr.tolist()
+        self._targets = graph.targets.tolist()
+        self._lengths = graph.lengths.tolist()
+        self._lons = np.radians(graph.node_coords[:, 0]).tolist()
+        self._lats = np.radians(graph.node_coords[:, 1]).tolist()
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Creates a router for a CSV edge list, see RoadGraph.from_edge_list.
+        """
+        graph = RoadGraph.from_edge_list(path)
+        print(f"Road graph loaded with {len(graph)} nodes and {len(graph.lengths)} edges")
+        return cls(graph)
+
+    def prepare(self, snapshot):
+        """
+        Returns the edge costs for a heatmap snapshot, computed once per data version.
+
+        Parameters:
+        ----------
+        snapshot : GeoSnapshot
+            The heatmap data
+
+        Returns:
+        ----------
+        EdgeCosts
+            The edge costs of the snapshot's data version.
+        """
+        costs = self._costs
+        if costs is not None and costs.version == snapshot.version:
+            return costs
+        with self._costs_lock:
+            costs = self._costs
+            if costs is None or costs.version != snapshot.version:
+                priorities = edge_priorities(self.graph, snapshot)
+                passable = priorities > 0
+                edge_costs = np.full(len(priorities), math.inf)
+                edge_costs[passable] = self.graph.lengths[passable] / priorities[passable]
+                costs = EdgeCosts(
+                    snapshot.version,
+                    edge_costs.tolist(),
+                    1.0 / priorities.max() if passable.any() else 1.0,
+                )
+                self._costs = costs
+        return costs
+
+    def route(self, points, profile, snapshot):
+        """
+        Returns a route through the points in the format of the GraphHopper route endpoint.
+
+        Parameters:
+        ----------
+        points : list
+            The route points as [longitude, latitude] pairs, the first one being the origin
+            and the last one the destination
+        profile : str
+            The routing profile, used for the travel time (e.g., "foot")
+        snapshot : GeoSnapshot
+            The heatmap data to weight the edges with
+
+        Returns:
+        ----------
+        dict
+            The route data like GraphHopper returns it, or a message if the points are not
+            connected.
+        """
+        costs = self.prepare(snapshot)
+        nodes = [self.graph.nearest_node(point) for point in points]
+
+        path = [nodes[0]]
+        distance = 0.0
+        weight = 0.0
+        for source, target in zip(nodes, nodes[1:]):
+            leg = self.shortest_path(source, target, costs)
+            if leg is None:
+                return {"message": "Connection between locations not found"}
+            leg_nodes, leg_distance, leg_weight = leg
+            path.extend(leg_nodes[1:])
+            distance += leg_distance
+            weight += leg_weight
+
+        speed_m_per_ms = PROFILE_SPEEDS_KMH.get(profile, PROFILE_SPEEDS_KMH["foot"]) / 3600.0
+        return {
+            "paths": [
+                {
+                    "distance": distance,
+                    "weight": weight,
+                    "time": int(distance / speed_m_per_ms),
+                    "points": {
+                        "type": "LineString",
+                        "coordinates": self.graph.node_coords[path].tolist(),
+                    },
+                }
+            ]
+        }
+
+    def matrix(self, from_points, to_points, snapshot):
+        """
+        Returns the distances of the cheapest routes between all pairs of points, in the
+        format of the GraphHopper matrix endpoint.
+
+        Parameters:
+        ----------
+        from_points : list
+            The start points as [longitude, latitude] pairs
+        to_points : list
+            The end points as [longitude, latitude] pairs
+        snapshot : GeoSnapshot
+            The heatmap data to weight the edges with
+
+        Returns:
+        ----------
+        dict
+            The "distances" in meters, with None for unreachable pairs.
+        """
+        costs = self.prepare(snapshot)
+        targets = [self.graph.nearest_node(point) for point in to_points]
+        distances = []
+        for point in from_points:
+            reached = self.distances_from(self.graph.nearest_node(point), targets, costs)
+            distances.append([reached.get(target) for target in targets])
+        return {"distances": distances}
+
+    def distances_from(self, source, targets, costs):
+        """
+        Searches the cheapest paths from one node to several nodes with Dijkstra's algorithm,
+        stopping once all of them are reached.
+
+        Parameters:
+        ----------
+        source : int
+            The start node
+        targets : list
+            The end nodes
+        costs : EdgeCosts
+            The edge costs to minimize
+
+        Returns:
+        ----------
+        dict
+            The distance in meters of the cheapest path to every reachable target node.
+        """
+        indptr, neighbours, lengths, edge_costs = (
+            self._indptr,
+            self._targets,
+            self._lengths,
+            costs.costs,
+        )
+        remaining = set(targets)
+        reached = {}
+        best = {source: 0.0}
+        queue = [(0.0, 0.0, source)]
+        while queue and remaining:
+            cost, distance, node = heapq.heappop(queue)
+            if cost > best[node]:
+                continue  # outdated queue entry
+            if node in remaining:
+                remaining.discard(node)
+                reached[node] = distance
+            for edge in range(indptr[node], indptr[node + 1]):
+                next_cost = cost + edge_costs[edge]
+                neighbour = neighbours[edge]
+                if next_cost < best.get(neighbour, math.inf):
+                    best[neighbour] = next_cost
+                    heapq.heappush(queue, (next_cost, distance + lengths[edge], neighbour))
+        return reached
+
+    def shortest_path(self, source, target, costs):
+        """
+        Searches the cheapest path between two nodes with A*.
+
+        Parameters:
+        ----------
+        source : int
+            The start node
+        target : int
+            The end node
+        costs : EdgeCosts
+            The edge costs to minimize
+
+        Returns:
+        ----------
+        tuple or None
+            The list of nodes, the distance in meters and the cost of the path, or None if
+            the target cannot be reached.
+        """
+        indptr, targets, lengths, edge_costs = (
+            self._indptr,
+            self._targets,
+            self._lengths,
+            costs.costs,
+        )
+        lons, lats = self._lons, self._lats
+        target_lon, target_lat = lons[target], lats[target]
+        cos_target_lat = math.cos(target_lat)
+        scale = 2 * EARTH_RADIUS_M * costs.min_cost_per_m
+
+        def estimate(node):
+            a = (
+                math.sin((lats[node] - target_lat) / 2) ** 2
+                + math.cos(lats[node]) * cos_target_lat * math.sin((lons[node] - target_lon) / 2) ** 2
+            )
+            return scale * math.asin(math.sqrt(a))
+
+        best = {source: 0.0}
+        previous = {source: (None, 0.0)}
+        queue = [(estimate(source), 0.0, source)]
+        while queue:
+            _, cost, node = heapq.heappop(queue)
+            if node == target:
+                break
+            if cost > best[node]:
+                continue  # outdated queue entry
+            for edge in range(indptr[node], indptr[node + 1]):
+                next_cost = cost + edge_costs[edge]
+                neighbour = targets[edge]
+                if next_cost < best.get(neighbour, math.inf):
+                    best[neighbour] = next_cost
+                    previous[neighbour] = (node, lengths[edge])
+                    heapq.heappush(queue, (next_cost + estimate(neighbour), next_cost, neighbour))
+        else:
+            return None
+
+        path = []
+        distance = 0.0
+        node = target
+        while node is not None:
+            path.append(node)
+            node, length = previous[node]
+            distance += length
+        path.reverse()
+        return path, distance, best[target]
@@ -0,0 +1,538 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Bucket bounds in seconds, from cache hits to slow upstream calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# The trace of the request handled in the current context, if any
+_current_trace = contextvars.ContextVar("welai_trace", default=None)
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = [*zip(labelnames, labelvalues), *extra]
+    if not pairs:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Counter class.
+
+    A thread-safe, monotonically increasing value per combination of label values.
+
+    Attributes:
+    ----------
+    name : str
+        The metric name, ending in "_total".
+    documentation : str
+        The help text of the metric.
+    labelnames : tuple
+        The names of the labels.
+
+    Methods:
+    ----------
+    inc(*labelvalues, amount=1) : None
+        Increases the counter of the label values.
+    value(*labelvalues) : float
+        Returns the counter of the label values.
+    samples() : dict
+        Returns a copy of the counters by label values.
+    merge(samples, labelvalues, value) : None
+        Adds the counter of another process to samples.
+    reset() : None
+        Removes all counters.
+    expose(samples=None) : list
+        Returns the lines of the metric in the Prometheus text format.
+    """
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues):
+        with self._lock:
+            return self._values.get(labelvalues, 0)
+
+    def samples(self):
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(samples, labelvalues, value):
+        samples[labelvalues] = samples.get(labelvalues, 0) + value
+
+    def reset(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def expose(self, samples=None):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        values = sorted((self.samples() if samples is None else samples).items())
+        for labelvalues, value in values:
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}{labels} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """
+    Histogram class.
+
+    A thread-safe distribution of observed values per combination of label values, with
+    cumulative bucket counts like Prometheus histograms.
+
+    Attributes:
+    ----------
+    name : str
+        The metric name.
+    documentation : str
+        The help text of the metric.
+    labelnames : tuple
+        The names of the labels.
+    buckets : tuple
+        The ascending upper bounds of the buckets, without +Inf.
+
+    Methods:
+    ----------
+    observe(value, *labelvalues) : None
+        Adds an observation for the label values.
+    count(*labelvalues) : int
+        Returns the number of observations of the label values.
+    samples() : dict
+        Returns a copy of the [count per bucket, sum, count] series by label values.
+    merge(samples, labelvalues, value) : None
+        Adds the series of another process to samples.
+    reset() : None
+        Removes all series.
+    expose(samples=None) : list
+        Returns the lines of the metric in the Prometheus text format.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [count per bucket, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def count(self, *labelvalues):
+        with self._lock:
+            series = self._series.get(labelvalues)
+            return 0 if series is None else series[2]
+
+    def samples(self):
+        with self._lock:
+            return {
+                labelvalues: [list(counts), total, count]
+                for labelvalues, (counts, total, count) in self._series.items()
+            }
+
+    @staticmethod
+    def merge(samples, labelvalues, value):
+        series = samples.get(labelvalues)
+        if series is None:
+            samples[labelvalues] = [list(value[0]), value[1], value[2]]
+        else:
+            series[0] = [a + b for a, b in zip(series[0], value[0])]
+            series[1] += value[1]
+            series[2] += value[2]
+
+    def reset(self):
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def expose(self, samples=None):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        series = sorted((self.samples() if samples is None else samples).items())
+        for labelvalues, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, labelvalues, [("le", str(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues, [("le", "+Inf")])
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Trace:
+    """
+    Trace class.
+
+    The spans of a single request, summed per stage. Spans of the worker threads a request
+    fans out to are added to the same trace, so the sum of a stage can exceed the request
+    duration.
+
+    Attributes:
+    ----------
+    name : str
+        The name of the traced request (e.g., "GET /route").
+    start : float
+        Point in time (as returned by time.perf_counter()) the request started.
+    stages : dict
+        Number of spans and their total duration in seconds per stage.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            count, total = self.stages.get(stage, (0, 0.0))
+            self.stages[stage] = (count + 1, total + seconds)
+
+    def summary(self):
+        """
+        Returns the stages as "stage 2x 123.4 ms" in the order they were first entered.
+        """
+        with self._lock:
+            stages = list(self.stages.items())
+        return ", ".join(
+            f"{stage} {f'{count}x ' if count > 1 else ''}{1000 * total:.1f} ms"
+            for stage, (count, total) in stages
+        )
+
+
+class Metrics:
+    """
+    Metrics class.
+
+    Collects request, pipeline stage and upstream metrics of the server and renders them
+    in the Prometheus text format. Requests are traced per context: spans entered while
+    a trace is active are added to it, also on worker threads started through
+    submit_with_context, and requests slower than slow_request_s are logged with the
+    breakdown of their stages.
+
+    Server worker processes share their metrics through a directory: every process writes
+    its own metrics to a file there every share_interval_s seconds, and render sums the
+    files of all processes, so every scrape returns the totals of the server whichever
+    worker answers it.
+
+    Attributes:
+    ----------
+    slow_request_s : float or None
+        Duration in seconds above which requests are logged, None to disable the log.
+    shared_dir : str or None
+        The directory the processes share their metrics through, None if they are not
+        shared.
+    share_interval_s : float
+        Time in seconds between two writes of the metrics of a process to shared_dir.
+    request_duration : Histogram
+        Duration of HTTP requests by endpoint.
+    stage_duration : Histogram
+        Duration of route pipeline stages by stage.
+    upstream_duration : Histogram
+        Duration of upstream calls by path, including retries.
+    upstream_requests : Counter
+        Upstream calls by path and status code ("error" if no response was received).
+    upstream_request_bytes : Counter
+        Bytes of the upstream request bodies by path.
+    upstream_response_bytes : Counter
+        Bytes of the upstream response bodies by path.
+
+    Methods:
+    ----------
+    span(stage) : context manager
+        Times a stage and adds it to the current trace.
+    start_trace(name) : Trace
+        Starts tracing a request in the current context.
+    finish_trace(trace, endpoint) : None
+        Records the request duration and logs the request if it was slow.
+    record_upstream(path, status, seconds, request_bytes, response_bytes) : None
+        Records an upstream call.
+    render() : str
+        Returns all metrics in the Prometheus text format.
+    share(directory) : None
+        Shares the metrics of all processes forked later through a directory.
+    after_fork() : None
+        Resets the metrics inherited by a forked process and starts sharing its own.
+    close() : None
+        Writes the final metrics of the process to shared_dir.
+    """
+
+    def __init__(self, slow_request_s=None, buckets=DEFAULT_BUCKETS, share_interval_s=1.0):
+        """
+        Initializes the Metrics instance.
+
+        Parameters:
+        ----------
+        slow_request_s : float, optional
+            Duration in seconds above which requests are logged (default: None, no log)
+        buckets : tuple, optional
+            Upper bounds in seconds of the duration histogram buckets
+        share_interval_s : float, optional
+            Time in seconds between two writes of the metrics to shared_dir (default: 1.0)
+        """
+        self.slow_request_s = slow_request_s
+        self.shared_dir = None
+        self.share_interval_s = share_interval_s
+        self._stop_sharing = None
+        self.request_duration = Histogram(
+            "welai_request_duration_seconds",
+            "Duration of HTTP requests.",
+            ("endpoint",),
+            buckets,
+        )
+        self.stage_duration = Histogram(
+            "welai_stage_duration_seconds",
+            "Duration of route pipeline stages.",
+            ("stage",),
+            buckets,
+        )
+        self.upstream_duration = Histogram(
+            "welai_upstream_duration_seconds",
+            "Duration of upstream calls including retries.",
+            ("path",),
+            buckets,
+        )
+        self.upstream_requests = Counter(
+            "welai_upstream_requests_total",
+            "Upstream calls by status code.",
+            ("path", "status"),
+        )
+        self.upstream_request_bytes = Counter(
+            "welai_upstream_request_bytes_total",
+            "Bytes of upstream request bodies.",
+            ("path",),
+        )
+        self.upstream_response_bytes = Counter(
+            "welai_upstream_response_bytes_total",
+            "Bytes of upstream response bodies.",
+            ("path",),
+        )
+
+    @contextmanager
+    def span(self, stage):
+        """
+        Times the enclosed block as a stage of the route pipeline.
+
+        Parameters:
+        ----------
+        stage : str
+            The name of the stage (e.g., "initial_route")
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.stage_duration.observe(seconds, stage)
+            trace = _current_trace.get()
+            if trace is not None:
+                trace.add(stage, seconds)
+
+    def start_trace(self, name):
+        """
+        Starts tracing a request in the current context.
+
+        Parameters:
+        ----------
+        name : str
+            The name of the request used in the slow request log (e.g., "GET /route")
+
+        Returns:
+        ----------
+        Trace
+            The trace to pass to finish_trace.
+        """
+        trace = Trace(name)
+        _current_trace.set(trace)
+        return trace
+
+    def finish_trace(self, trace, endpoint):
+        """
+        Ends a trace, records the request duration and logs the request with its stages if
+        it took longer than slow_request_s.
+
+        Streamed responses finish after the view returned, possibly in another context,
+        so the trace is passed in instead of being taken from the current context.
+
+        Parameters:
+        ----------
+        trace : Trace
+            The trace returned by start_trace
+        endpoint : str
+            The endpoint label of the request duration (e.g., "/route")
+        """
+        if _current_trace.get() is trace:
+            _current_trace.set(None)
+        seconds = time.perf_counter() - trace.start
+        self.request_duration.observe(seconds, endpoint)
+        if self.slow_request_s is not None and seconds > self.slow_request_s:
+            print(f"Slow request {trace.name} took {1000 * seconds:.1f} ms: {trace.summary()}")
+
+    def record_upstream(self, path, status, seconds, request_bytes, response_bytes):
+        """
+        Records an upstream call.
+
+        Parameters:
+        ----------
+        path : str
+            The path of the call (e.g., "/route")
+        status : int or str
+            The status code of the response, or "error" if there was none
+        seconds : float
+            The duration of the call including retries
+        request_bytes : int
+            The size of the request body
+        response_bytes : int
+            The size of the response body
+        """
+        self.upstream_duration.observe(seconds, path)
+        self.upstream_requests.inc(path, str(status))
+        self.upstream_request_bytes.inc(path, amount=request_bytes)
+        self.upstream_response_bytes.inc(path, amount=response_bytes)
+
+    def _metrics(self):
+        return (
+            self.request_duration,
+            self.stage_duration,
+            self.upstream_duration,
+            self.upstream_requests,
+            self.upstream_request_bytes,
+            self.upstream_response_bytes,
+        )
+
+    def render(self):
+        """
+        Returns all metrics in the Prometheus text exposition format, summed over all
+        processes if they are shared.
+        """
+        if self.shared_dir is None:
+            samples = [metric.samples() for metric in self._metrics()]
+        else:
+            self._write_shared()
+            samples = self._read_shared()
+        lines = []
+        for metric, metric_samples in zip(self._metrics(), samples):
+            lines.extend(metric.expose(metric_samples))
+        return "\n".join(lines) + "\n"
+
+    def share(self, directory):
+        """
+        Shares the metrics of all processes forked from now on through a directory. Files
+        left behind by earlier runs are removed.
+
+        Parameters:
+        ----------
+        directory : str
+            The directory, created if it does not exist
+        """
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            if name.startswith("metrics-"):
+                os.remove(os.path.join(directory, name))
+        self.shared_dir = directory
+
+    def after_fork(self):
+        """
+        Resets the metrics a forked process inherited from its parent, so they are not
+        counted once per process, and starts writing its own metrics to shared_dir.
+        """
+        for metric in self._metrics():
+            metric.reset()
+        if self.shared_dir is None:
+            return
+        self._stop_sharing = threading.Event()
+        threading.Thread(target=self._share_loop, name="metrics-writer", daemon=True).start()
+
+    def close(self):
+        """
+        Stops sharing and writes the final metrics of the process to shared_dir, where
+        they keep counting towards the totals after the process exited.
+        """
+        if self._stop_sharing is not None:
+            self._stop_sharing.set()
+        if self.shared_dir is not None:
+            self._write_shared()
+
+    def _share_loop(self):
+        while not self._stop_sharing.wait(self.share_interval_s):
+            try:
+                self._write_shared()
+            except OSError as e:
+                print(f"Could not share the metrics: {e}")
+
+    def _write_shared(self):
+        """
+        Replaces the file of this process in shared_dir with its current metrics.
+        """
+        state = {
+            metric.name: [[list(labels), value] for labels, value in metric.samples().items()]
+            for metric in self._metrics()
+        }
+        path = os.path.join(self.shared_dir, f"metrics-{os.getpid()}.json")
+        with open(path + ".tmp", mode="w", encoding="utf-8") as file:
+            json.dump(state, file)
+        os.replace(path + ".tmp", path)
+
+    def _read_shared(self):
+        """
+        Returns the samples of every metric summed over the files of all processes.
+        """
+        samples = [{} for _ in self._metrics()]
+        for name in sorted(os.listdir(self.shared_dir)):
+            if not (name.startswith("metrics-") and name.endswith(".json")):
+                continue
+            try:
+                with open(os.path.join(self.shared_dir, name), encoding="utf-8") as file:
+                    state = json.load(file)
+            except (OSError, ValueError):
+                continue  # Removed since it was listed
+            for metric, metric_samples in zip(self._metrics(), samples):
+                for labelvalues, value in state.get(metric.name, []):
+                    metric.merge(metric_samples, tuple(labelvalues), value)
+        return samples
+
+
+def submit_with_context(executor, function, *args, **kwargs):
+    """
+    Submits a call to an executor so it runs in a copy of the current context, which
+    keeps the spans of worker threads in the trace of the request that started them.
+    """
+    return executor.submit(contextvars.copy_context().run, function, *args, **kwargs)
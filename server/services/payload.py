@@ -0,0 +1,145 @@
+import gzip
+import hashlib
+import json
+import threading
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, responses are gzip compressed without it
+    brotli = None
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+class EncodedPayload:
+    """
+    EncodedPayload class.
+
+    A JSON response body that is serialized once and compressed at most once per content
+    encoding, so it can be served any number of times without encoding it again.
+
+    Attributes:
+    ----------
+    body : bytes
+        The JSON body without content encoding.
+    digest : str
+        Hash of the body, used to build the ETags.
+    content_type : str
+        The media type of the body.
+
+    Methods:
+    ----------
+    from_json(data) : EncodedPayload
+        Serializes the data to a payload.
+    select_encoding(accept_encodings) : str
+        Returns the best content encoding the client accepts.
+    encoded(encoding) : bytes
+        Returns the body in a content encoding.
+    etag(encoding) : str
+        Returns the strong ETag of the body in a content encoding.
+    matches(etags) : bool
+        Returns whether one of the ETags belongs to this payload.
+    """
+
+    def __init__(self, body, content_type="application/json"):
+        self.body = body
+        self.digest = hashlib.sha1(body).hexdigest()
+        self.content_type = content_type
+        self._encoded = {"identity": body}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_json(cls, data):
+        """
+        Serializes the data to a compact JSON payload.
+
+        Parameters:
+        ----------
+        data : dict
+            The JSON serializable data.
+
+        Returns:
+        ----------
+        EncodedPayload
+            The payload.
+        """
+        return cls(json.dumps(data, separators=(",", ":")).encode("utf-8"))
+
+    def select_encoding(self, accept_encodings):
+        """
+        Returns the best content encoding the client accepts.
+
+        Parameters:
+        ----------
+        accept_encodings : werkzeug.datastructures.Accept
+            The parsed Accept-Encoding header of the request.
+
+        Returns:
+        ----------
+        str
+            "br", "gzip" or "identity".
+        """
+        if brotli is not None and accept_encodings.quality("br") > 0:
+            return "br"
+        if accept_encodings.quality("gzip") > 0:
+            return "gzip"
+        return "identity"
+
+    def encoded(self, encoding):
+        """
+        Returns the body in a content encoding. Every encoding is only computed once.
+
+        Parameters:
+        ----------
+        encoding : str
+            "br", "gzip" or "identity".
+
+        Returns:
+        ----------
+        bytes
+            The encoded body.
+        """
+        body = self._encoded.get(encoding)
+        if body is not None:
+            return body
+        with self._lock:
+            if encoding not in self._encoded:
+                if encoding == "br":
+                    self._encoded[encoding] = brotli.compress(
+                        self.body, quality=BROTLI_QUALITY
+                    )
+                elif encoding == "gzip":
+                    self._encoded[encoding] = gzip.compress(
+                        self.body, compresslevel=GZIP_LEVEL, mtime=0
+                    )
+                else:
+                    raise ValueError(f"Unsupported content encoding {encoding}")
+            return self._encoded[encoding]
+
+    def etag(self, encoding="identity"):
+        """
+        Returns the strong ETag (without quotes) of the body in a content encoding. The
+        encodings get different tags, as their bytes differ.
+        """
+        if encoding == "identity":
+            return self.digest
+        return f"{self.digest}-{encoding}"
+
+    def matches(self, etags):
+        """
+        Returns whether one of the ETags belongs to this payload in any content encoding.
+
+        Parameters:
+        ----------
+        etags : werkzeug.datastructures.ETags
+            The parsed If-None-Match header of the request.
+
+        Returns:
+        ----------
+        bool
+            True if the client already has the current body.
+        """
+        return any(
+            etags.contains(self.etag(encoding)) for encoding in ("identity", "gzip", "br")
+        )
@@ -0,0 +1,345 @@
+import math
+
+import numpy as np
+import shapely
+from services.columnar import KIND_PREFERRED
+from services.geo import haversine_m
+
+SAFE_SCORE = 1.0  # score of cells outside all bad polygons
+BAND_ROWS = 64  # rows of a band, the unit copied when an edit changes the grid
+
+
+class SafetyRaster:
+    """
+    SafetyRaster class.
+
+    The heatmap compiled into a regular grid over the bounding box of its polygons. Every
+    cell holds the lowest safety score of the bad polygons covering its center and whether
+    it lies in a preferred area, so the risk along whole coordinate arrays is looked up by
+    array indexing instead of polygon intersections. Overlapping polygons count once, with
+    their lowest score.
+
+    Rasters are immutable like the snapshots they are built from. Polygons are only ever
+    appended to a snapshot, so the raster of a later snapshot is derived from an earlier
+    one by rasterizing the added polygons only. The grid is stored in bands of BAND_ROWS
+    rows, and a derived raster copies only the bands the added polygons overlap and shares
+    all others, so an edit costs in proportion to the size of its polygon, not the grid.
+
+    Attributes:
+    ----------
+    version : int
+        The data version of the snapshot the raster was built from.
+    bounds : tuple
+        The (min longitude, min latitude) corner of the grid.
+    cell_size : float
+        The edge length of a cell in degrees.
+    shape : tuple
+        The (rows, columns) of the grid.
+    score_bands : tuple
+        The (BAND_ROWS, columns) float32 arrays of the lowest safety score per cell, from
+        the southernmost band on; the last band may have fewer rows.
+    preferred_bands : tuple
+        The (BAND_ROWS, columns) bool arrays of cells in preferred areas, like score_bands.
+    polygon_count : int
+        The number of snapshot polygons rasterized.
+
+    Methods:
+    ----------
+    from_snapshot(snapshot, cell_size=0.0001, max_cells=25000000) : SafetyRaster
+        Rasterizes the polygons of a snapshot.
+    extended(snapshot) : SafetyRaster or None
+        Returns the raster of a later snapshot, rasterizing only the added polygons.
+    sample(coordinates) : tuple
+        Returns the safety scores and preferred flags at (longitude, latitude) points.
+    segment_exposure(starts, ends) : tuple
+        Returns the badness and preferred length of straight segments in meters.
+    """
+
+    def __init__(
+        self, version, bounds, cell_size, shape, score_bands, preferred_bands, polygon_count
+    ):
+        self.version = version
+        self.bounds = bounds
+        self.cell_size = cell_size
+        self.shape = shape
+        self.score_bands = score_bands
+        self.preferred_bands = preferred_bands
+        self.polygon_count = polygon_count
+
+    @classmethod
+    def from_snapshot(cls, snapshot, cell_size=0.0001, max_cells=25_000_000):
+        """
+        Rasterizes the polygons of a snapshot.
+
+        Parameters:
+        ----------
+        snapshot : GeoSnapshot
+            The heatmap data
+        cell_size : float, optional
+            Edge length of a cell in degrees (default: 0.0001, about 11 m by 7 m)
+        max_cells : int, optional
+            Maximum number of cells; the cells are enlarged if the bounding box of the
+            polygons needs more (default: 25000000)
+
+        Returns:
+        ----------
+        SafetyRaster
+            The raster.
+        """
+        coords = snapshot.polygons.coords
+        if len(coords):
+            # One cell of margin, so polygons on the edge still cover cell centers
+            min_lon, min_lat = coords.min(axis=0) - cell_size
+            max_lon, max_lat = coords.max(axis=0) + cell_size
+        else:
+            min_lon = min_lat = max_lon = max_lat = 0.0
+        cells = max(1.0, (max_lon - min_lon) / cell_size * (max_lat - min_lat) / cell_size)
+        if cells > max_cells:
+            cell_size *= math.sqrt(cells / max_cells)
+        shape = (
+            math.ceil((max_lat - min_lat) / cell_size),
+            math.ceil((max_lon - min_lon) / cell_size),
+        )
+        scores = np.full(shape, SAFE_SCORE, dtype=np.float32)
+        preferred = np.zeros(shape, dtype=bool)
+        raster = cls(
+            snapshot.version, (float(min_lon), float(min_lat)), cell_size, shape, (), (), 0
+        )
+        raster._rasterize(snapshot, 0, scores, preferred, 0)
+        raster.score_bands = tuple(_bands(scores))
+        raster.preferred_bands = tuple(_bands(preferred))
+        return raster
+
+    def extended(self, snapshot):
+        """
+        Returns the raster of a later snapshot, rasterizing only the polygons added since.
+
+        Parameters:
+        ----------
+        snapshot : GeoSnapshot
+            A snapshot that evolved from the one the raster was built from
+
+        Returns:
+        ----------
+        SafetyRaster or None
+            The raster of the snapshot, or None if an added polygon lies outside the grid or
+            the snapshot has fewer polygons, and the raster has to be rebuilt with
+            from_snapshot.
+        """
+        if len(snapshot.polygons.offsets) <= self.polygon_count:
+            return None  # Reloaded with less data, e.g. from edited CSV files
+        added = snapshot.polygons.coords[snapshot.polygons.offsets[self.polygon_count]:]
+        rows, cols = self.shape
+        min_lon, min_lat = self.bounds
+        if len(added) and (
+            added[:, 0].min() < min_lon
+            or added[:, 1].min() < min_lat
+            or added[:, 0].max() >= min_lon + cols * self.cell_size
+            or added[:, 1].max() >= min_lat + rows * self.cell_size
+        ):
+            return None
+        raster = SafetyRaster(
+            snapshot.version,
+            self.bounds,
+            self.cell_size,
+            self.shape,
+            self.score_bands,
+            self.preferred_bands,
+            self.polygon_count,
+        )
+        row_start, heights, _, _ = raster._windows(
+            snapshot.polygon_geometries[self.polygon_count:]
+        )
+        touched = heights > 0
+        if not touched.any():
+            raster.polygon_count = len(snapshot.polygons.offsets) - 1
+            return raster
+
+        # Copy the bands the added polygons overlap, all others stay shared
+        first = row_start[touched].min() // BAND_ROWS
+        last = (row_start + heights - 1)[touched].max() // BAND_ROWS + 1
+        scores = np.concatenate(self.score_bands[first:last])
+        preferred = np.concatenate(self.preferred_bands[first:last])
+        raster._rasterize(snapshot, self.polygon_count, scores, preferred, first * BAND_ROWS)
+        raster.score_bands = (
+            self.score_bands[:first] + tuple(_bands(scores)) + self.score_bands[last:]
+        )
+        raster.preferred_bands = (
+            self.preferred_bands[:first] + tuple(_bands(preferred)) + self.preferred_bands[last:]
+        )
+        return raster
+
+    def _windows(self, geometries):
+        """
+        Returns the first row, the number of rows, the first column and the number of
+        columns of the cells overlapping the bounding box of every geometry.
+        """
+        rows, cols = self.shape
+        min_lon, min_lat = self.bounds
+        bounds = np.nan_to_num(shapely.bounds(geometries).reshape(-1, 4), nan=-np.inf)
+        col_start = np.clip(np.floor((bounds[:, 0] - min_lon) / self.cell_size), 0, cols)
+        row_start = np.clip(np.floor((bounds[:, 1] - min_lat) / self.cell_size), 0, rows)
+        col_stop = np.clip(np.floor((bounds[:, 2] - min_lon) / self.cell_size) + 1, 0, cols)
+        row_stop = np.clip(np.floor((bounds[:, 3] - min_lat) / self.cell_size) + 1, 0, rows)
+        row_start, col_start = row_start.astype(np.intp), col_start.astype(np.intp)
+        heights = np.maximum(row_stop.astype(np.intp) - row_start, 0)
+        widths = np.maximum(col_stop.astype(np.intp) - col_start, 0)
+        return row_start, heights, col_start, widths
+
+    def _rasterize(
+        self, snapshot, start, window_scores, window_preferred, first_row, chunk_cells=1_000_000
+    ):
+        """
+        Burns the snapshot polygons from index start on into unshared arrays of the grid
+        rows from first_row on.
+
+        The cell centers in the bounding box window of every polygon are tested in
+        vectorized chunks of about chunk_cells cells.
+        """
+        geometries = snapshot.polygon_geometries[start:]
+        if not len(geometries):
+            return
+        scores = np.clip(np.nan_to_num(snapshot.polygons.scores[start:], nan=SAFE_SCORE), 0, 1)
+        preferred_kind = snapshot.polygons.kinds[start:] == KIND_PREFERRED
+        cols = self.shape[1]
+        min_lon, min_lat = self.bounds
+        cell_scores = window_scores.reshape(-1)
+        cell_preferred = window_preferred.reshape(-1)
+        window_cells = len(cell_scores)
+
+        # Windows of the cells overlapping the bounding box of each polygon
+        row_start, heights, col_start, widths = self._windows(geometries)
+        sizes = heights * widths
+
+        # Chunks of consecutive polygons with about chunk_cells cells in their windows
+        chunk = (np.cumsum(sizes) - sizes) // chunk_cells
+        edges = [0, *(np.flatnonzero(np.diff(chunk)) + 1), len(sizes)]
+        for first, last in zip(edges[:-1], edges[1:]):
+            ids = np.arange(first, last)
+            counts = sizes[ids]
+
+            # Every cell of every window, with the polygon it belongs to
+            owner = np.repeat(ids, counts)
+            local = np.arange(len(owner)) - np.repeat(np.cumsum(counts) - counts, counts)
+            row = row_start[owner] + local // widths[owner]
+            col = col_start[owner] + local % widths[owner]
+            inside = shapely.contains_xy(
+                geometries[owner],
+                min_lon + (col + 0.5) * self.cell_size,
+                min_lat + (row + 0.5) * self.cell_size,
+            )
+            owner, cells = owner[inside], ((row - first_row) * cols + col)[inside]
+
+            # Polygons between cell centers still mark the cell they lie in
+            missed = ids[np.bincount(owner - first, minlength=len(ids)) == 0]
+            missed = missed[~shapely.is_empty(geometries[missed])]
+            if len(missed):
+                points = shapely.get_coordinates(shapely.point_on_surface(geometries[missed]))
+                missed_row, missed_col, on_grid = self._cells(points)
+                missed_cells = (missed_row - first_row) * cols + missed_col
+                on_grid &= (missed_cells >= 0) & (missed_cells < window_cells)
+                owner = np.concatenate([owner, missed[on_grid]])
+                cells = np.concatenate([cells, missed_cells[on_grid]])
+
+            is_preferred = preferred_kind[owner]
+            cell_preferred[cells[is_preferred]] = True
+            np.minimum.at(cell_scores, cells[~is_preferred], scores[owner[~is_preferred]])
+        self.polygon_count += len(geometries)
+
+    def _cells(self, coordinates):
+        """
+        Returns the row and column of the cell of every point and whether it is on the grid.
+        """
+        rows, cols = self.shape
+        col = np.floor((coordinates[:, 0] - self.bounds[0]) / self.cell_size)
+        row = np.floor((coordinates[:, 1] - self.bounds[1]) / self.cell_size)
+        on_grid = (row >= 0) & (row < rows) & (col >= 0) & (col < cols)
+        row = np.where(on_grid, row, 0).astype(np.intp)
+        col = np.where(on_grid, col, 0).astype(np.intp)
+        return row, col, on_grid
+
+    def sample(self, coordinates):
+        """
+        Returns the safety scores and preferred flags at points.
+
+        Parameters:
+        ----------
+        coordinates : numpy.ndarray
+            The (N, 2) array of (longitude, latitude) points
+
+        Returns:
+        ----------
+        tuple
+            The (N,) array of safety scores (SAFE_SCORE off the grid) and the (N,) bool
+            array of preferred flags.
+        """
+        coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+        row, col, on_grid = self._cells(coordinates)
+        scores = np.full(len(coordinates), SAFE_SCORE, dtype=np.float32)
+        preferred = np.zeros(len(coordinates), dtype=bool)
+
+        # Look the points up band by band
+        points = np.flatnonzero(on_grid)
+        band = row[points] // BAND_ROWS
+        order = np.argsort(band, kind="stable")
+        points, band = points[order], band[order]
+        for part in np.split(points, np.flatnonzero(np.diff(band)) + 1):
+            if not len(part):
+                continue
+            b = row[part[0]] // BAND_ROWS
+            band_row = row[part] - b * BAND_ROWS
+            scores[part] = self.score_bands[b][band_row, col[part]]
+            preferred[part] = self.preferred_bands[b][band_row, col[part]]
+        return scores, preferred
+
+    def segment_exposure(self, starts, ends):
+        """
+        Measures how far straight segments run through unsafe and preferred cells.
+
+        Every segment is sampled at least twice per cell it crosses, in one vectorized pass
+        over all segments. Every meter in a cell adds (1 - safety score) meters of badness,
+        like in services.scoring.score_route.
+
+        Parameters:
+        ----------
+        starts : numpy.ndarray
+            The (N, 2) array of (longitude, latitude) start points
+        ends : numpy.ndarray
+            The (N, 2) array of (longitude, latitude) end points
+
+        Returns:
+        ----------
+        tuple
+            The (N,) arrays of badness and of length in preferred areas in meters.
+        """
+        starts = np.asarray(starts, dtype=float).reshape(-1, 2)
+        ends = np.asarray(ends, dtype=float).reshape(-1, 2)
+        if not len(starts):
+            return np.zeros(0), np.zeros(0)
+        lengths = haversine_m(starts[:, 0], starts[:, 1], ends[:, 0], ends[:, 1])
+        deltas = ends - starts
+        steps = np.maximum(
+            1, np.ceil(np.hypot(deltas[:, 0], deltas[:, 1]) / (self.cell_size / 2))
+        ).astype(np.intp)
+
+        # Midpoints of the equal pieces every segment is cut into
+        segment = np.repeat(np.arange(len(starts)), steps)
+        piece = np.arange(len(segment)) - np.repeat(np.cumsum(steps) - steps, steps)
+        t = (piece + 0.5) / steps[segment]
+        scores, preferred = self.sample(starts[segment] + deltas[segment] * t[:, None])
+
+        piece_lengths = (lengths / steps)[segment]
+        badness = np.bincount(
+            segment, weights=(1 - scores) * piece_lengths, minlength=len(starts)
+        )
+        preferred_lengths = np.bincount(
+            segment, weights=preferred * piece_lengths, minlength=len(starts)
+        )
+        return badness, preferred_lengths
+
+
+def _bands(grid):
+    """
+    Splits a grid into views of BAND_ROWS rows each.
+    """
+    return np.split(grid, range(BAND_ROWS, len(grid), BAND_ROWS))
@@ -0,0 +1,138 @@
+import numpy as np
+import shapely
+from services.geo import haversine_m
+
+LINESTRING_TYPE_ID = 1
+
+
+def line_lengths_m(lines):
+    """
+    Calculates the lengths of (longitude, latitude) linestrings in meters.
+
+    All coordinates are measured in a single vectorized haversine pass.
+
+    Parameters:
+    ----------
+    lines : numpy.ndarray
+        An array of shapely LineStrings
+
+    Returns:
+    ----------
+    numpy.ndarray
+        The length of every linestring in meters
+    """
+    coordinates, owner = shapely.get_coordinates(lines, return_index=True)
+    if len(coordinates) < 2:
+        return np.zeros(len(lines))
+    lengths = haversine_m(
+        coordinates[:-1, 0], coordinates[:-1, 1], coordinates[1:, 0], coordinates[1:, 1]
+    )
+    # Only consecutive coordinates of the same linestring form a segment
+    same_line = owner[:-1] == owner[1:]
+    return np.bincount(
+        owner[:-1][same_line], weights=lengths[same_line], minlength=len(lines)
+    )
+
+
+def score_route(route_data, heatmap_index, safety_scores, badness_weight=1.0):
+    """
+    Scores a route by its length and the distance it travels through unsafe polygons.
+
+    The route is intersected with all polygons it touches in one pass, and the clipped
+    pieces are measured with a vectorized haversine. Every meter inside a polygon adds
+    (1 - safety score) meters of badness, so a route that only clips the corner of a
+    polygon is only penalized for that corner. Overlapping polygons each add their share.
+
+    Parameters:
+    ----------
+    route_data : dict
+        A single path of a GraphHopper response (e.g., route["paths"][0])
+    heatmap_index : SpatialIndex
+        Spatial index over the heatmap polygons
+    safety_scores : sequence
+        A safety score for every polygon in the heatmap index
+    badness_weight : float, optional
+        Weight of the badness score in the heuristic (default: 1.0)
+
+    Returns:
+    ----------
+    dict
+        The route distance, badness and heuristic value in meters, and a per-polygon
+        breakdown with the index, safety score, length inside and badness of every
+        polygon the route passes through.
+    """
+    total_distance = route_data["distance"]
+    coordinates = np.asarray(route_data["points"]["coordinates"], dtype=float)[:, :2]
+
+    breakdown = []
+    badness_score = 0.0
+    if len(coordinates) >= 2:
+        route_line = shapely.linestrings(coordinates)
+        polygon_indices = heatmap_index.query(route_line, predicate="intersects")
+        clipped = shapely.intersection(
+            route_line, heatmap_index.geometries[polygon_indices]
+        )
+
+        # Touching a polygon in single points does not add any length
+        parts, owner = shapely.get_parts(clipped, return_index=True)
+        is_line = shapely.get_type_id(parts) == LINESTRING_TYPE_ID
+        lengths = np.bincount(
+            owner[is_line],
+            weights=line_lengths_m(parts[is_line]),
+            minlength=len(polygon_indices),
+        )
+
+        for polygon_index, length in zip(polygon_indices, lengths):
+            safety_score = safety_scores[polygon_index]
+            badness = (1 - safety_score) * length
+            badness_score += badness
+            breakdown.append(
+                {
+                    "index": int(polygon_index),
+                    "safetyScore": safety_score,
+                    "length": float(length),
+                    "badness": float(badness),
+                }
+            )
+
+    return {
+        "distance": total_distance,
+        "badness": badness_score,
+        "heuristic": total_distance + badness_weight * badness_score,
+        "polygons": breakdown,
+    }
+
+
+def score_route_raster(route_data, raster, badness_weight=1.0):
+    """
+    Scores a route like score_route, but looks the safety up in a SafetyRaster.
+
+    All segments of the route are sampled in one vectorized pass, so the cost does not
+    depend on the number of heatmap polygons. Where polygons overlap, only the lowest
+    safety score counts, and there is no per-polygon breakdown.
+
+    Parameters:
+    ----------
+    route_data : dict
+        A single path of a GraphHopper response (e.g., route["paths"][0])
+    raster : SafetyRaster
+        The raster of the heatmap
+    badness_weight : float, optional
+        Weight of the badness score in the heuristic (default: 1.0)
+
+    Returns:
+    ----------
+    dict
+        The route distance, badness, heuristic value and length through preferred areas
+        in meters.
+    """
+    total_distance = route_data["distance"]
+    coordinates = np.asarray(route_data["points"]["coordinates"], dtype=float)[:, :2]
+    badness, preferred = raster.segment_exposure(coordinates[:-1], coordinates[1:])
+    badness_score = float(badness.sum())
+    return {
+        "distance": total_distance,
+        "badness": badness_score,
+        "heuristic": total_distance + badness_weight * badness_score,
+        "preferredLength": float(preferred.sum()),
+    }
@@ -0,0 +1,168 @@
+import numpy as np
+import shapely
+from shapely.geometry import Point, Polygon
+
+
+def repair_polygons(polygons):
+    """
+    Replaces invalid polygons, e.g. self-intersecting "bowtie" rings, by valid geometries
+    covering the same area, so GEOS operations like intersection do not raise on them.
+
+    Parameters:
+    ----------
+    polygons : numpy.ndarray
+        An array of shapely polygons, repaired in place
+
+    Returns:
+    ----------
+    numpy.ndarray
+        The array of polygons
+    """
+    invalid = ~shapely.is_valid(polygons)
+    if invalid.any():
+        polygons[invalid] = shapely.make_valid(polygons[invalid])
+    return polygons
+
+
+class SpatialIndex:
+    """
+    SpatialIndex class.
+
+    Wraps a shapely STRtree over a list of geometries so that lookups only test
+    geometries whose bounding box matches the query.
+
+    Attributes:
+    ----------
+    geometries : numpy.ndarray
+        The indexed (prepared) shapely geometries, in the order of the source data.
+    tree : shapely.STRtree
+        The STRtree built over the geometries.
+
+    Methods:
+    ----------
+    from_points(coordinates) : SpatialIndex
+        Builds an index over a list of (longitude, latitude) points.
+    from_polygons(polygons) : SpatialIndex
+        Builds an index over a list of polygon rings.
+    from_rings(coords, offsets) : SpatialIndex
+        Builds an index over polygon rings stored in columnar arrays.
+    query(geometry, predicate=None) : numpy.ndarray
+        Returns the indices of the indexed geometries matching the query geometry.
+
+    Notes:
+    -----
+    STRtrees are immutable, so the index is rebuilt whenever the source data changes.
+    Polygons built from rings are repaired with shapely.make_valid if they are invalid, e.g.
+    self-intersecting rings drawn by users, so intersecting them never raises.
+    """
+
+    def __init__(self, geometries):
+        """
+        Initializes the SpatialIndex with the specified geometries.
+
+        Parameters:
+        ----------
+        geometries : list
+            The shapely geometries to index.
+        """
+        self.geometries = np.array(geometries, dtype=object)
+        shapely.prepare(self.geometries)
+        self.tree = shapely.STRtree(self.geometries)
+
+    @classmethod
+    def from_points(cls, coordinates):
+        """
+        Builds an index over a list of (longitude, latitude) points.
+
+        Parameters:
+        ----------
+        coordinates : list
+            The point coordinates (e.g., [[9.180221, 48.783391]]).
+
+        Returns:
+        ----------
+        SpatialIndex
+            The index over the points.
+        """
+        if isinstance(coordinates, np.ndarray):
+            return cls(shapely.points(coordinates.reshape(-1, 2)))
+        return cls([Point(coord) for coord in coordinates])
+
+    @classmethod
+    def from_polygons(cls, polygons):
+        """
+        Builds an index over a list of polygon rings.
+
+        Parameters:
+        ----------
+        polygons : list
+            The closed polygon rings as lists of (longitude, latitude) coordinates.
+            Rings with less than four coordinates are indexed as empty polygons.
+
+        Returns:
+        ----------
+        SpatialIndex
+            The index over the polygons.
+        """
+        geometries = np.empty(len(polygons), dtype=object)
+        geometries[:] = [
+            Polygon(polygon) if len(polygon) >= 4 else Polygon() for polygon in polygons
+        ]
+        return cls(repair_polygons(geometries))
+
+    @classmethod
+    def from_rings(cls, coords, offsets):
+        """
+        Builds an index over polygon rings stored in columnar arrays, without creating
+        intermediate Python lists.
+
+        Parameters:
+        ----------
+        coords : numpy.ndarray
+            The (N, 2) array of the vertices of all rings.
+        offsets : numpy.ndarray
+            The (M + 1,) array; ring i spans coords[offsets[i]:offsets[i + 1]].
+            Rings with less than four coordinates are indexed as empty polygons.
+
+        Returns:
+        ----------
+        SpatialIndex
+            The index over the polygons.
+        """
+        lengths = np.diff(offsets)
+        polygons = np.full(len(lengths), Polygon(), dtype=object)
+        valid = lengths >= 4
+        if valid.any():
+            ring_ids = np.repeat(np.arange(len(lengths)), lengths)
+            vertices = np.repeat(valid, lengths)
+            rings = shapely.linearrings(
+                coords[vertices], indices=np.unique(ring_ids[vertices], return_inverse=True)[1]
+            )
+            polygons[valid] = shapely.polygons(rings)
+        return cls(repair_polygons(polygons))
+
+    def __len__(self):
+        return len(self.geometries)
+
+    def query(self, geometry, predicate=None):
+        """
+        Returns the indices of the indexed geometries matching the query geometry.
+
+        Parameters:
+        ----------
+        geometry : shapely.Geometry or numpy.ndarray
+            The query geometry, or an array of query geometries.
+        predicate : str, optional
+            A binary predicate evaluated as predicate(geometry, indexed geometry), e.g.
+            "intersects" or "contains". Without a predicate only bounding boxes are compared.
+
+        Returns:
+        ----------
+        numpy.ndarray
+            For a single geometry, the sorted indices of the matching geometries. For an array,
+            a 2 x n array with the query indices in the first and the matches in the second row.
+        """
+        result = self.tree.query(geometry, predicate=predicate)
+        if result.ndim == 1:
+            result = np.sort(result)
+        return result
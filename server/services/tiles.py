@@ -0,0 +1,132 @@
+import math
+
+import numpy as np
+import shapely
+
+TILE_SIZE_PX = 256
+MAX_ZOOM = 22
+MAX_LATITUDE = 85.0511287798066
+
+
+def tile_bounds(z, x, y):
+    """
+    Returns the bounds of a Web Mercator (slippy map) tile.
+
+    Parameters:
+    ----------
+    z : int
+        The zoom level
+    x : int
+        The tile column, counted from the west
+    y : int
+        The tile row, counted from the north
+
+    Returns:
+    ----------
+    tuple
+        (min longitude, min latitude, max longitude, max latitude) of the tile.
+    """
+    n = 2**z
+
+    def latitude(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return (x / n * 360.0 - 180.0, latitude(y + 1), (x + 1) / n * 360.0 - 180.0, latitude(y))
+
+
+def tile_tolerance(z):
+    """
+    Returns the simplification tolerance in degrees for a zoom level, the width of one
+    pixel of a tile.
+    """
+    return 360.0 / (TILE_SIZE_PX * 2**z)
+
+
+def is_valid_tile(z, x, y):
+    """
+    Returns whether the tile coordinates exist.
+    """
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2**z and 0 <= y < 2**z
+
+
+def _polygon_parts(geometry):
+    """
+    Returns the non-empty polygons of a geometry, e.g. the parts of a MultiPolygon or
+    GeometryCollection that shapely.make_valid repaired a self-intersecting ring into.
+    """
+    parts = shapely.get_parts(geometry)
+    while True:
+        nested = np.isin(shapely.get_type_id(parts), (6, 7))  # MultiPolygon, collection
+        if not nested.any():
+            break
+        parts = np.concatenate([parts[~nested], shapely.get_parts(parts[nested])])
+    return parts[(shapely.get_type_id(parts) == 3) & ~shapely.is_empty(parts)]
+
+
+def build_tile(snapshot, z, x, y):
+    """
+    Returns the heatmap features intersecting a tile, simplified for its zoom level.
+
+    Polygons are returned whole rather than clipped to the tile, together with their id in
+    the snapshot, so a client can draw a polygon spanning several tiles only once. Like the
+    /heatmap endpoint, coordinates are returned as [latitude, longitude] and rounded to the
+    precision visible at the zoom level. A polygon that was repaired into several parts
+    (see services.spatial_index.repair_polygons) is returned as the list of the rings of
+    its parts, [[ring], [ring]], which Leaflet draws as a MultiPolygon.
+
+    Parameters:
+    ----------
+    snapshot : GeoSnapshot
+        The heatmap data
+    z, x, y : int
+        The tile coordinates
+
+    Returns:
+    ----------
+    dict
+        The heatmap, preferred and safe place features of the tile.
+    """
+    tile = shapely.box(*tile_bounds(z, x, y))
+    tolerance = tile_tolerance(z)
+    decimals = max(0, math.ceil(-math.log10(tolerance)) + 1)
+
+    def polygons(index):
+        positions = index.query(tile, predicate="intersects")
+        simplified = shapely.simplify(
+            index.geometries[positions], tolerance, preserve_topology=True
+        )
+        coordinates = []
+        kept = []
+        for position, geometry in zip(positions, simplified):
+            rings = []
+            for part in _polygon_parts(geometry):
+                ring = shapely.get_coordinates(shapely.get_exterior_ring(part))[:, ::-1]
+                rings.append(np.round(ring, decimals).tolist())
+            if not rings:
+                continue
+            coordinates.append(rings[0] if len(rings) == 1 else [[ring] for ring in rings])
+            kept.append(position)
+        return np.asarray(kept, dtype=np.int64), coordinates
+
+    heatmap_positions, heatmap_coordinates = polygons(snapshot.heatmap_index)
+    preferred_positions, preferred_coordinates = polygons(snapshot.preferred_index)
+    safe_place_ids = snapshot.safe_place_index.query(tile, predicate="intersects")
+
+    return {
+        "zoom": z,
+        "heatmap": {
+            "ids": snapshot.heatmap_ids[heatmap_positions].tolist(),
+            "coordinates": heatmap_coordinates,
+            "safetyScores": snapshot.heatmap_scores[heatmap_positions].tolist(),
+        },
+        "safePlaces": {
+            "ids": safe_place_ids.tolist(),
+            "coordinates": np.round(
+                snapshot.safe_places[safe_place_ids][:, ::-1], decimals
+            ).tolist(),
+        },
+        "preferred": {
+            "ids": snapshot.preferred_ids[preferred_positions].tolist(),
+            "coordinates": preferred_coordinates,
+        },
+    }
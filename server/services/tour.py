@@ -0,0 +1,65 @@
+import time
+
+
+def beam_search_tour(distances, max_distance, max_stops=3, beam_width=8, deadline=None):
+    """
+    Plans routes from an origin to a destination that pass as many stops as possible within
+    a distance budget.
+
+    Partial tours are extended stop by stop. After every step only the beam_width shortest
+    tours are kept, and only tours that can still reach the destination within the budget
+    are considered at all. This is a bounded heuristic for the orienteering problem, not an
+    exact solution.
+
+    Parameters:
+    ----------
+    distances : list
+        The square matrix of route distances between the points; point 0 is the origin, the
+        last point the destination and the points in between are the possible stops. None
+        marks unconnected pairs.
+    max_distance : float
+        Maximum distance of a tour in meters
+    max_stops : int, optional
+        Maximum number of stops of a tour (default: 3)
+    beam_width : int, optional
+        Number of partial tours kept after every step (default: 8)
+    deadline : float, optional
+        Point in time (as returned by time.monotonic()) after which the search stops and
+        returns the tours found so far
+
+    Returns:
+    ----------
+    list
+        (stops, distance) pairs of all feasible tours found, with at least one stop, ordered
+        by descending number of stops and then by ascending distance. The stops are the
+        indices of the points in visiting order.
+    """
+    destination = len(distances) - 1
+
+    def total(stops, distance):
+        closing = distances[stops[-1]][destination]
+        return None if closing is None else distance + closing
+
+    beam = [((), 0.0)]  # partial tours from the origin and their distance so far
+    tours = []
+    for _ in range(max_stops):
+        if deadline is not None and time.monotonic() > deadline:
+            break
+        extended = []
+        for stops, distance in beam:
+            last = stops[-1] if stops else 0
+            for stop in range(1, destination):
+                leg = distances[last][stop]
+                if stop in stops or leg is None:
+                    continue
+                tour = (stops + (stop,), distance + leg)
+                length = total(*tour)
+                if length is not None and length <= max_distance:
+                    extended.append(tour)
+                    tours.append((tour[0], length))
+        if not extended:
+            break
+        beam = sorted(extended, key=lambda tour: total(*tour))[:beam_width]
+
+    tours.sort(key=lambda tour: (-len(tour[0]), tour[1]))
+    return tours
@@ -0,0 +1,346 @@
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """
+    Raised instead of calling the upstream while the circuit breaker is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    CircuitBreaker class.
+
+    Tracks consecutive upstream failures and opens after a threshold is reached, so calls
+    fail fast while the upstream is degraded. After the reset timeout a single probe call
+    is let through; its outcome closes the breaker again or keeps it open.
+
+    Attributes:
+    ----------
+    failure_threshold : int
+        Number of consecutive failures that open the breaker.
+    reset_timeout_s : float
+        Time in seconds the breaker stays open before a probe call is allowed.
+    state : str
+        One of "closed", "open" and "half_open".
+
+    Methods:
+    ----------
+    before_call() : None
+        Raises CircuitOpenError if no call may be made right now.
+    record_success() : None
+        Records a successful call.
+    record_failure() : None
+        Records a failed call.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout_s=30.0):
+        """
+        Initializes the CircuitBreaker instance.
+
+        Parameters:
+        ----------
+        failure_threshold : int, optional
+            Number of consecutive failures that open the breaker (default: 5)
+        reset_timeout_s : float, optional
+            Time in seconds before a probe call is allowed (default: 30.0)
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """
+        Raises CircuitOpenError if the breaker is open, or half open with a probe in flight.
+        """
+        with self._lock:
+            if self.state == "closed":
+                return
+            if (
+                self.state == "open"
+                and time.monotonic() - self._opened_at >= self.reset_timeout_s
+            ):
+                self.state = "half_open"  # let this call through as the probe
+                return
+            raise CircuitOpenError("Upstream circuit breaker is open")
+
+    def record_success(self):
+        """
+        Records a successful call and closes the breaker.
+        """
+        with self._lock:
+            self._failures = 0
+            self.state = "closed"
+
+    def record_failure(self):
+        """
+        Records a failed call and opens the breaker if the threshold is reached or a probe failed.
+        """
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+class UpstreamClient:
+    """
+    UpstreamClient class.
+
+    Shared HTTP client for all GraphHopper traffic. It keeps a pool of keep-alive
+    connections, retries on rate limiting and server errors with jittered exponential
+    backoff, and fails fast through a circuit breaker while the upstream is degraded.
+
+    Attributes:
+    ----------
+    base_url : str
+        The base URL of the API (e.g., "https://graphhopper.com/api/1").
+    connect_timeout_s : float
+        Timeout in seconds for establishing a connection.
+    read_timeout_s : float
+        Default timeout in seconds for waiting on a response.
+    total_timeout_s : float
+        Default time budget in seconds of a call including its retries and their backoff.
+    max_retries : int
+        Number of retries after a failed attempt.
+    breaker : CircuitBreaker
+        The circuit breaker guarding the upstream.
+    session : requests.Session
+        The pooled session used for all requests.
+    metrics : Metrics or None
+        Where the calls, their duration and their request and response bytes are recorded.
+
+    Methods:
+    ----------
+    get(path, params=None, timeout=None) : requests.Response
+        Sends a GET request.
+    post(path, params=None, timeout=None, **kwargs) : requests.Response
+        Sends a POST request.
+    after_fork() : None
+        Replaces the connection pool inherited by a forked process.
+    close() : None
+        Closes all pooled connections.
+    """
+
+    def __init__(
+        self,
+        base_url,
+        pool_size=16,
+        connect_timeout_s=3.05,
+        read_timeout_s=10.0,
+        total_timeout_s=30.0,
+        max_retries=2,
+        backoff_base_s=0.2,
+        backoff_max_s=2.0,
+        breaker=None,
+        metrics=None,
+    ):
+        """
+        Initializes the UpstreamClient instance.
+
+        Parameters:
+        ----------
+        base_url : str
+            The base URL of the API (e.g., "https://graphhopper.com/api/1")
+        pool_size : int, optional
+            Maximum number of pooled connections to the upstream (default: 16)
+        connect_timeout_s : float, optional
+            Timeout in seconds for establishing a connection (default: 3.05)
+        read_timeout_s : float, optional
+            Default timeout in seconds for waiting on a response (default: 10.0)
+        total_timeout_s : float, optional
+            Time budget in seconds of a call without an explicit timeout, including its
+            retries and their backoff (default: 30.0)
+        max_retries : int, optional
+            Number of retries after a failed attempt (default: 2)
+        backoff_base_s : float, optional
+            Base delay in seconds of the exponential backoff (default: 0.2)
+        backoff_max_s : float, optional
+            Maximum delay in seconds between two attempts (default: 2.0)
+        breaker : CircuitBreaker, optional
+            The circuit breaker to use (default: a new CircuitBreaker)
+        metrics : Metrics, optional
+            Where to record the calls (default: None, nothing is recorded)
+        """
+        self.base_url = base_url.rstrip("/")
+        self.connect_timeout_s = connect_timeout_s
+        self.read_timeout_s = read_timeout_s
+        self.total_timeout_s = total_timeout_s
+        self.max_retries = max_retries
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.metrics = metrics
+        self.pool_size = pool_size
+        self.session = self._create_session()
+
+    def _create_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def get(self, path, params=None, timeout=None):
+        """
+        Sends a GET request.
+
+        Parameters:
+        ----------
+        path : str
+            The path relative to the base URL (e.g., "/geocode")
+        params : dict, optional
+            The query parameters
+        timeout : float, optional
+            Time budget in seconds of this request including its retries (default: a read
+            timeout of read_timeout_s per attempt and a budget of total_timeout_s)
+
+        Returns:
+        ----------
+        requests.Response
+            The response of the last attempt.
+        """
+        return self.request("GET", path, params=params, timeout=timeout)
+
+    def post(self, path, params=None, timeout=None, **kwargs):
+        """
+        Sends a POST request.
+
+        Parameters:
+        ----------
+        path : str
+            The path relative to the base URL (e.g., "/route")
+        params : dict, optional
+            The query parameters
+        timeout : float, optional
+            Time budget in seconds of this request including its retries (default: a read
+            timeout of read_timeout_s per attempt and a budget of total_timeout_s)
+        **kwargs
+            Further arguments for requests, e.g. json, data or headers
+
+        Returns:
+        ----------
+        requests.Response
+            The response of the last attempt.
+        """
+        return self.request("POST", path, params=params, timeout=timeout, **kwargs)
+
+    def request(self, method, path, params=None, timeout=None, **kwargs):
+        """
+        Sends a request, retrying on connection errors, rate limiting and server errors.
+
+        Raises:
+        ----------
+        CircuitOpenError
+            If the circuit breaker is open.
+        requests.exceptions.RequestException
+            If the last attempt failed without a response.
+        """
+        if self.metrics is None:
+            return self._request_with_retries(method, path, params, timeout, **kwargs)
+
+        start = time.perf_counter()
+        status = "error"
+        response_bytes = 0
+        try:
+            response = self._request_with_retries(method, path, params, timeout, **kwargs)
+            status = response.status_code
+            response_bytes = len(response.content)
+            return response
+        finally:
+            self.metrics.record_upstream(
+                path,
+                status,
+                time.perf_counter() - start,
+                len(kwargs.get("data") or b""),
+                response_bytes,
+            )
+
+    def _request_with_retries(self, method, path, params, timeout, **kwargs):
+        """
+        Sends a request and retries it, see request.
+        """
+        read_timeout = self.read_timeout_s if timeout is None else timeout
+        # The budget covers all attempts and the backoff between them
+        deadline = time.monotonic() + (self.total_timeout_s if timeout is None else timeout)
+        url = self.base_url + path
+
+        for attempt in range(self.max_retries + 1):
+            self.breaker.before_call()
+            remaining = max(0.001, deadline - time.monotonic())
+            try:
+                response = self.session.request(
+                    method,
+                    url,
+                    params=params,
+                    timeout=(
+                        min(self.connect_timeout_s, remaining),
+                        min(read_timeout, remaining),
+                    ),
+                    **kwargs,
+                )
+            except requests.exceptions.ConnectionError:
+                self.breaker.record_failure()
+                delay = self.backoff_delay(attempt)
+                if attempt == self.max_retries or time.monotonic() + delay >= deadline:
+                    raise
+            except requests.exceptions.Timeout:
+                # A read timeout already used up the caller's time budget, so do not retry
+                self.breaker.record_failure()
+                raise
+            except BaseException:
+                # Any other error also ends the call, and must release a half open probe
+                self.breaker.record_failure()
+                raise
+            else:
+                if response.status_code not in RETRY_STATUS_CODES:
+                    self.breaker.record_success()
+                    return response
+                self.breaker.record_failure()
+                delay = self.backoff_delay(attempt)
+                if attempt == self.max_retries or time.monotonic() + delay >= deadline:
+                    return response
+                response.close()
+
+            time.sleep(delay)
+
+    def backoff_delay(self, attempt):
+        """
+        Returns the delay before the next attempt, with full jitter.
+
+        Parameters:
+        ----------
+        attempt : int
+            The number of the failed attempt, starting at 0
+
+        Returns:
+        ----------
+        float
+            The delay in seconds
+        """
+        return random.uniform(
+            0, min(self.backoff_max_s, self.backoff_base_s * 2**attempt)
+        )
+
+    def after_fork(self):
+        """
+        Replaces the connection pool in a forked process without closing the connections
+        the parent process still uses.
+        """
+        self.session = self._create_session()
+
+    def close(self):
+        """
+        Closes all pooled connections.
+        """
+        self.session.close()
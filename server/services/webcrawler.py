@@ -1,11 +1,29 @@
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 from pathlib import Path
 
 import requests
 from dotenv import load_dotenv
 from geopy.distance import geodesic
+from services.cache import SingleFlight, TTLCache
+from services.compaction import compact_polygons
+from services.custom_model import (
+    build_matrix_request,
+    build_route_request,
+    compile_custom_model,
+    polygon_areas,
+)
+from services.geo import estimate_detour_m
 from services.heatmap import Heatmap
-from shapely.geometry import LineString, Point, Polygon
+from services.local_router import LocalRouter
+from services.metrics import Counter, Metrics, submit_with_context
+from services.raster import SafetyRaster
+from services.scoring import score_route, score_route_raster
+from services.tour import beam_search_tour
+from services.upstream import UpstreamClient
+from shapely.geometry import LineString
 
 
 class WebCrawler(Heatmap):
@@ -19,6 +37,15 @@ class WebCrawler(Heatmap):
     api_key : str
         The loaded API key.
 
+    upstream : UpstreamClient
+        Pooled HTTP client with retries and a circuit breaker used for all GraphHopper calls
+
+    local_router : LocalRouter or None
+        In-process router used instead of the GraphHopper route endpoint if routing_backend is "local"
+
+    metrics : Metrics
+        Timing spans of the route pipeline stages and upstream call statistics
+
     heatmap_coords : list
         A list of polygons for the heatmap
 
@@ -31,34 +58,355 @@ class WebCrawler(Heatmap):
     safe_place_coords : list
         A list of coordinates for safe places
 
+    max_workers : int
+        Maximum number of safe place candidates evaluated concurrently
+
+    batch_workers : int
+        Maximum number of routes of a batch computed concurrently
+
+    max_batch_size : int
+        Maximum number of routes in one batch
+
+    candidate_deadline_s : float
+        Time budget in seconds for evaluating all safe place candidates of one route request
+
+    max_candidates : int
+        Maximum number of safe place candidates sent upstream per route request
+
+    detour_mode : str
+        How safe place candidates are evaluated: "routes" (one route call each), "matrix"
+        (one matrix call for all of them) or "multi" (a tour through several of them)
+
+    max_waypoints : int
+        Maximum number of safe places a route passes in "multi" mode
+
+    max_tour_calls : int
+        Maximum number of upstream calls spent on planning a tour in "multi" mode
+
+    badness_weight : float
+        Weight of the badness score relative to the route distance in the heuristic
+
+    scoring_mode : str
+        How routes and candidates are scored against the heatmap: "exact" (polygon
+        intersections) or "raster" (lookups in a SafetyRaster)
+
+    suggestion_cache : TTLCache
+        Cache of geocode suggestions, keyed by normalized query
+
+    route_cache : TTLCache
+        Cache of final routes, keyed by snapped origin and destination, profile and data version
+
+    routing_call_cache : TTLCache
+        Cache of single routing calls, keyed like the route cache plus the waypoints
+
     Methods:
     ----------
     load_api_key() : str or None
         Loads the API key from a.env file in the current directory.
 
-    api_routing_call(origin, destination, waypoints, profile, optimize, heatmap, safety_scores, preferred_coords) : dict
+    warm_up() : None
+        Builds the indexes, custom model and safety raster of the current data ahead of the first request.
+
+    after_fork() : None
+        Replaces the thread pools and upstream connections inherited by a forked server worker.
+
+    close() : None
+        Waits for the routes being computed and the background work, then closes the upstream connections.
+
+    api_routing_call(origin, destination, waypoints, profile, optimize, heatmap=None, safety_scores=None, preferred_coords=None, timeout=None) : dict
         Makes a routing API call to GraphHopper with the specified origin, destination, waypoints, profile, and optimization settings.
 
+    api_matrix_call(from_points, to_points, profile, timeout=None) : dict
+        Makes a matrix API call to GraphHopper for the route distances between all pairs of points.
+
+    get_custom_model() : bytes
+        Returns the custom model of the current heatmap data, compiled once per data version.
+
+    get_safety_raster(snapshot=None) : SafetyRaster
+        Returns the safety raster of the heatmap data, extended incrementally per data version.
+
+    compact_custom_model(snapshot=None) : tuple
+        Compiles the custom model from dissolved and simplified heatmap polygons.
+
+    get_compaction_report() : dict
+        Returns the rule-count reduction of the last compaction and the routing latency per variant.
+
+    routing_call(origin, destination, waypoints, profile, timeout=None) : dict
+        Makes a routing API call with the current heatmap data, served from the cache if possible.
+
     get_route(origin, destination, profile) : dict
         Crawls the route through GraphHopper's API and returns the route data as json.
 
+    iter_route(origin, destination, profile) : generator
+        Yields the initial route right away and the route through safe places once it is ready.
+
+    get_routes(route_requests) : generator
+        Computes many routes concurrently and returns a generator of the results in the order they finish.
+
+    get_cache_stats() : dict
+        Returns the hit and miss counters of the route and suggestion caches.
+
     is_within_distance(coord1, coord2, max_distance_km=0.5) : bool
         Checks if two coordinates are within a certain distance of each other.
 
     find_nearby_safe_places(route, max_distance_for_no_detour=0.1, max_distance_for_detour=0.2) : list
         Finds nearby safe places along a route.
 
+    rank_safe_place_candidates(route_line, candidates) : list
+        Pre-ranks safe place candidates by their estimated detour and keeps the best ones.
+
+    evaluate_safe_place_candidates(origin, destination, profile, candidates, max_distance, deadline) : list
+        Evaluates detour routes for safe place candidates concurrently within a deadline.
+
+    evaluate_safe_place_candidates_matrix(origin, destination, profile, candidates, max_distance, deadline) : list or None
+        Evaluates the detour distances of safe place candidates with a single matrix call.
+
+    plan_safe_place_tour(origin, destination, profile, candidates, max_distance, deadline) : list or None
+        Plans a route through several safe places within the detour budget.
+
     get_suggestions(query) : dict
         Returns a list of suggestions based on the specified query.
 
+    calculate_heuristic(route) : float
+        Calculates a heuristic value for a route based on its length and safety score.
+
+    score_route(route) : dict
+        Scores a route against the heatmap with a per-polygon breakdown.
+
     Notes:
     -----
     This class is responsible for crawling route data from GraphHopper's API and finding nearby safe places.
     """
 
-    def __init__(self, data_dir):
+    def __init__(
+        self,
+        data_dir,
+        max_workers=8,
+        batch_workers=4,
+        max_batch_size=1000,
+        candidate_deadline_s=12.0,
+        max_candidates=5,
+        detour_mode="routes",
+        max_waypoints=3,
+        tour_beam_width=8,
+        max_tour_calls=3,
+        badness_weight=1.0,
+        scoring_mode="exact",
+        raster_cell_size=0.0001,
+        raster_max_cells=25_000_000,
+        route_cache_size=1024,
+        route_cache_ttl_s=600.0,
+        coordinate_precision=5,
+        suggestion_cache_size=4096,
+        suggestion_cache_ttl_s=3600.0,
+        suggestion_limit=10,
+        api_base_url="https://graphhopper.com/api/1",
+        upstream_pool_size=16,
+        connect_timeout_s=3.05,
+        read_timeout_s=10.0,
+        upstream_max_retries=2,
+        compaction_mode="off",
+        compaction_score_step=0.1,
+        compaction_tolerance=0.00005,
+        compaction_max_areas=32,
+        routing_backend="graphhopper",
+        road_graph_path=None,
+        metrics=None,
+        store=None,
+    ):
+        """
+        Initializes the WebCrawler instance.
+
+        Parameters:
+        ----------
+        data_dir : str
+            The directory where the CSV files are stored.
+        max_workers : int, optional
+            Maximum number of concurrent upstream calls for safe place candidates (default: 8)
+        batch_workers : int, optional
+            Maximum number of routes of a batch computed concurrently (default: 4)
+        max_batch_size : int, optional
+            Maximum number of routes in one batch (default: 1000)
+        candidate_deadline_s : float, optional
+            Time budget in seconds for evaluating all candidates of one route request (default: 12.0)
+        max_candidates : int, optional
+            Maximum number of pre-ranked candidates routed upstream per request (default: 5)
+        detour_mode : str, optional
+            How safe place candidates are evaluated: "routes" (one route call per candidate,
+            ranked by the route heuristic), "matrix" (one matrix call for all candidates,
+            ranked by detour distance) or "multi" (a tour through several candidates planned
+            on a pairwise matrix) (default: "routes")
+        max_waypoints : int, optional
+            Maximum number of safe places a route passes in "multi" mode (default: 3)
+        tour_beam_width : int, optional
+            Number of partial tours kept per step of the "multi" tour search (default: 8)
+        max_tour_calls : int, optional
+            Maximum number of upstream calls, including the matrix call, spent on planning a
+            tour in "multi" mode (default: 3)
+        badness_weight : float, optional
+            Weight of the badness score in the route heuristic (default: 1.0)
+        scoring_mode : str, optional
+            How routes and safe place candidates are scored: "exact" (intersections with the
+            heatmap polygons) or "raster" (lookups in a SafetyRaster of the heatmap, which
+            also adds the estimated badness of the detour to the candidate ranking)
+            (default: "exact")
+        raster_cell_size : float, optional
+            Edge length of a safety raster cell in degrees (default: 0.0001, about 11 m)
+        raster_max_cells : int, optional
+            Maximum number of safety raster cells; larger areas get larger cells
+            (default: 25000000)
+        route_cache_size : int, optional
+            Maximum number of entries in each of the route caches (default: 1024)
+        route_cache_ttl_s : float, optional
+            Time to live of cached routes in seconds (default: 600.0)
+        coordinate_precision : int, optional
+            Decimal places coordinates are rounded to for cache keys (default: 5, about 1 m)
+        suggestion_cache_size : int, optional
+            Maximum number of cached suggestion results (default: 4096)
+        suggestion_cache_ttl_s : float, optional
+            Time to live of cached suggestion results in seconds (default: 3600.0)
+        suggestion_limit : int, optional
+            Number of suggestions requested from GraphHopper per query (default: 10)
+        api_base_url : str, optional
+            Base URL of the GraphHopper API (default: "https://graphhopper.com/api/1")
+        upstream_pool_size : int, optional
+            Maximum number of pooled keep-alive connections to GraphHopper (default: 16)
+        connect_timeout_s : float, optional
+            Timeout in seconds for connecting to GraphHopper (default: 3.05)
+        read_timeout_s : float, optional
+            Timeout in seconds for waiting on a GraphHopper response (default: 10.0)
+        upstream_max_retries : int, optional
+            Retries of a GraphHopper call on connection errors, 429 and 5xx (default: 2)
+        compaction_mode : str, optional
+            When heatmap polygons are compacted for the custom model: "off", "write" (right
+            after every change) or "background" (on a separate thread) (default: "off")
+        compaction_score_step : float, optional
+            Width of the safety score buckets polygons are dissolved by (default: 0.1)
+        compaction_tolerance : float, optional
+            Simplification tolerance of compacted polygons in degrees (default: 0.00005)
+        compaction_max_areas : int, optional
+            Maximum number of areas in a compacted custom model (default: 32)
+        routing_backend : str, optional
+            Where routes are computed: "graphhopper" (the GraphHopper API) or "local" (A* on
+            the road graph at road_graph_path) (default: "graphhopper")
+        road_graph_path : str, optional
+            CSV edge list of the road graph for the local routing backend, see
+            services.local_router.RoadGraph.from_edge_list
+        metrics : Metrics, optional
+            Where route pipeline spans and upstream calls are recorded (default: a new Metrics)
+        store : GeoStore, optional
+            The store to share the heatmap data with (default: a new store for data_dir)
+        """
         self.api_key = self.load_api_key()
-        super().__init__(data_dir)
+        self._custom_model = (None, b"", None)
+        self._custom_model_lock = threading.Lock()
+        self._routing_latency = {}
+        self.compaction_mode = compaction_mode
+        self.compaction_score_step = compaction_score_step
+        self.compaction_tolerance = compaction_tolerance
+        self.compaction_max_areas = compaction_max_areas
+        self.compaction_report = {}
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.upstream = UpstreamClient(
+            api_base_url,
+            pool_size=upstream_pool_size,
+            connect_timeout_s=connect_timeout_s,
+            read_timeout_s=read_timeout_s,
+            max_retries=upstream_max_retries,
+            metrics=self.metrics,
+        )
+        self.routing_backend = routing_backend
+        self.local_router = None
+        if routing_backend == "local":
+            self.local_router = LocalRouter.from_file(road_graph_path)
+        elif routing_backend != "graphhopper":
+            raise ValueError(f"Unknown routing backend: {routing_backend}")
+        self.max_workers = max_workers
+        self.candidate_deadline_s = candidate_deadline_s
+        self.max_candidates = max_candidates
+        self.detour_mode = detour_mode
+        self.max_waypoints = max_waypoints
+        self.tour_beam_width = tour_beam_width
+        self.max_tour_calls = max_tour_calls
+        self.badness_weight = badness_weight
+        if scoring_mode not in ("exact", "raster"):
+            raise ValueError(f"Unknown scoring mode: {scoring_mode}")
+        self.scoring_mode = scoring_mode
+        self.raster_cell_size = raster_cell_size
+        self.raster_max_cells = raster_max_cells
+        self._safety_raster = None
+        self._safety_raster_lock = threading.Lock()
+        self.coordinate_precision = coordinate_precision
+        self.route_cache = TTLCache(route_cache_size, route_cache_ttl_s)
+        self.routing_call_cache = TTLCache(route_cache_size, route_cache_ttl_s)
+        self.suggestion_limit = suggestion_limit
+        self.suggestion_min_prefix = 3  # the client only asks from three characters on
+        self.suggestion_cache = TTLCache(suggestion_cache_size, suggestion_cache_ttl_s)
+        self.suggestion_flight = SingleFlight()
+        self.suggestion_prefix_hits = Counter(
+            "welai_suggestion_prefix_hits_total", "Suggestions answered from a cached prefix."
+        )
+        self.batch_workers = batch_workers
+        self.max_batch_size = max_batch_size
+        self._start_executors()
+        self.route_flight = SingleFlight()
+        super().__init__(data_dir, store=store)
+        if scoring_mode == "raster":
+            # Rasterize ahead of the first route, later versions are extended in on_data_changed
+            self._compaction_executor.submit(self.get_safety_raster)
+
+    def _start_executors(self):
+        """
+        Creates the thread pools of the candidate routes, batch routes and background work.
+        """
+        self._compaction_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="heatmap-compaction"
+        )
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="safe-place-candidate"
+        )
+        # Separate from the candidate pool, whose workers batch routes wait for
+        self.batch_executor = ThreadPoolExecutor(
+            max_workers=self.batch_workers, thread_name_prefix="route-batch"
+        )
+
+    def warm_up(self):
+        """
+        Builds the spatial indexes, the custom model and, in "raster" scoring mode, the
+        safety raster of the current data and waits for the background work to finish.
+
+        Called before forking server workers, so they share the results copy-on-write
+        instead of building them once per worker.
+        """
+        snapshot = self.snapshot
+        snapshot.heatmap_index
+        snapshot.safe_place_index
+        snapshot.preferred_index
+        self.get_custom_model()
+        if self.scoring_mode == "raster":
+            self.get_safety_raster(snapshot)
+        # The pool runs one task at a time, so this returns once the earlier ones are done
+        self._compaction_executor.submit(lambda: None).result()
+
+    def after_fork(self):
+        """
+        Replaces the thread pools and pooled upstream connections inherited from the parent
+        process. A forked worker has none of the parent's threads, and must not share its
+        connections.
+        """
+        self._start_executors()
+        self.upstream.after_fork()
+
+    def close(self):
+        """
+        Waits for the routes being computed and the background work to finish, then closes
+        the upstream connections.
+        """
+        # Batches submit to the candidate pool, so they are drained first
+        self.batch_executor.shutdown(wait=True)
+        self.executor.shutdown(wait=True)
+        self._compaction_executor.shutdown(wait=True)
+        self.upstream.close()
 
     def load_api_key(self):
         """
@@ -86,10 +434,19 @@ class WebCrawler(Heatmap):
         return api_key
 
     def api_routing_call(
-        self, origin, destination, waypoints, profile, optimize, heatmap, safety_scores, preferred_coords
+        self,
+        origin,
+        destination,
+        waypoints,
+        profile,
+        optimize,
+        heatmap=None,
+        safety_scores=None,
+        preferred_coords=None,
+        timeout=None,
     ):
         """
-        Makes a routing API call to GraphHopper.
+        Makes a routing API call to GraphHopper, or to the local router if it is enabled.
 
         PARAMETERS
         ----------
@@ -103,91 +460,52 @@ class WebCrawler(Heatmap):
             The routing profile to use (e.g., "foot")
         optimize : str
             Whether to optimize the route (e.g., "false")
-        heatmap : list
-            A list of polygon coordinates to avoid
-        safety_scores :
+        heatmap : list, optional
+            A list of polygon coordinates to avoid (default: the precompiled current heatmap).
+            The local router always uses the current heatmap.
+        safety_scores : list, optional
             A safety score for every polygon in the heatmap
+        preferred_coords : list, optional
+            A list of polygon coordinates to prefer
+        timeout : float, optional
+            Read timeout in seconds for the upstream request (default: read_timeout_s)
 
         RETURNS
         -------
         data : dict
             The route data as a JSON dictionary, or an empty dictionary if an exception occurs
         """
+        if self.local_router is not None:
+            points = [
+                list(map(float, point.split(",")))
+                for point in (origin, *waypoints, destination)
+            ]
+            return self.local_router.route(points, profile, self.snapshot)
+
         try:
-            url = "https://graphhopper.com/api/1/route"
             headers = {"Content-Type": "application/json"}
             params = {"key": self.api_key}
-            data = {
-                "profile": profile,
-                "points": [
-                    origin.split(","),  # Source coordinates
-                    *[wp.split(",") for wp in waypoints],  # waypoints
-                    destination.split(","),  # Target coordinates
-                ],
-                "ch.disable": True,
-                "points_encoded": False,
-                "optimize": optimize,
-                "custom_model": {
-                    "priority": [
-                        {"if": "in_init", "multiply_by": "1"},
-                    ],
-                    "areas": {
-                        "type": "FeatureCollection",
-                        "features": [
-                            {
-                                "type": "Feature",
-                                "id": "init",
-                                "properties": {},
-                                "geometry": {
-                                    "type": "Polygon",
-                                    "coordinates": [
-                                        [
-                                            [9.179079392366791, 48.77928985002192],
-                                            [9.178403533981024, 48.77848548812847],
-                                            [9.180537608035477, 48.77835052681645],
-                                            [9.179079392366791, 48.77928985002192],
-                                        ]
-                                    ],
-                                },
-                            },
-                        ],
-                    },
-                },
-            }
-
-            # Add polygons with lower priority to api call
-            for i, polygon in enumerate(heatmap):
-                feature = {
-                    "type": "Feature",
-                    "id": f"bad{i}",
-                    "properties": {},
-                    "geometry": {"type": "Polygon", "coordinates": [polygon]},
-                }
-                priority = {
-                    "else_if": f"in_bad{i}",
-                    "multiply_by": f"{safety_scores[i]}",
-                }
-                data["custom_model"]["areas"]["features"].append(feature)
-                data["custom_model"]["priority"].append(priority)
-            
-            # Add polygons with higher priority (but no loop this time as this is an inverse operation (it sets the priority of everythin else lower))
-            feature = {
-                "type": "Feature",
-                "id": "good",
-                "properties": {},
-                "geometry": {"type": "Polygon", "coordinates": preferred_coords},
-            }
-            priority = {
-                "if": "!in_good",
-                "multiply_by": "0.5",
-            }
-            data["custom_model"]["areas"]["features"].append(feature)
-            data["custom_model"]["priority"].append(priority)
+            points = [
+                origin.split(","),  # Source coordinates
+                *[wp.split(",") for wp in waypoints],  # waypoints
+                destination.split(","),  # Target coordinates
+            ]
+            if heatmap is None:
+                _, custom_model, variant = self._get_custom_model_entry()
+            else:
+                custom_model = compile_custom_model(
+                    polygon_areas(heatmap, safety_scores), preferred_coords
+                )
+                variant = None
+            data = build_route_request(points, profile, optimize, custom_model)
 
             # Post request
-            response = requests.post(
-                url, json=data, headers=headers, params=params, timeout=10
+            start = time.perf_counter()
+            response = self.upstream.post(
+                "/route", data=data, headers=headers, params=params, timeout=timeout
             )
+            if variant is not None:
+                self._record_routing_latency(variant, time.perf_counter() - start)
             response.raise_for_status()
             ret = response.json()
 
@@ -197,6 +515,339 @@ class WebCrawler(Heatmap):
 
         return ret
 
+    def api_matrix_call(self, from_points, to_points, profile, timeout=None):
+        """
+        Makes a matrix API call to GraphHopper for the route distances between all pairs of
+        points, or to the local router if it is enabled. Routes are weighted with the
+        precompiled custom model of the current heatmap, like route calls.
+
+        PARAMETERS
+        ----------
+        from_points : list
+            The start points as [longitude, latitude] pairs
+        to_points : list
+            The end points as [longitude, latitude] pairs
+        profile : str
+            The routing profile to use (e.g., "foot")
+        timeout : float, optional
+            Read timeout in seconds for the upstream request (default: read_timeout_s)
+
+        RETURNS
+        -------
+        data : dict
+            The "distances" matrix in meters (None for unconnected pairs), or an empty
+            dictionary if an exception occurs
+        """
+        if self.local_router is not None:
+            return self.local_router.matrix(from_points, to_points, self.snapshot)
+
+        try:
+            headers = {"Content-Type": "application/json"}
+            params = {"key": self.api_key}
+            data = build_matrix_request(
+                from_points, to_points, profile, self.get_custom_model()
+            )
+            response = self.upstream.post(
+                "/matrix", data=data, headers=headers, params=params, timeout=timeout
+            )
+            response.raise_for_status()
+            ret = response.json()
+
+        except requests.exceptions.RequestException as e:
+            print(f"An Exception occured: {e}")
+            ret = {}
+
+        return ret
+
+    def get_custom_model(self):
+        """
+        Returns the serialized custom model of the current heatmap data.
+
+        The custom model is compiled once per data version and reused by every routing call.
+        Depending on compaction_mode it is built from the compacted heatmap polygons.
+
+        RETURNS
+        -------
+        bytes
+            The JSON encoded custom model
+        """
+        return self._get_custom_model_entry()[1]
+
+    def _get_custom_model_entry(self):
+        """
+        Returns the (data version, custom model bytes, variant) entry of the current data.
+        """
+        snapshot = self.snapshot
+        entry = self._custom_model
+        if entry[0] == snapshot.version:
+            return entry
+        with self._custom_model_lock:
+            entry = self._custom_model
+            if entry[0] != snapshot.version:
+                if self.compaction_mode == "write":
+                    entry = self.compact_custom_model(snapshot)
+                else:
+                    entry = (
+                        snapshot.version,
+                        compile_custom_model(
+                            polygon_areas(snapshot.heatmap_coords, snapshot.safety_scores),
+                            snapshot.preferred_coords,
+                        ),
+                        "raw",
+                    )
+                self._custom_model = entry
+        return entry
+
+    def get_safety_raster(self, snapshot=None):
+        """
+        Returns the safety raster of the heatmap data.
+
+        The raster is built once and then extended with the polygons added by every new
+        data version, so an edit only rasterizes the new polygon into copies of the grid
+        bands it overlaps.
+
+        PARAMETERS
+        ----------
+        snapshot : GeoSnapshot, optional
+            The heatmap data to rasterize (default: the current snapshot)
+
+        RETURNS
+        -------
+        SafetyRaster
+            The raster of the snapshot
+        """
+        if snapshot is None:
+            snapshot = self.snapshot
+        raster = self._safety_raster
+        if raster is not None and raster.version == snapshot.version:
+            return raster
+        with self._safety_raster_lock:
+            raster = self._safety_raster
+            if raster is not None and raster.version == snapshot.version:
+                return raster
+            if raster is not None and raster.version < snapshot.version:
+                raster = raster.extended(snapshot)
+            else:
+                raster = None
+            if raster is None:
+                raster = SafetyRaster.from_snapshot(
+                    snapshot, self.raster_cell_size, self.raster_max_cells
+                )
+            if self._safety_raster is None or raster.version > self._safety_raster.version:
+                self._safety_raster = raster
+        return raster
+
+    def compact_custom_model(self, snapshot=None):
+        """
+        Compiles the custom model from compacted heatmap polygons.
+
+        The report of the compaction is stored in compaction_report.
+
+        PARAMETERS
+        ----------
+        snapshot : GeoSnapshot, optional
+            The heatmap data to compile (default: the current snapshot)
+
+        RETURNS
+        -------
+        tuple
+            The (data version, custom model bytes, "compacted") entry
+        """
+        if snapshot is None:
+            snapshot = self.snapshot
+        version = snapshot.version
+        heatmap = snapshot.heatmap_coords
+        safety_scores = snapshot.safety_scores
+        preferred_coords = snapshot.preferred_coords
+
+        areas, report = compact_polygons(
+            heatmap,
+            safety_scores,
+            score_step=self.compaction_score_step,
+            tolerance=self.compaction_tolerance,
+            max_areas=self.compaction_max_areas,
+        )
+        custom_model = compile_custom_model(areas, preferred_coords)
+        raw_size = len(
+            compile_custom_model(polygon_areas(heatmap, safety_scores), preferred_coords)
+        )
+        report.update(
+            {
+                "dataVersion": version,
+                "ruleReduction": 1 - report["outputAreas"] / max(1, report["inputAreas"]),
+                "rawCustomModelBytes": raw_size,
+                "customModelBytes": len(custom_model),
+            }
+        )
+        self.compaction_report = report
+        print(
+            f"Heatmap compacted from {report['inputAreas']} to {report['outputAreas']} routing areas"
+        )
+        return (version, custom_model, "compacted")
+
+    def on_data_changed(self):
+        """
+        Compacts the custom model after the heatmap data changed, if compaction is enabled,
+        and updates the edge costs of the local router and the safety raster.
+
+        In "write" mode the compaction runs right away, in "background" mode on a separate
+        thread while routing calls keep using the uncompacted custom model until it is done.
+        """
+        snapshot = self.snapshot
+        if self.local_router is not None:
+            # Weight the road graph ahead of the first route of the new data version
+            self._compaction_executor.submit(self.local_router.prepare, snapshot)
+        if self.scoring_mode == "raster":
+            self._compaction_executor.submit(self.get_safety_raster, snapshot)
+        if self.compaction_mode == "write":
+            entry = self.compact_custom_model(snapshot)
+            with self._custom_model_lock:
+                self._custom_model = entry
+        elif self.compaction_mode == "background":
+            self._compaction_executor.submit(self._compact_in_background, snapshot)
+
+    def _compact_in_background(self, snapshot):
+        """
+        Compacts the custom model and publishes it if the data has not changed meanwhile.
+        """
+        try:
+            entry = self.compact_custom_model(snapshot)
+        except Exception as e:
+            print(f"An Exception occured while compacting the heatmap: {e}")
+            return
+        with self._custom_model_lock:
+            if entry[0] == self.data_version:
+                self._custom_model = entry
+
+    def _record_routing_latency(self, variant, seconds):
+        """
+        Adds the latency of a routing call to the statistics of its custom model variant.
+        """
+        with self._custom_model_lock:
+            calls, total = self._routing_latency.get(variant, (0, 0.0))
+            self._routing_latency[variant] = (calls + 1, total + seconds)
+
+    def get_compaction_report(self):
+        """
+        Returns the report of the last heatmap compaction and the routing latency per variant.
+
+        RETURNS
+        -------
+        dict
+            The compaction mode, the last compaction report, and the number of routing calls
+            and their mean latency in milliseconds for the raw and the compacted custom model
+        """
+        with self._custom_model_lock:
+            latency = {
+                variant: {"calls": calls, "meanMs": 1000 * total / calls}
+                for variant, (calls, total) in self._routing_latency.items()
+            }
+        return {
+            "mode": self.compaction_mode,
+            "lastCompaction": self.compaction_report,
+            "routingLatency": latency,
+        }
+
+    def routing_call(self, origin, destination, waypoints, profile, timeout=None):
+        """
+        Makes a routing API call with the current heatmap data, served from the cache if possible.
+
+        PARAMETERS
+        ----------
+        origin : str
+            The starting location of the route (e.g., "48.783391,9.180221")
+        destination : str
+            The ending location of the route (e.g., "48.779477,9.179306")
+        waypoints : list
+            A list of waypoints to include in the route
+        profile : str
+            The routing profile to use (e.g., "foot")
+        timeout : float, optional
+            Read timeout in seconds for the upstream request (default: read_timeout_s)
+
+        RETURNS
+        -------
+        data : dict
+            The route data as a JSON dictionary, or an empty dictionary if the call failed
+        """
+        key = (
+            self.route_cache_key(origin, destination, profile),
+            tuple(self.snap_coordinates(wp) for wp in waypoints),
+        )
+        route = self.routing_call_cache.get(key)
+        if route is None:
+            route = self.api_routing_call(
+                origin, destination, waypoints, profile, "false", timeout=timeout
+            )
+            # Failed calls are not cached so they are retried on the next request
+            if route.get("paths"):
+                self.routing_call_cache.set(key, route)
+        return route
+
+    def snap_coordinates(self, coordinates):
+        """
+        Rounds a coordinate string to the configured cache precision.
+
+        PARAMETERS
+        ----------
+        coordinates : str
+            A coordinate string (e.g., "48.783391,9.180221")
+
+        RETURNS
+        -------
+        tuple
+            The rounded coordinates
+        """
+        return tuple(
+            round(float(coord), self.coordinate_precision)
+            for coord in coordinates.split(",")
+        )
+
+    def route_cache_key(self, origin, destination, profile):
+        """
+        Returns the cache key of a route for the current heatmap data version.
+
+        PARAMETERS
+        ----------
+        origin : str
+            The starting location of the route (e.g., "48.783391,9.180221")
+        destination : str
+            The ending location of the route (e.g., "48.779477,9.179306")
+        profile : str
+            The routing profile to use (e.g., "foot")
+
+        RETURNS
+        -------
+        tuple
+            The cache key
+        """
+        return (
+            self.snap_coordinates(origin),
+            self.snap_coordinates(destination),
+            profile,
+            self.data_version,
+        )
+
+    def get_cache_stats(self):
+        """
+        Returns the hit and miss counters of the route and suggestion caches.
+
+        RETURNS
+        -------
+        dict
+            The statistics of the route cache, the routing call cache and the suggestion cache
+        """
+        return {
+            "dataVersion": self.data_version,
+            "route": self.route_cache.stats(),
+            "routingCall": self.routing_call_cache.stats(),
+            "suggestion": {
+                **self.suggestion_cache.stats(),
+                "prefixHits": self.suggestion_prefix_hits.value(),
+                "coalesced": self.suggestion_flight.coalesced,
+            },
+        }
+
     def get_suggestions(self, query):
         """
         Returns a list of suggestions based on the specified query.
@@ -213,21 +864,99 @@ class WebCrawler(Heatmap):
 
         Notes:
         -----
-        This method uses GraphHopper's API to fetch suggestions based on the query.
+        This method uses GraphHopper's API to fetch suggestions based on the query. Results are
+        cached by normalized query, answered from a cached shorter prefix where that is safe,
+        and concurrent identical queries share a single upstream request.
+        """
+        query = self.normalize_query(query)
+
+        ret = self.suggestion_cache.get(query)
+        if ret is None:
+            ret = self.suggestions_from_prefix(query)
+            if ret is not None:
+                self.suggestion_prefix_hits.inc()
+        if ret is None:
+            ret = self.suggestion_flight.do(query, self._fetch_suggestions, query)
+        return ret
+
+    def _fetch_suggestions(self, query):
+        """
+        Fetches suggestions for a normalized query from GraphHopper and caches successful results.
         """
         try:
-            url = "https://graphhopper.com/api/1/geocode"
-            params = {"q": query, "key": self.api_key}
+            params = {"q": query, "limit": self.suggestion_limit, "key": self.api_key}
 
-            response = requests.get(url, params=params, timeout=10)
+            response = self.upstream.get("/geocode", params=params)
             response.raise_for_status()
             ret = response.json()
+            self.suggestion_cache.set(query, ret)
         except requests.exceptions.RequestException as e:
             print(f"An Exception occured: {e}")
             ret = {}
 
         return ret
 
+    def normalize_query(self, query):
+        """
+        Normalizes a search query for use as a cache key.
+
+        Parameters:
+        ----------
+        query : str
+            The search query (e.g., "  Königstraße  1")
+
+        Returns:
+        ----------
+        str
+            The lower-cased query with collapsed whitespace (e.g., "königstraße 1")
+        """
+        return " ".join(query.casefold().split())
+
+    def suggestions_from_prefix(self, query):
+        """
+        Answers a query from the cached result of a shorter prefix, if that is safe.
+
+        A cached result is only reused if it holds fewer hits than the requested limit, so it
+        contains every match of the prefix, and if at least one of its hits still matches the
+        longer query. A hit matches if every word of the query starts a word of its name or
+        address.
+
+        Parameters:
+        ----------
+        query : str
+            The normalized search query
+
+        Returns:
+        ----------
+        dict or None
+            The filtered suggestions, or None if no cached prefix can answer the query
+        """
+        words = query.split()
+        for end in range(len(query) - 1, self.suggestion_min_prefix - 1, -1):
+            cached = self.suggestion_cache.peek(query[:end])
+            if cached is None:
+                continue
+            hits = cached.get("hits", [])
+            if len(hits) >= self.suggestion_limit:
+                return None  # Truncated result, the longer query may match other places
+            matching = [hit for hit in hits if self._hit_matches(hit, words)]
+            if not matching:
+                return None
+            return {**cached, "hits": matching}
+        return None
+
+    def _hit_matches(self, hit, words):
+        """
+        Checks whether every query word starts a word of the hit's name or address.
+        """
+        text = " ".join(
+            str(hit[field])
+            for field in ("name", "street", "housenumber", "postcode", "city", "state", "country")
+            if hit.get(field)
+        )
+        hit_words = text.casefold().replace(",", " ").split()
+        return all(any(hw.startswith(word) for hw in hit_words) for word in words)
+
     def get_route(self, origin, destination, profile):
         """
         Crawls the Route through GraphHopper's API and returns the route data as json.
@@ -249,42 +978,134 @@ class WebCrawler(Heatmap):
         Notes:
         -----
         This method first makes an initial API call to get the route, then finds nearby safe places and adds them as waypoints to the route.
+        See iter_route for a variant that returns the initial route before the safe places are evaluated.
         """
 
-        initial_route = self.api_routing_call(
-            origin,
-            destination,
-            [],
-            profile,
-            "false",
-            self.heatmap_coords,
-            self.safety_scores,
-            self.preferred_coords,
+        route = None
+        for _, route in self.iter_route(origin, destination, profile):
+            pass
+        return route
+
+    def iter_route(self, origin, destination, profile):
+        """
+        Computes a route in stages and yields every stage as soon as it is ready.
+
+        The initial route only takes a single routing call and is yielded right away. The
+        final route through nearby safe places follows once the candidates are evaluated. A
+        cached final route is yielded directly.
+
+        Parameters:
+        ----------
+        origin : str
+            The starting location of the route (e.g., "48.783391,9.180221")
+        destination : str
+            The ending location of the route (e.g., "48.779477,9.179306")
+        profile : str
+            The routing profile to use (e.g., "foot")
+
+        Yields:
+        ----------
+        tuple
+            ("initial", route data) and then ("final", route data). Nothing is yielded if no
+            route was found.
+        """
+        key = self.route_cache_key(origin, destination, profile)
+        cached_route = self.route_cache.get(key)
+        if cached_route is not None:
+            yield "final", cached_route
+            return
+
+        with self.metrics.span("initial_route"):
+            initial_route = self.routing_call(origin, destination, [], profile)
+        if not initial_route.get("paths"):
+            return
+        yield "initial", initial_route
+
+        waypoints = self.find_nearby_safe_places(
+            origin, destination, profile, initial_route
         )
 
-        if "paths" in initial_route and initial_route["paths"]:
-            waypoints = self.find_nearby_safe_places(
-                origin, destination, profile, initial_route
+        print("Waypoint added to route:", waypoints)
+        final_route = {}
+
+        if waypoints:
+            with self.metrics.span("final_route"):
+                final_route = self.routing_call(
+                    origin, destination, waypoints, profile
+                )
+        else:
+            final_route = initial_route
+
+        if final_route.get("paths"):
+            self.route_cache.set(key, final_route)
+        yield "final", final_route
+
+    def get_routes(self, route_requests):
+        """
+        Computes many routes concurrently and yields every result as soon as it is ready.
+
+        The routes share the caches and the pooled upstream connections of single route
+        requests, and identical requests within the batch are only computed once. Closing
+        the generator early cancels the routes that have not been started yet.
+
+        Parameters:
+        ----------
+        route_requests : list
+            (origin, destination, profile) tuples (e.g., [("9.180221,48.783391", "9.179306,48.779477", "foot")])
+
+        Returns:
+        ----------
+        generator
+            Yields (index of the request, route data or None, exception or None) tuples in
+            the order the routes finish. Malformed requests yield their ValueError.
+
+        Raises:
+        ----------
+        ValueError
+            If the batch holds more than max_batch_size routes.
+        """
+        if len(route_requests) > self.max_batch_size:
+            raise ValueError(
+                f"Batch of {len(route_requests)} routes exceeds the limit of {self.max_batch_size}"
             )
 
-            print("Waypoint added to route:", waypoints)
-            final_route = {}
+        futures = {}
+        for index, (origin, destination, profile) in enumerate(route_requests):
+            future = submit_with_context(
+                self.batch_executor, self._get_batch_route, origin, destination, profile
+            )
+            futures[future] = index
+        return self._iter_completed_routes(futures)
 
-            if waypoints:
-                final_route = self.api_routing_call(
-                    origin,
-                    destination,
-                    waypoints,
-                    profile,
-                    "false",
-                    self.heatmap_coords,
-                    self.safety_scores,
-                    self.preferred_coords,
-                )
-            else:
-                final_route = initial_route
+    def _get_batch_route(self, origin, destination, profile):
+        """
+        Computes one route of a batch. Its request is validated here, so a malformed one
+        only fails its own result.
+        """
+        if not isinstance(origin, str) or not isinstance(destination, str):
+            raise ValueError("origin and destination must be coordinate strings")
+        return self.route_flight.do(
+            self.route_cache_key(origin, destination, profile),
+            self.get_route,
+            origin,
+            destination,
+            profile,
+        )
 
-            return final_route
+    def _iter_completed_routes(self, futures):
+        """
+        Yields the results of batch route futures as they finish and cancels the rest if
+        the generator is closed early.
+        """
+        try:
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result(), None
+                except Exception as e:
+                    yield futures[future], None, e
+        finally:
+            for future in futures:
+                future.cancel()
 
     def find_nearby_safe_places(
         self,
@@ -295,6 +1116,7 @@ class WebCrawler(Heatmap):
         additional_percent=0.2,
         buffer_distance_km=0.5,
         ignore_range_km=0.2,
+        mode=None,
     ):
         """
         Find nearby safe places along a route.
@@ -315,6 +1137,8 @@ class WebCrawler(Heatmap):
             Distance in kilometers to buffer around the route for preselecting safe places (default: 0.5)
         ignore_range_km : float, optional
             Distance in kilometers to ignore around the start and end points (default: 0.2)
+        mode : str, optional
+            How candidates are evaluated, "routes", "matrix" or "multi" (default: detour_mode)
 
         Returns:
         ----------
@@ -328,25 +1152,27 @@ class WebCrawler(Heatmap):
         coordinates = route_data["points"]["coordinates"]
         route_line = LineString(coordinates)
 
-        # Define a buffer distance in degrees (approximate conversion from km)
-        buffer_distance_degrees = buffer_distance_km / 111.32  # 1 degree ≈ 111.32 km
-
-        # Create a buffer around the route
-        route_buffer = route_line.buffer(buffer_distance_degrees)
-
         # Initialize variables
         total_distance = route_data["distance"]
-        safeplace_distances = []
         waypoints = []
 
-        # Filter safe places within the buffer
-        for safeplace in self.safe_place_coords:
-            safeplace_point = Point(safeplace)
-            if route_buffer.contains(safeplace_point):
+        with self.metrics.span("safe_place_filter"):
+            # Define a buffer distance in degrees (approximate conversion from km)
+            buffer_distance_degrees = buffer_distance_km / 111.32  # 1 degree ≈ 111.32 km
+
+            # Create a buffer around the route
+            route_buffer = route_line.buffer(buffer_distance_degrees)
+
+            start_coords = tuple(map(float, origin.split(",")[::-1]))
+            end_coords = tuple(map(float, destination.split(",")[::-1]))
+
+            # Filter safe places within the buffer
+            candidates = []
+            snapshot = self.snapshot
+            for index in snapshot.safe_place_index.query(route_buffer, predicate="contains"):
+                safeplace = snapshot.safe_places[index].tolist()
 
                 # Check if the safe place is within the ignore range of start or end points
-                start_coords = tuple(map(float, origin.split(",")[::-1]))
-                end_coords = tuple(map(float, destination.split(",")[::-1]))
                 safeplace_coords = tuple(safeplace)[::-1]
 
                 if (
@@ -355,24 +1181,33 @@ class WebCrawler(Heatmap):
                 ):
                     continue  # skip this safe place if it's within the ignore range
 
-                safeplace_str = ",".join(map(str, safeplace))
-                route_with_safeplace = self.api_routing_call(
-                    origin,
-                    destination,
-                    [safeplace_str],
-                    profile,
-                    "false",
-                    self.heatmap_coords,
-                    self.safety_scores,
-                    self.preferred_coords,
-                )
-                if (
-                    route_with_safeplace["paths"][0]["distance"]
-                    <= (1 + additional_percent) * total_distance
-                ):
-                    # Calculate the heuristic value for this safe place
-                    heuristic_value = self.calculate_heuristic(route_with_safeplace)
-                    safeplace_distances.append([heuristic_value, safeplace])
+                candidates.append(safeplace)
+
+        with self.metrics.span("candidate_ranking"):
+            candidates = self.rank_safe_place_candidates(route_line, candidates)
+        if not candidates:
+            return []
+
+        max_distance = (1 + additional_percent) * total_distance
+        deadline = time.monotonic() + self.candidate_deadline_s
+        mode = mode or self.detour_mode
+        if mode == "multi":
+            tour = self.plan_safe_place_tour(
+                origin, destination, profile, candidates, max_distance, deadline
+            )
+            if tour is not None:
+                return tour
+            # Without a tour, fall back to the single safe place of the "routes" mode
+
+        safeplace_distances = None
+        if mode == "matrix":
+            safeplace_distances = self.evaluate_safe_place_candidates_matrix(
+                origin, destination, profile, candidates, max_distance, deadline
+            )
+        if safeplace_distances is None:
+            safeplace_distances = self.evaluate_safe_place_candidates(
+                origin, destination, profile, candidates, max_distance, deadline
+            )
 
         if not safeplace_distances:
             return []  # or some other default value indicating no safe places found
@@ -382,75 +1217,305 @@ class WebCrawler(Heatmap):
         waypoints.append(nearest_safeplace)
         return waypoints
 
-    def calculate_heuristic(self, route):
+    def rank_safe_place_candidates(self, route_line, candidates):
         """
-        Calculate a heuristic value for a route based on its length and safety score.
+        Pre-ranks safe place candidates by their estimated detour and keeps the best ones.
 
-        Args:
-        - route_data (dict): Route data as a JSON object
+        The estimate is the out-and-back distance between a candidate and its projection
+        onto the route, so only the most promising candidates are routed upstream. In
+        "raster" scoring mode the weighted badness of that straight detour is added, so
+        candidates behind unsafe areas rank lower.
+
+        Parameters:
+        ----------
+        route_line : shapely.geometry.LineString
+            The initial route
+        candidates : list
+            Safe place coordinates (e.g., [[9.180221, 48.783391]])
 
         Returns:
-        - float: Heuristic value
+        ----------
+        list
+            At most max_candidates safe places, ordered by estimated detour
+        """
+        if self.scoring_mode == "raster" and candidates:
+            detours, projections = estimate_detour_m(
+                route_line, candidates, return_projections=True
+            )
+            badness, _ = self.get_safety_raster().segment_exposure(projections, candidates)
+            detours = detours + self.badness_weight * 2 * badness
+        else:
+            detours = estimate_detour_m(route_line, candidates)
+        ranking = sorted(range(len(candidates)), key=lambda i: detours[i])
+        return [candidates[i] for i in ranking[: self.max_candidates]]
+
+    def evaluate_safe_place_candidates(
+        self, origin, destination, profile, candidates, max_distance, deadline
+    ):
         """
+        Evaluates detour routes for safe place candidates concurrently.
 
-        route_data = route["paths"][0]
+        Every candidate is routed as a waypoint on the shared worker pool, so a request
+        costs roughly one upstream round-trip instead of one per candidate. Candidates
+        that have not finished when the deadline is hit are cancelled and ignored, and
+        candidates whose evaluation raised are dropped.
 
-        # Calculate the total distance of the route
-        total_distance = route_data["distance"]
+        Parameters:
+        ----------
+        origin : str
+            Starting point coordinates as a string (e.g., "48.783391,9.180221")
+        destination : str
+            Destination coordinates as a string (e.g., "48.783391,9.180221")
+        profile : str
+            Routing profile (e.g., "car", "bike", "foot")
+        candidates : list
+            Safe place coordinates to evaluate (e.g., [[9.180221, 48.783391]])
+        max_distance : float
+            Maximum allowed distance in meters of a route through a candidate
+        deadline : float
+            Point in time (as returned by time.monotonic()) after which evaluation stops
+
+        Returns:
+        ----------
+        list
+            Pairs of [heuristic value, safe place] for every feasible candidate
+        """
+        futures = {}
+        for safeplace in candidates:
+            future = submit_with_context(
+                self.executor,
+                self._evaluate_safe_place_candidate,
+                origin,
+                destination,
+                profile,
+                safeplace,
+                max_distance,
+                deadline,
+            )
+            futures[future] = safeplace
 
-        # Initialize the badness score
-        badness_score = 0
+        done, not_done = wait(futures, timeout=max(0.0, deadline - time.monotonic()))
 
-        # Iterate over the route segments
-        for i in range(len(route_data["points"]["coordinates"]) - 1):
-            segment_start = route_data["points"]["coordinates"][i]
-            segment_end = route_data["points"]["coordinates"][i + 1]
+        # Cancel stragglers; running calls end at the latest with their timeout
+        for future in not_done:
+            future.cancel()
+        if not_done:
+            print(
+                f"Candidate deadline hit: {len(not_done)} of {len(futures)} safe places not evaluated"
+            )
 
-            # Check if the segment passes through any polygon areas with low safety scores
-            for polygon, safety_score in zip(self.heatmap_coords, self.safety_scores):
-                if self.is_segment_in_polygon(segment_start, segment_end, polygon):
-                    badness_score += (1 - safety_score) * self.segment_length(
-                        segment_start, segment_end
-                    )
+        safeplace_distances = []
+        for future in done:
+            try:
+                heuristic_value = future.result()
+            except Exception as e:
+                # One failing candidate must not fail the whole detour search
+                print(f"Dropping safe place candidate {futures[future]}: {e}")
+                continue
+            if heuristic_value is not None:
+                safeplace_distances.append([heuristic_value, futures[future]])
+        return safeplace_distances
+
+    def evaluate_safe_place_candidates_matrix(
+        self, origin, destination, profile, candidates, max_distance, deadline
+    ):
+        """
+        Evaluates the detour distances of safe place candidates with a single matrix call.
 
-        # Calculate the heuristic value as a weighted sum of the total distance and badness score
-        heuristic_value = total_distance + badness_score
-        # maybe add a weight value =! 1 for badness_score
+        The matrix holds the distances from the origin to every candidate and from every
+        candidate to the destination, so the distance of the route through a candidate is
+        known without routing it. Only the chosen candidate is routed afterwards.
 
-        return heuristic_value
+        Parameters:
+        ----------
+        origin : str
+            Starting point coordinates as a string (e.g., "48.783391,9.180221")
+        destination : str
+            Destination coordinates as a string (e.g., "48.783391,9.180221")
+        profile : str
+            Routing profile (e.g., "car", "bike", "foot")
+        candidates : list
+            Safe place coordinates to evaluate (e.g., [[9.180221, 48.783391]])
+        max_distance : float
+            Maximum allowed distance in meters of a route through a candidate
+        deadline : float
+            Point in time (as returned by time.monotonic()) after which evaluation stops
 
-    def is_segment_in_polygon(self, segment_start, segment_end, polygon):
+        Returns:
+        ----------
+        list or None
+            Pairs of [route distance, safe place] for every feasible candidate, or None if
+            the matrix call failed
         """
-        Check if a segment is inside a polygon.
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
 
-        Args:
-        - segment_start (list of long and lat): Start point of the segment
-        - segment_end (list of long and lat): End point of the segment
-        - polygon (list): Polygon coordinates
+        origin_point = list(map(float, origin.split(",")))
+        destination_point = list(map(float, destination.split(",")))
+        with self.metrics.span("candidate_matrix"):
+            matrix = self.api_matrix_call(
+                [origin_point, *candidates],
+                [*candidates, destination_point],
+                profile,
+                timeout=min(self.upstream.read_timeout_s, remaining),
+            )
+        distances = matrix.get("distances")
+        if not distances:
+            print("Matrix call failed, routing every safe place candidate instead")
+            return None
+
+        safeplace_distances = []
+        for i, safeplace in enumerate(candidates):
+            to_safeplace = distances[0][i]
+            from_safeplace = distances[i + 1][len(candidates)]
+            if to_safeplace is None or from_safeplace is None:
+                continue  # not connected
+            distance = to_safeplace + from_safeplace
+            if distance <= max_distance:
+                safeplace_distances.append([distance, safeplace])
+        return safeplace_distances
+
+    def plan_safe_place_tour(
+        self, origin, destination, profile, candidates, max_distance, deadline
+    ):
+        """
+        Plans a route through several safe places within the detour budget.
+
+        One matrix call returns the distances between all pairs of origin, candidates and
+        destination. A beam search (see services.tour.beam_search_tour) then orders as many
+        candidates as possible into a tour within max_distance. The best tours are routed
+        until one is confirmed to stay within max_distance. Together with the matrix call
+        at most max_tour_calls upstream calls are made, and none after the deadline.
+
+        Parameters:
+        ----------
+        origin : str
+            Starting point coordinates as a string (e.g., "48.783391,9.180221")
+        destination : str
+            Destination coordinates as a string (e.g., "48.783391,9.180221")
+        profile : str
+            Routing profile (e.g., "car", "bike", "foot")
+        candidates : list
+            Safe place coordinates to choose from (e.g., [[9.180221, 48.783391]])
+        max_distance : float
+            Maximum allowed distance in meters of the route through the safe places
+        deadline : float
+            Point in time (as returned by time.monotonic()) after which planning stops
 
         Returns:
-        - bool: True if the segment is inside the polygon, False otherwise
+        ----------
+        list or None
+            The safe places to pass as coordinate strings in visiting order (empty if no
+            tour was confirmed), or None if the matrix call failed
+        """
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+
+        points = [
+            list(map(float, origin.split(","))),
+            *candidates,
+            list(map(float, destination.split(","))),
+        ]
+        with self.metrics.span("tour_matrix"):
+            matrix = self.api_matrix_call(
+                points, points, profile, timeout=min(self.upstream.read_timeout_s, remaining)
+            )
+        calls = 1
+        distances = matrix.get("distances")
+        if not distances:
+            print("Matrix call failed, routing every safe place candidate instead")
+            return None
+
+        with self.metrics.span("tour_search"):
+            tours = beam_search_tour(
+                distances, max_distance, self.max_waypoints, self.tour_beam_width, deadline
+            )
+        for stops, _ in tours:
+            remaining = deadline - time.monotonic()
+            if calls >= self.max_tour_calls or remaining <= 0:
+                break
+            waypoints = [",".join(map(str, candidates[stop - 1])) for stop in stops]
+            with self.metrics.span("tour_route"):
+                route = self.routing_call(
+                    origin,
+                    destination,
+                    waypoints,
+                    profile,
+                    timeout=min(self.upstream.read_timeout_s, remaining),
+                )
+            calls += 1
+            # The matrix distances are checked against the actual route
+            if route.get("paths") and route["paths"][0]["distance"] <= max_distance:
+                return waypoints
+        return []
+
+    def _evaluate_safe_place_candidate(
+        self, origin, destination, profile, safeplace, max_distance, deadline
+    ):
+        """
+        Routes through a single safe place and returns its heuristic value, or None if the
+        detour is too long, the upstream call failed or the deadline has passed.
         """
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+
+        safeplace_str = ",".join(map(str, safeplace))
+        with self.metrics.span("candidate_route"):
+            route_with_safeplace = self.routing_call(
+                origin,
+                destination,
+                [safeplace_str],
+                profile,
+                timeout=min(self.upstream.read_timeout_s, remaining),
+            )
+        if not route_with_safeplace.get("paths"):
+            return None
+        if route_with_safeplace["paths"][0]["distance"] > max_distance:
+            return None
 
-        # Create a LineString object from the segment
-        line = LineString([segment_start, segment_end])
+        # Calculate the heuristic value for this safe place
+        return self.calculate_heuristic(route_with_safeplace)
 
-        # Create a Polygon object from the polygon coordinates
-        poly = Polygon(polygon)
+    def calculate_heuristic(self, route):
+        """
+        Calculate a heuristic value for a route based on its length and safety score.
 
-        # Check if the LineString intersects with the Polygon
-        return poly.intersects(line)
+        Args:
+        - route_data (dict): Route data as a JSON object
 
-    def segment_length(self, segment_start, segment_end):
+        Returns:
+        - float: Heuristic value, the route distance plus the weighted badness in meters
+        """
+        with self.metrics.span("heuristic"):
+            if self.scoring_mode == "raster":
+                return score_route_raster(
+                    route["paths"][0], self.get_safety_raster(), self.badness_weight
+                )["heuristic"]
+            return self.score_route(route)["heuristic"]
+
+    def score_route(self, route):
         """
-        Calculate the length of a segment.
+        Score a route against the heatmap.
 
         Args:
-        - segment_start (tuple): Start point of the segment
-        - segment_end (tuple): End point of the segment
+        - route (dict): Route data as a JSON object
 
         Returns:
-        - float: Length of the segment
+        - dict: Distance, badness and heuristic value in meters and a per-polygon breakdown
+          (see services.scoring.score_route)
+
+        Notes:
+        - Only the part of the route inside a polygon counts towards its badness, measured
+          in meters like the route distance. Earlier versions added the full length of every
+          touching segment in kilometers, which made the badness negligible.
         """
-        # Calculate the distance between the two points using the geodesic distance
-        return geodesic(segment_start, segment_end).km
+        snapshot = self.snapshot
+        return score_route(
+            route["paths"][0],
+            snapshot.heatmap_index,
+            snapshot.heatmap_scores,
+            self.badness_weight,
+        )
@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server"))
+
+from services.geostore import GeoStore  # noqa: E402
+
+# A self-intersecting "bowtie" ring, as users can draw it
+BOWTIE = [[9.18, 48.78], [9.19, 48.79], [9.19, 48.78], [9.18, 48.79], [9.18, 48.78]]
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    """
+    An empty heatmap data directory.
+    """
+    for name in (
+        "heatmap_coords.csv",
+        "safety_scores.csv",
+        "safe_place_coords.csv",
+        "preferred_coords.csv",
+    ):
+        (tmp_path / name).write_text("")
+    return str(tmp_path)
+
+
+@pytest.fixture
+def store(data_dir):
+    store = GeoStore(data_dir)
+    yield store
+    store.close()
@@ -0,0 +1,79 @@
+import io
+import json
+
+import pytest
+from conftest import BOWTIE
+from services.columnar import UNKNOWN_SAFETY_SCORE
+from services.geojson import GeoJSONError, iter_feature_collection, read_feature_collection
+from services.geostore import GeoStore
+
+SQUARE = [[9.18, 48.78], [9.181, 48.78], [9.181, 48.781], [9.18, 48.781], [9.18, 48.78]]
+
+
+def export(store):
+    return "".join(iter_feature_collection(store.snapshot))
+
+
+def polygons_csv(*rings):
+    return "".join("".join(f"{lon},{lat}\n" for lon, lat in ring) + "\n" for ring in rings)
+
+
+def feature_collection(*features):
+    return io.StringIO(json.dumps({"type": "FeatureCollection", "features": list(features)}))
+
+
+def polygon_feature(ring, properties):
+    return {
+        "type": "Feature",
+        "geometry": {"type": "Polygon", "coordinates": [ring]},
+        "properties": properties,
+    }
+
+
+def test_export_import_round_trip(data_dir, tmp_path):
+    # Two polygons but one score: the second heatmap score and the preferred score are unknown
+    with open(f"{data_dir}/heatmap_coords.csv", "w") as f:
+        f.write(polygons_csv(SQUARE, SQUARE[::-1]))
+    with open(f"{data_dir}/safety_scores.csv", "w") as f:
+        f.write("0.3\n")
+    with open(f"{data_dir}/preferred_coords.csv", "w") as f:
+        f.write(polygons_csv(SQUARE))
+    with open(f"{data_dir}/safe_place_coords.csv", "w") as f:
+        f.write("9.18,48.78\n")
+    source = GeoStore(data_dir)
+    exported = export(source)
+    source.close()
+
+    target_dir = tmp_path / "target"
+    target_dir.mkdir()
+    for name in (
+        "heatmap_coords.csv",
+        "safety_scores.csv",
+        "safe_place_coords.csv",
+        "preferred_coords.csv",
+    ):
+        (target_dir / name).write_text("")
+    target = GeoStore(str(target_dir))
+    target.add_batch(*read_feature_collection(io.StringIO(exported)))
+    assert export(target) == exported
+    scores = target.snapshot.polygons.scores
+    assert scores[0] == 0.3 and scores[1] == UNKNOWN_SAFETY_SCORE
+    target.close()
+
+
+def test_null_score_needs_a_kind():
+    with pytest.raises(GeoJSONError) as error:
+        read_feature_collection(feature_collection(polygon_feature(SQUARE, {"safetyScore": None})))
+    assert error.value.errors[0].startswith("Feature 0:")
+
+
+def test_self_intersecting_ring_is_rejected():
+    with pytest.raises(GeoJSONError) as error:
+        read_feature_collection(
+            feature_collection(
+                polygon_feature(SQUARE, {"safetyScore": 0.5}),
+                polygon_feature(BOWTIE, {"safetyScore": 0.5}),
+            )
+        )
+    assert len(error.value.errors) == 1
+    assert error.value.errors[0].startswith("Feature 1: Invalid Polygon ring: Self-intersection")
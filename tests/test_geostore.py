@@ -0,0 +1,146 @@
+import os
+
+import numpy as np
+import pytest
+from services.geostore import GeoStore
+
+SQUARE = [[9.18, 48.78], [9.181, 48.78], [9.181, 48.781], [9.18, 48.781], [9.18, 48.78]]
+
+
+def counts(store):
+    snapshot = store.snapshot
+    return len(snapshot.polygons), len(snapshot.safe_places)
+
+
+def add_edits(store):
+    store.add_polygon(SQUARE, 0.3)
+    store.add_polygon(SQUARE, 1.5)
+    store.add_safe_place([9.18, 48.78])
+
+
+def reload(store):
+    store.close()
+    return GeoStore(store.data_dir)
+
+
+def test_crash_after_binary_snapshot_does_not_replay_journal(store, monkeypatch):
+    add_edits(store)
+    expected = counts(store)
+
+    def crash(*args, **kwargs):
+        raise RuntimeError("crash")
+
+    monkeypatch.setattr(store.journal, "reset", crash)
+    with pytest.raises(RuntimeError):
+        store.save_snapshot()
+    monkeypatch.undo()
+
+    reloaded = reload(store)
+    assert counts(reloaded) == expected
+    # Edits after the recovery are journaled and replayed once
+    reloaded.add_safe_place([9.19, 48.79])
+    again = reload(reloaded)
+    assert counts(again) == (expected[0], expected[1] + 1)
+    again.close()
+
+
+def test_crash_between_csv_files_loads_consistent_data(store, monkeypatch):
+    add_edits(store)
+    store.save_snapshot()
+    store.add_polygon(SQUARE, 0.6)
+    expected = counts(store)
+
+    written = []
+    atomic_writer = store._atomic_writer
+
+    def crash_after_first_file(path):
+        if written:
+            raise RuntimeError("crash")
+        written.append(path)
+        return atomic_writer(path)
+
+    monkeypatch.setattr(store, "_atomic_writer", crash_after_first_file)
+    with pytest.raises(RuntimeError):
+        store.save_snapshot()
+    monkeypatch.undo()
+
+    reloaded = reload(store)
+    assert counts(reloaded) == expected
+    assert not np.isnan(reloaded.snapshot.heatmap_scores).any()
+    assert not os.path.exists(reloaded.pending_snapshot_path)
+
+    # The CSV files were written again and match the binary snapshot
+    reloaded.close()
+    os.remove(reloaded.binary_snapshot_path)
+    from_csv = GeoStore(store.data_dir)
+    assert counts(from_csv) == expected
+    from_csv.close()
+
+
+def test_journal_without_generation_is_upgraded(store):
+    add_edits(store)
+    expected = counts(store)
+    store.close()
+    with open(store.journal.path, encoding="utf-8") as file:
+        lines = file.readlines()
+    with open(store.journal.path, mode="w", encoding="utf-8") as file:
+        file.writelines(lines[1:])
+
+    reloaded = GeoStore(store.data_dir)
+    assert counts(reloaded) == expected
+    assert reloaded.journal.read_generation() is not None
+    reloaded.close()
+
+
+def test_saved_csv_files_are_not_replayed_again(data_dir):
+    from services.heatmap import Heatmap
+
+    heatmap = Heatmap(data_dir)
+    heatmap.add_and_save_new_polygon(SQUARE, 0.3)
+    heatmap.save_data_to_csv()
+    heatmap.store.close()
+
+    reloaded = Heatmap(data_dir)
+    assert len(reloaded.snapshot.polygons) == 1
+    reloaded.store.close()
+
+
+@pytest.mark.parametrize(
+    "polygon, safety_score",
+    [
+        (SQUARE, None),
+        (SQUARE, "unsafe"),
+        (SQUARE, float("nan")),
+        ([[9.18, 48.78], [9.181], [9.181, 48.781], [9.18, 48.78]], 0.3),
+        ([], 0.3),
+    ],
+)
+def test_rejected_edit_leaves_the_journal_unchanged(store, polygon, safety_score):
+    add_edits(store)
+    expected = counts(store)
+    with open(store.journal.path, encoding="utf-8") as file:
+        journal = file.read()
+
+    with pytest.raises(ValueError):
+        store.add_polygon(polygon, safety_score)
+    with pytest.raises(ValueError):
+        store.add_safe_place([9.18])
+
+    with open(store.journal.path, encoding="utf-8") as file:
+        assert file.read() == journal
+    assert counts(store) == expected
+    reloaded = reload(store)
+    assert counts(reloaded) == expected
+    reloaded.close()
+
+
+def test_invalid_journal_records_are_skipped(store):
+    add_edits(store)
+    expected = counts(store)
+    store.close()
+    with open(store.journal.path, mode="a", encoding="utf-8") as file:
+        file.write('{"op": "add_polygon", "polygon": [[9.18, 48.78]], "safetyScore": null}\n')
+
+    reloaded = GeoStore(store.data_dir)
+    assert counts(reloaded) == expected
+    reloaded.close()
@@ -0,0 +1,78 @@
+import json
+
+import main
+import pytest
+
+
+@pytest.fixture
+def client(data_dir):
+    main.create_app(data_dir)
+    yield main.app.test_client()
+    main.shutdown()
+    main.store = main.heatmap = main.crawler = None
+    main.shutting_down = False
+
+
+def test_batch_reports_malformed_items_per_line(client, monkeypatch):
+    monkeypatch.setattr(
+        main.crawler, "get_route", lambda origin, destination, profile: {"paths": []}
+    )
+    response = client.post(
+        "/routes/batch",
+        json=[
+            {"origin": "48.78,9.18", "destination": "48.79,9.19"},
+            {"origin": "48.78,9.18"},
+            "not an item",
+            {"origin": "48.78;9.18", "destination": "48.79,9.19"},
+            {"origin": "48.77,9.17", "destination": "48.79,9.19", "profile": "bike"},
+        ],
+    )
+    assert response.status_code == 200
+    lines = {
+        line["index"]: line for line in map(json.loads, response.get_data(as_text=True).splitlines())
+    }
+    assert sorted(lines) == [0, 1, 2, 3, 4]
+    assert "route" in lines[0] and "route" in lines[4]
+    assert all("error" in lines[index] for index in (1, 2, 3))
+
+
+def test_edits_are_acknowledged_with_the_data_version(client):
+    square = [[9.18, 48.78], [9.181, 48.78], [9.181, 48.781], [9.18, 48.781]]
+    response = client.post(
+        "/add_polygon",
+        query_string={"polygon": json.dumps({"coordinates": square}), "safetyScore": "0.3"},
+    )
+    assert response.get_json() == {"status": "ok", "dataVersion": main.store.snapshot.version}
+
+    response = client.post("/add_safe_place", query_string={"coordinates": "9.18,48.78"})
+    assert response.get_json() == {"status": "ok", "dataVersion": main.store.snapshot.version}
+    assert len(main.store.snapshot.polygons) == 1 and len(main.store.snapshot.safe_places) == 1
+
+
+def strict_json(response):
+    def reject(constant):
+        raise ValueError(f"{constant} is not valid JSON")
+
+    assert response.status_code == 200
+    return json.loads(response.get_data(as_text=True), parse_constant=reject)
+
+
+def test_unknown_scores_are_served_as_strict_json(client):
+    square = [[9.18, 48.78], [9.181, 48.78], [9.181, 48.781], [9.18, 48.781], [9.18, 48.78]]
+    features = [
+        {
+            "type": "Feature",
+            "geometry": {"type": "Polygon", "coordinates": [square]},
+            "properties": {"kind": "heatmap", "safetyScore": score},
+        }
+        for score in (0.3, None)
+    ]
+    response = client.post(
+        "/heatmap/import", json={"type": "FeatureCollection", "features": features}
+    )
+    assert response.status_code == 200
+
+    strict_json(client.get("/heatmap"))
+    tile = strict_json(client.get("/heatmap/tile/10/538/352"))
+    assert sorted(tile["heatmap"]["safetyScores"]) == [0.3, 1.0]
+    strict_json(client.get("/heatmap/export"))
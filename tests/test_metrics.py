@@ -0,0 +1,41 @@
+import os
+
+from services import metrics as metrics_module
+from services.metrics import Metrics
+
+
+def series(text):
+    return [line for line in text.splitlines() if not line.startswith("#")]
+
+
+def test_shared_metrics_are_summed_over_processes(tmp_path, monkeypatch):
+    # share runs once before the workers are forked, and removes the files of earlier runs
+    (tmp_path / "metrics-1.json").write_text("{}")
+    parent = Metrics()
+    parent.share(str(tmp_path))
+    workers = []
+    for pid in (101, 102):
+        worker = Metrics()
+        worker.shared_dir = parent.shared_dir
+        worker.record_upstream("/route", 200, 0.02, 10, 20)
+        monkeypatch.setattr(metrics_module.os, "getpid", lambda pid=pid: pid)
+        worker.close()
+        workers.append(worker)
+    workers[1].record_upstream("/route", 200, 3.0, 10, 20)
+
+    # Whichever worker answers the scrape, it reports the totals of both
+    monkeypatch.setattr(metrics_module.os, "getpid", lambda: 102)
+    lines = series(workers[1].render())
+    assert 'welai_upstream_requests_total{path="/route",status="200"} 3' in lines
+    assert 'welai_upstream_duration_seconds_bucket{path="/route",le="0.025"} 2' in lines
+    assert 'welai_upstream_duration_seconds_count{path="/route"} 3' in lines
+    assert sorted(os.listdir(tmp_path)) == ["metrics-101.json", "metrics-102.json"]
+    monkeypatch.setattr(metrics_module.os, "getpid", lambda: 101)
+    assert series(workers[0].render()) == lines
+
+
+def test_forked_process_starts_from_zero():
+    metrics = Metrics()
+    metrics.record_upstream("/route", 200, 0.02, 10, 20)
+    metrics.after_fork()
+    assert series(metrics.render()) == []
@@ -0,0 +1,38 @@
+import numpy as np
+from conftest import BOWTIE
+from services.raster import SafetyRaster
+
+
+def square(lon, lat, size):
+    return [[lon, lat], [lon + size, lat], [lon + size, lat + size], [lon, lat + size], [lon, lat]]
+
+
+def grid(raster):
+    return np.concatenate(raster.score_bands), np.concatenate(raster.preferred_bands)
+
+
+def test_extended_raster_equals_rebuilt_raster(store):
+    store.add_polygon(square(9.10, 48.70, 0.1), 0.9)
+    raster = SafetyRaster.from_snapshot(store.snapshot)
+    rasters = [raster]
+    for polygon, score in [
+        (square(9.15, 48.75, 0.001), 0.2),
+        (square(9.12, 48.71, 0.02), 1.5),
+        (BOWTIE, 0.4),
+        (square(9.1505, 48.7505, 0.00001), 0.1),  # between cell centers
+        (square(9.11, 48.72, 0.05), 0.5),
+    ]:
+        snapshot = store.add_polygon(polygon, score)
+        raster = raster.extended(snapshot)
+        rasters.append(raster)
+
+    rebuilt = SafetyRaster.from_snapshot(store.snapshot)
+    assert raster.bounds == rebuilt.bounds and raster.shape == rebuilt.shape
+    for extended_array, rebuilt_array in zip(grid(raster), grid(rebuilt)):
+        np.testing.assert_array_equal(extended_array, rebuilt_array)
+
+    # A small edit copies the bands it overlaps and shares all others with the older raster
+    before, after = rasters[0], rasters[1]
+    shared = [a is b for a, b in zip(before.score_bands, after.score_bands)]
+    assert shared.count(False) == 1
+    assert grid(before)[0].min() == np.float32(0.9)  # the older raster is unchanged
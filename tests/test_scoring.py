@@ -0,0 +1,19 @@
+from conftest import BOWTIE
+from services.scoring import score_route
+
+
+def route(coordinates):
+    return {"distance": 1000.0, "points": {"coordinates": coordinates}}
+
+
+def test_score_route_through_bowtie_polygon(store):
+    snapshot = store.add_polygon(BOWTIE, 0.2)
+    # Crosses both lobes of the bowtie and its self-intersection
+    result = score_route(
+        route([[9.179, 48.785], [9.191, 48.785]]),
+        snapshot.heatmap_index,
+        snapshot.safety_scores,
+    )
+    assert len(result["polygons"]) == 1
+    assert result["polygons"][0]["length"] > 0
+    assert result["badness"] > 0
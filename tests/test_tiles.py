@@ -0,0 +1,17 @@
+from conftest import BOWTIE
+from services.tiles import build_tile
+
+SQUARE = [[9.18, 48.78], [9.181, 48.78], [9.181, 48.781], [9.18, 48.781], [9.18, 48.78]]
+
+
+def test_tile_includes_repaired_bowtie(store):
+    store.add_polygon(SQUARE, 0.3)
+    store.add_polygon(BOWTIE, 0.5)
+    tile = build_tile(store.snapshot, 14, 8609, 5641)
+
+    assert tile["heatmap"]["ids"] == [0, 1]
+    square, bowtie = tile["heatmap"]["coordinates"]
+    assert len(square) == 5 and square[0] == [48.78, 9.18]
+    # The bowtie was repaired into its two triangles, drawn as a MultiPolygon
+    assert len(bowtie) == 2
+    assert all(len(part) == 1 and len(part[0]) == 4 for part in bowtie)
@@ -0,0 +1,82 @@
+import time
+
+import pytest
+import requests
+from services.upstream import CircuitBreaker, CircuitOpenError, UpstreamClient
+
+
+class FakeResponse:
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+        self.content = b"{}"
+
+    def close(self):
+        pass
+
+
+class FakeSession:
+    """
+    Answers requests with the outcomes given, raising exceptions and returning responses.
+    """
+
+    def __init__(self, *outcomes, latency_s=0.0):
+        self.outcomes = list(outcomes)
+        self.latency_s = latency_s
+        self.timeouts = []
+
+    def request(self, method, url, params=None, timeout=None, **kwargs):
+        self.timeouts.append(timeout)
+        time.sleep(self.latency_s)
+        outcome = self.outcomes.pop(0) if len(self.outcomes) > 1 else self.outcomes[0]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def client(session, **kwargs):
+    upstream = UpstreamClient("http://upstream", **kwargs)
+    upstream.session = session
+    return upstream
+
+
+def test_failed_probe_releases_half_open_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout_s=0.0)
+    breaker.record_failure()
+    upstream = client(
+        FakeSession(requests.exceptions.ChunkedEncodingError("broken"), FakeResponse()),
+        breaker=breaker,
+        max_retries=0,
+    )
+
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        upstream.get("/route")
+    assert breaker.state == "open"
+
+    # The next probe is let through and closes the breaker
+    assert upstream.get("/route").status_code == 200
+    assert breaker.state == "closed"
+
+
+def test_probe_in_flight_blocks_other_calls():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout_s=0.0)
+    breaker.record_failure()
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        client(FakeSession(FakeResponse()), breaker=breaker).get("/route")
+
+
+def test_retries_stay_within_the_timeout():
+    session = FakeSession(FakeResponse(503), latency_s=0.05)
+    upstream = client(
+        session,
+        max_retries=10,
+        backoff_base_s=0.05,
+        breaker=CircuitBreaker(failure_threshold=100),
+    )
+
+    start = time.monotonic()
+    response = upstream.get("/route", timeout=0.3)
+    assert response.status_code == 503
+    assert time.monotonic() - start < 0.45
+    assert len(session.timeouts) < 11
+    assert all(read <= 0.3 for _, read in session.timeouts)
@@ -0,0 +1,87 @@
+import time
+
+import pytest
+from services.webcrawler import WebCrawler
+
+
+@pytest.fixture
+def crawler(store):
+    crawler = WebCrawler(store.data_dir, api_base_url="http://127.0.0.1:9", store=store)
+    yield crawler
+    crawler.close()
+
+
+def test_failing_candidate_is_dropped(crawler, monkeypatch):
+    def evaluate(origin, destination, profile, safeplace, max_distance, deadline):
+        if safeplace == [9.0, 48.0]:
+            raise RuntimeError("TopologyException: side location conflict")
+        return 1234.0
+
+    monkeypatch.setattr(crawler, "_evaluate_safe_place_candidate", evaluate)
+    result = crawler.evaluate_safe_place_candidates(
+        "48.78,9.18", "48.79,9.19", "foot", [[9.0, 48.0], [9.1, 48.1]], 5000,
+        time.monotonic() + 5,
+    )
+    assert result == [[1234.0, [9.1, 48.1]]]
+
+
+def test_malformed_batch_item_fails_alone(crawler, monkeypatch):
+    monkeypatch.setattr(
+        crawler, "get_route", lambda origin, destination, profile: {"paths": [origin]}
+    )
+    results = {
+        index: (route, error)
+        for index, route, error in crawler.get_routes(
+            [
+                ("48.78,9.18", "48.79,9.19", "foot"),
+                ("not a coordinate", "48.79,9.19", "foot"),
+                (None, "48.79,9.19", "foot"),
+                ("48.77,9.17", "48.79,9.19", "bike"),
+            ]
+        )
+    }
+    assert results[0] == ({"paths": ["48.78,9.18"]}, None)
+    assert results[3] == ({"paths": ["48.77,9.17"]}, None)
+    assert isinstance(results[1][1], ValueError)
+    assert isinstance(results[2][1], ValueError)
+
+
+def test_suggestions_reuse_only_complete_prefix_results(crawler, monkeypatch):
+    fetched = []
+
+    def fetch(query):
+        fetched.append(query)
+        return {"hits": []}
+
+    monkeypatch.setattr(crawler, "_fetch_suggestions", fetch)
+    crawler.suggestion_cache.set("kön", {"hits": [{"name": "Königstraße"}, {"name": "Köln"}]})
+    assert crawler.get_suggestions("König") == {"hits": [{"name": "Königstraße"}]}
+
+    # A full result may have left out places that match the longer query
+    crawler.suggestion_cache.set(
+        "sch", {"hits": [{"name": f"Schule {i}"} for i in range(crawler.suggestion_limit)]}
+    )
+    assert crawler.get_suggestions("Schlossplatz") == {"hits": []}
+    assert fetched == ["schlossplatz"]
+    assert crawler.get_cache_stats()["suggestion"]["prefixHits"] == 1
+
+
+def test_multi_mode_falls_back_when_the_matrix_call_fails(crawler, store, monkeypatch):
+    store.add_safe_place([9.19, 48.781])
+    monkeypatch.setattr(crawler, "api_matrix_call", lambda *args, **kwargs: {})
+    monkeypatch.setattr(
+        crawler,
+        "evaluate_safe_place_candidates",
+        lambda origin, destination, profile, candidates, max_distance, deadline: [
+            [1600.0, candidate] for candidate in candidates
+        ],
+    )
+    route = {
+        "paths": [
+            {"distance": 1500.0, "points": {"coordinates": [[9.18, 48.78], [9.20, 48.78]]}}
+        ]
+    }
+    waypoints = crawler.find_nearby_safe_places(
+        "48.78,9.18", "48.78,9.20", "foot", route, mode="multi"
+    )
+    assert waypoints == ["9.19,48.781"]